@@ -0,0 +1,199 @@
+"""
+Quantization Benchmark - So sánh encoder/decoder TFLite (int8 / float16) với float32
+Báo cáo latency, bộ nhớ và mức độ trùng khớp caption trên tập ảnh mẫu
+
+Ví dụ:
+    python benchmark_quantization.py
+    python benchmark_quantization.py --images ../data/sample_images --modes dynamic_int8 float16
+    python benchmark_quantization.py --method greedy --json report.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+
+# Import config
+sys.path.append(str(Path(__file__).parent))
+from config import LOGGING_CONFIG, QUANTIZATION_CONFIG
+
+logging.basicConfig(
+    level=LOGGING_CONFIG["level"],
+    format=LOGGING_CONFIG["format"]
+)
+logger = logging.getLogger("benchmark_quantization")
+
+
+def current_rss_bytes():
+    """
+    RSS hiện tại của process (Linux /proc), None nếu không đọc được
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def keras_weight_bytes(*models):
+    return sum(w.nbytes for model in models for w in model.get_weights())
+
+
+def token_agreement(reference, candidate):
+    """
+    Tỉ lệ vị trí trùng token giữa hai captions (theo caption dài hơn)
+    """
+    reference, candidate = reference.split(), candidate.split()
+    length = max(len(reference), len(candidate))
+    if length == 0:
+        return 1.0
+    return sum(a == b for a, b in zip(reference, candidate)) / length
+
+
+def run_captions(caption_generator, images, method):
+    """
+    Sinh caption cho từng ảnh (batch size 1, như một request API)
+
+    Returns:
+        tuple: (captions, latencies giây)
+    """
+    captions, latencies = [], []
+    for image in images:
+        start = time.perf_counter()
+        result = caption_generator.generate_caption(image, method=method)
+        latencies.append(time.perf_counter() - start)
+        captions.append(result["caption"])
+    return captions, latencies
+
+
+def summarize(name, captions, latencies, memory_bytes, reference=None):
+    latencies_ms = np.array(latencies) * 1000
+    row = {
+        "variant": name,
+        "latency_mean_ms": round(float(latencies_ms.mean()), 2),
+        "latency_p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "latency_p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+        "model_bytes": memory_bytes,
+    }
+    if reference is not None:
+        row["exact_match"] = round(
+            sum(a == b for a, b in zip(reference, captions)) / len(captions), 4
+        )
+        row["token_agreement"] = round(
+            float(np.mean([token_agreement(a, b) for a, b in zip(reference, captions)])), 4
+        )
+    return row
+
+
+def print_report(rows):
+    baseline = rows[0]
+    header = f"{'variant':<24}{'mean ms':>10}{'p95 ms':>10}{'Δ latency':>11}{'MB':>9}{'Δ memory':>10}{'exact':>8}{'tokens':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        latency_delta = row["latency_mean_ms"] / baseline["latency_mean_ms"] - 1
+        memory_delta = row["model_bytes"] / baseline["model_bytes"] - 1
+        print(
+            f"{row['variant']:<24}{row['latency_mean_ms']:>10.1f}{row['latency_p95_ms']:>10.1f}"
+            f"{latency_delta:>+10.1%}{row['model_bytes'] / 1e6:>9.1f}{memory_delta:>+9.1%}"
+            f"{row.get('exact_match', 1.0):>8.2%}{row.get('token_agreement', 1.0):>8.2%}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark quantized (TFLite) vs float32 inference")
+    parser.add_argument("--images", default=str(QUANTIZATION_CONFIG["calibration_dir"]),
+                        help="Thư mục ảnh mẫu (dùng cho calibration và đánh giá)")
+    parser.add_argument("--limit", type=int, default=QUANTIZATION_CONFIG["calibration_samples"])
+    parser.add_argument("--modes", nargs="+", default=["dynamic_int8", "int8", "float16"],
+                        choices=["dynamic_int8", "int8", "float16"])
+    parser.add_argument("--decoder-mode", choices=["dynamic_int8", "int8", "float16"],
+                        help="Mode riêng cho decoder (mặc định: QUANTIZATION_CONFIG / theo mode)")
+    parser.add_argument("--method", default="beam_search", choices=["beam_search", "greedy"])
+    parser.add_argument("--json", help="Ghi báo cáo ra file JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from src.model_loader import ModelLoader
+    from src.image_processor import get_image_processor
+    from src.caption_generator import CaptionGenerator
+    from src.inference_backend import get_inference_model
+    from src.quantization import TFLiteModel, load_calibration_images, resolve_decoder_mode
+
+    images = load_calibration_images(get_image_processor(), args.images, args.limit)
+    if not images:
+        logger.error(f"No images found in {args.images}")
+        return 1
+
+    loader = ModelLoader()
+    enabled = QUANTIZATION_CONFIG["enabled"]
+    QUANTIZATION_CONFIG["enabled"] = False  # Chỉ load float32; các biến thể được tạo bên dưới
+    try:
+        models = loader.load_all_models()
+    finally:
+        QUANTIZATION_CONFIG["enabled"] = enabled
+
+    def make_generator(encoder, decoder):
+        # Không cache/scheduler: đo thời gian chạy model thuần
+        return CaptionGenerator(encoder, decoder, loader.word_to_idx, loader.idx_to_word, loader.max_length)
+
+    # Float32 baseline
+    baseline = make_generator(get_inference_model(models["encoder"]), get_inference_model(models["decoder"]))
+    run_captions(baseline, images[:1], args.method)  # warmup
+    reference, latencies = run_captions(baseline, images, args.method)
+    rows = [summarize(
+        "float32", reference, latencies,
+        keras_weight_bytes(models["encoder"], models["decoder"])
+    )]
+
+    for mode in args.modes:
+        decoder_mode = resolve_decoder_mode(mode, args.decoder_mode)
+        paths = loader.quantize_models(mode, calibration_images=images, decoder_mode=decoder_mode)
+        rss_before = current_rss_bytes()
+        generator = make_generator(
+            TFLiteModel(paths["encoder"], QUANTIZATION_CONFIG["num_threads"]),
+            TFLiteModel(paths["decoder"], QUANTIZATION_CONFIG["num_threads"])
+        )
+        run_captions(generator, images[:1], args.method)  # warmup
+        rss_after = current_rss_bytes()
+
+        captions, latencies = run_captions(generator, images, args.method)
+        name = mode if decoder_mode == mode else f"{mode}+{decoder_mode}"
+        row = summarize(
+            name, captions, latencies,
+            sum(os.path.getsize(path) for path in paths.values()),
+            reference=reference
+        )
+        if rss_before is not None and rss_after is not None:
+            row["rss_delta_bytes"] = rss_after - rss_before
+        rows.append(row)
+
+    print()
+    print(f"{len(images)} images, method={args.method}")
+    print_report(rows)
+    # Benchmark giữ cả float32 models để so sánh; server với .tflite còn mới chỉ load TFLite
+    print(
+        "MB = weights của từng biến thể (float32: Keras weights, quantized: file .tflite). "
+        "Server quantized (QUANTIZATION_CONFIG[\"skip_float_models\"]) chỉ giữ phần TFLite trong RAM; "
+        "rss_delta_bytes (JSON) đo trong process benchmark vốn đã có float32 models"
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"images": len(images), "method": args.method, "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""
+Bulk Captioning CLI - Sinh caption cho thư mục / glob / manifest, ghi kết quả ra JSONL
+Pipeline: decode + resize song song (prefetch) → CNN encoder theo batch → decoder theo batch
+
+Ví dụ:
+    python caption_cli.py ../data/sample_images -o captions.jsonl
+    python caption_cli.py "/data/catalog/**/*.jpg" -o out.jsonl --method greedy --batch-size 32
+    python caption_cli.py manifest.txt -o out.jsonl --resume
+"""
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import time
+import argparse
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# Import config
+sys.path.append(str(Path(__file__).parent))
+from config import LOGGING_CONFIG, BULK_CAPTION_CONFIG
+
+logging.basicConfig(
+    level=LOGGING_CONFIG["level"],
+    format=LOGGING_CONFIG["format"]
+)
+logger = logging.getLogger("caption_cli")
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+MANIFEST_EXTENSIONS = {".txt", ".jsonl"}
+
+
+def _walk_directory(directory):
+    """
+    Duyệt thư mục đệ quy theo thứ tự tên (ổn định giữa các lần chạy → resume được)
+    """
+    entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            yield from _walk_directory(entry.path)
+        elif Path(entry.name).suffix.lower() in IMAGE_EXTENSIONS:
+            yield Path(entry.path)
+
+
+def _read_manifest(manifest):
+    """
+    Đọc manifest: .txt (mỗi dòng một path) hoặc .jsonl ({"path": ...} hoặc {"image": ...})
+    Path tương đối được tính từ thư mục chứa manifest
+    """
+    base = manifest.parent
+    with open(manifest, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if manifest.suffix == ".jsonl":
+                record = json.loads(line)
+                line = record.get("path") or record.get("image")
+            path = Path(line)
+            yield path if path.is_absolute() else base / path
+
+
+def iter_inputs(sources):
+    """
+    Sinh lần lượt các đường dẫn ảnh từ danh sách nguồn (lazy, không load hết vào bộ nhớ)
+
+    Args:
+        sources: List thư mục, file ảnh, manifest hoặc glob pattern
+    """
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            yield from _walk_directory(path)
+        elif path.is_file() and path.suffix.lower() in MANIFEST_EXTENSIONS:
+            yield from _read_manifest(path)
+        elif path.is_file():
+            yield path
+        else:
+            # glob không đảm bảo thứ tự → sắp xếp để các lần chạy cho cùng thứ tự
+            for match in sorted(glob.iglob(source, recursive=True)):
+                if Path(match).suffix.lower() in IMAGE_EXTENSIONS:
+                    yield Path(match)
+
+
+class PathDigests:
+    """
+    Tập path đã xử lý, lưu dạng digest 16 bytes trong một numpy array đã sắp xếp
+    (~16 bytes mỗi path thay vì cả chuỗi path) → `str(path) in digests` bằng binary search
+    """
+
+    DIGEST_SIZE = 16
+
+    def __init__(self, digests=b""):
+        """
+        Args:
+            digests: Bytes các digest nối liền (xem PathDigests.digest)
+        """
+        self._digests = np.sort(np.frombuffer(digests, dtype=f"S{self.DIGEST_SIZE}"))
+
+    @classmethod
+    def digest(cls, path):
+        return hashlib.blake2b(str(path).encode("utf-8"), digest_size=cls.DIGEST_SIZE).digest()
+
+    def __contains__(self, path):
+        key = np.array(self.digest(path), dtype=self._digests.dtype)
+        position = np.searchsorted(self._digests, key)
+        return position < len(self._digests) and self._digests[position] == key
+
+    def __len__(self):
+        return len(self._digests)
+
+
+def _truncate_partial_line(f, chunk_size=1 << 16):
+    """
+    Cắt dòng cuối ghi dở (crash): tìm newline cuối cùng bằng cách seek lùi từ cuối file
+
+    Returns:
+        int: Kích thước file sau khi cắt
+    """
+    end = f.seek(0, os.SEEK_END)
+    position = end
+    while position > 0:
+        start = max(position - chunk_size, 0)
+        f.seek(start)
+        newline = f.read(position - start).rfind(b"\n")
+        if newline >= 0:
+            complete = start + newline + 1
+            break
+        position = start
+    else:
+        complete = 0
+
+    if complete < end:
+        f.truncate(complete)
+    return complete
+
+
+def prepare_output(output_path, resume):
+    """
+    Chuẩn bị file output và trả về tập các inputs đã xử lý (checkpoint)
+
+    Mỗi input tạo đúng một dòng JSONL có "path", nên tập path trong các dòng
+    hoàn chỉnh là checkpoint - không phụ thuộc thứ tự inputs giữa các lần chạy.
+    Dòng cuối bị ghi dở (crash) sẽ bị cắt bỏ. Output được đọc từng dòng,
+    chỉ giữ digest của mỗi path.
+
+    Returns:
+        PathDigests: Các path đã có trong output
+    """
+    if not resume or not output_path.exists():
+        output_path.write_text("")
+        return PathDigests()
+
+    digests = bytearray()
+    with open(output_path, "rb+") as f:
+        _truncate_partial_line(f)
+        f.seek(0)
+        for line in f:
+            try:
+                digests += PathDigests.digest(json.loads(line)["path"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return PathDigests(digests)
+
+
+def feature_key_for(path):
+    """
+    Feature key theo file (path + size + mtime) → dùng được với feature store
+    mà không cần decode lại ảnh
+    """
+    stat = path.stat()
+    return f"{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class BulkCaptioner:
+    """
+    Pipeline sinh caption hàng loạt với bộ nhớ giới hạn
+
+    - decode workers: mỗi worker decode + resize cả một batch thẳng vào một buffer
+      uint8 (N, H, W, 3), nhiều batch song song, tối đa `prefetch` ảnh chờ
+    - batch: buffer của batch → một lần gọi encoder + decoder chạy chung batch
+    - output: ghi JSONL theo thứ tự input, flush sau mỗi batch (checkpoint)
+    """
+
+    def __init__(self, caption_generator, image_processor, method="beam_search",
+                 batch_size=None, workers=None, prefetch=None):
+        self.caption_generator = caption_generator
+        self.image_processor = image_processor
+        self.method = method
+        self.batch_size = batch_size or BULK_CAPTION_CONFIG["batch_size"]
+        self.workers = workers or BULK_CAPTION_CONFIG["workers"]
+        self.prefetch = max(prefetch or BULK_CAPTION_CONFIG["prefetch"], self.batch_size)
+
+        self.processed = 0
+        self.failed = 0
+
+    def _load_batch(self, paths):
+        """
+        Decode + preprocess một batch ảnh vào một buffer (chạy trong decode worker)
+
+        Returns:
+            tuple: (items, images) - items là list (path, feature key, error, row):
+                row là vị trí của ảnh trong images, None nếu features đã có trong store
+                hoặc bị lỗi; images là buffer uint8 (số ảnh decode được, H, W, 3)
+        """
+        store = self.caption_generator.feature_store
+        items = []
+        to_decode = []  # vị trí trong items của các ảnh cần decode
+        for path in paths:
+            try:
+                key = feature_key_for(path)
+            except Exception as e:
+                items.append((path, None, str(e), None))
+                continue
+            items.append((path, key, None, None))
+            # Features đã có trong store → không cần decode ảnh
+            if store is None or key not in store:
+                to_decode.append(len(items) - 1)
+
+        errors = {}
+        images = self.image_processor.preprocess_batch(
+            [items[i][0] for i in to_decode], errors=errors
+        )
+        row = 0
+        for j, i in enumerate(to_decode):
+            path, key, _, _ = items[i]
+            if j in errors:
+                items[i] = (path, None, str(errors[j]), None)
+            else:
+                items[i] = (path, key, None, row)
+                row += 1
+        return items, images
+
+    def _flush(self, loaded, out):
+        """
+        Chạy encoder + decoder cho một batch và ghi kết quả
+        """
+        items, images = loaded
+        ready = [i for i, item in enumerate(items) if item[2] is None]
+        results = [item[2] for item in items]
+        if ready:
+            if len(images) == len(ready):
+                # Không có ảnh nào lấy features từ store → truyền thẳng buffer
+                batch_images = images
+            else:
+                batch_images = [
+                    None if items[i][3] is None else images[items[i][3]:items[i][3] + 1]
+                    for i in ready
+                ]
+            try:
+                captions = self.caption_generator.generate_captions_batch(
+                    batch_images,
+                    method=self.method,
+                    feature_keys=[items[i][1] for i in ready]
+                )
+                for i, result in zip(ready, captions):
+                    results[i] = result
+            except Exception as e:
+                logger.error(f"Batch failed: {e}")
+                for i in ready:
+                    results[i] = e
+
+        for (path, _, _, _), result in zip(items, results):
+            if isinstance(result, dict):
+                record = {
+                    "path": str(path),
+                    "caption": result["caption"],
+                    "all_captions": result.get("all_captions", []),
+                    "method": result["method"],
+                }
+                self.processed += 1
+            else:
+                record = {"path": str(path), "error": str(result)}
+                self.failed += 1
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        out.flush()
+        os.fsync(out.fileno())
+
+    def run(self, paths, out, done=()):
+        """
+        Chạy pipeline trên iterator các đường dẫn ảnh
+
+        Args:
+            paths: Iterator các Path
+            out: File object (JSONL) đang mở ở chế độ append
+            done: Các path đã có trong output, vd: PathDigests (resume)
+        """
+        start_time = time.time()
+        pending = deque()
+        batch = []
+        # Giới hạn số batch đã decode đang chờ → bộ nhớ không phụ thuộc kích thước corpus
+        max_pending = max(self.prefetch // self.batch_size, 1)
+
+        def drain_one():
+            self._flush(pending.popleft().result(), out)
+            self._log_progress(start_time)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="decode") as pool:
+            for path in paths:
+                if str(path) in done:
+                    continue
+                batch.append(path)
+                if len(batch) < self.batch_size:
+                    continue
+                pending.append(pool.submit(self._load_batch, batch))
+                batch = []
+                while len(pending) >= max_pending:
+                    drain_one()
+
+            if batch:
+                pending.append(pool.submit(self._load_batch, batch))
+            while pending:
+                drain_one()
+
+        self._log_progress(start_time)
+
+    def _log_progress(self, start_time):
+        elapsed = time.time() - start_time
+        done = self.processed + self.failed
+        rate = done / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Processed {done} images ({self.failed} failed) - {rate:.1f} images/s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk image captioning to JSONL")
+    parser.add_argument("inputs", nargs="+", help="Thư mục, file ảnh, glob pattern hoặc manifest (.txt/.jsonl)")
+    parser.add_argument("-o", "--output", required=True, help="File JSONL output")
+    parser.add_argument("--method", default="beam_search", choices=["beam_search", "greedy"])
+    parser.add_argument("--batch-size", type=int, default=BULK_CAPTION_CONFIG["batch_size"])
+    parser.add_argument("--workers", type=int, default=BULK_CAPTION_CONFIG["workers"],
+                        help="Số decode/resize workers (mỗi worker decode một batch)")
+    parser.add_argument("--prefetch", type=int, default=BULK_CAPTION_CONFIG["prefetch"],
+                        help="Số ảnh đã decode tối đa đang chờ encoder")
+    parser.add_argument("--resume", action="store_true",
+                        help="Tiếp tục từ checkpoint (bỏ qua các path đã có trong output)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from src.model_loader import get_model_loader
+    from src.image_processor import get_image_processor
+    from src.caption_generator import get_caption_generator
+
+    output_path = Path(args.output)
+    done = prepare_output(output_path, args.resume)
+    if done:
+        logger.info(f"Resuming: skipping {len(done)} already processed inputs")
+
+    caption_generator = get_caption_generator(get_model_loader())
+    runner = BulkCaptioner(
+        caption_generator,
+        get_image_processor(),
+        method=args.method,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        prefetch=args.prefetch,
+    )
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        runner.run(iter_inputs(args.inputs), out, done=done)
+
+    if caption_generator.feature_store is not None:
+        caption_generator.feature_store.flush()
+
+    logger.info(f"Done: {runner.processed} captioned, {runner.failed} failed → {output_path}")
+    return 0 if runner.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,7 +20,7 @@ MODEL_CONFIG = {
     "lstm_units": 512,  # Matches your Bidirectional LSTM(256) * 2 = 512
     "dropout_rate": 0.5,
     
-    # Vocabulary (will be determined from tokenizer.pkl)
+    # Vocabulary (will be determined from tokenizer.pkl / vocabulary.npz)
     "max_length": 37,  # From model_metadata.json
     "vocab_size": 8781,  # From model_metadata.json
     
@@ -37,15 +37,113 @@ BEAM_SEARCH_CONFIG = {
     "alpha": 0.7,  # Length penalty factor
 }
 
+# Inference backend cho encoder/decoder
+INFERENCE_CONFIG = {
+    "backend": "compiled",  # "keras" (model.predict) hoặc "compiled" (tf.function)
+    "jit_compile": False,   # XLA JIT (chỉ áp dụng cho "compiled" và decode_mode "graph")
+    # "python": vòng lặp giải mã trong Python (decode scheduler gộp được các request)
+    # "graph": cả vòng greedy/beam search trong một tf.while_loop - một lần gọi mỗi batch
+    "decode_mode": "python",
+    # Tách decoder: projection features -> 256 chạy một lần mỗi ảnh,
+    # mỗi bước chỉ chạy nhánh text + merge (ModelLoader.split_decoder)
+    "split_decoder": True,
+}
+
+# Model snapshot (export_snapshot.py): kiến trúc JSON + weights .npy memory-mapped + vocabulary,
+# load nhanh hơn .h5 và không cần mạng (EfficientNetB0 ImageNet weights đã nằm trong snapshot)
+SNAPSHOT_CONFIG = {
+    "enabled": True,  # Load từ snapshot nếu có (snapshot lỗi/cũ → báo lỗi, không fallback); chưa có → MODEL_FILES
+    "dir": MODELS_DIR / "snapshots",
+    "version": None,  # None = version ghi trong snapshots/LATEST
+}
+
+# Quantized inference (TFLite): encoder + decoder chạy bằng interpreter thay cho Keras
+QUANTIZATION_CONFIG = {
+    "enabled": False,
+    "mode": "dynamic_int8",  # "dynamic_int8", "int8" (cần calibration) hoặc "float16"
+    # Mode riêng cho decoder (None = giống "mode", riêng "float16" → "dynamic_int8"
+    # vì converter của TF 2.15 treo khi chuyển LSTM decoder sang float16)
+    "decoder_mode": None,
+    "output_dir": MODELS_DIR / "quantized",  # <output_dir>/<mode>/{encoder,decoder}.tflite
+    "calibration_dir": DATA_DIR / "sample_images",  # Bắt buộc có ảnh khi mode/decoder_mode là "int8"
+    "calibration_samples": 64,
+    "convert_if_missing": True,  # Tự convert khi khởi động nếu chưa có / model nguồn đã đổi
+    # .tflite đã có và còn mới → chỉ load TFLite (không import TensorFlow, không giữ float weights).
+    # Lần khởi động phải convert vẫn giữ float models trong bộ nhớ tới khi restart
+    "skip_float_models": True,
+    "num_threads": None,  # Threads mỗi interpreter (None = mặc định của TFLite)
+    "decoder_batch_size": 4,  # Batch cố định của decoder TFLite (>= beam_width: một bước beam = một lần invoke)
+}
+
+# Decode scheduler: gộp các bước giải mã của mọi request vào chung batch
+DECODE_SCHEDULER_CONFIG = {
+    "enabled": True,
+    "max_batch_size": 64,  # Số hàng (chuỗi/beams) tối đa mỗi lần gọi decoder
+    "max_wait_ms": 2.0,    # Thời gian chờ tối đa để gom thêm request
+}
+
+# Encoder micro-batching: gom ảnh từ nhiều request vào một lần gọi EfficientNetB0
+ENCODER_BATCHER_CONFIG = {
+    "enabled": True,
+    "max_wait_ms": 5.0,  # Cửa sổ thời gian gom ảnh (batch size: PERFORMANCE_CONFIG)
+}
+
+# Executor pools: chạy preprocessing/inference ngoài asyncio event loop
+EXECUTOR_CONFIG = {
+    "preprocess_pool": "thread",  # "thread" hoặc "process"
+    "preprocess_workers": 4,
+    "inference_workers": 4,  # Nhiều threads → decode scheduler gộp được các request
+    "max_pending": 64,  # Quá số này API trả 503 thay vì xếp hàng vô hạn
+}
+
+# Caption result cache (key: hash ảnh + method + beam width + alpha + model version)
+CAPTION_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 4096,
+    "ttl_seconds": None,  # None = không hết hạn
+}
+
+# Encoder feature cache (key: hash ảnh đã preprocess, giới hạn theo bytes)
+FEATURE_CACHE_CONFIG = {
+    "enabled": True,
+    "max_bytes": 64 * 1024 * 1024,  # ~12k vectors float32 (1280,)
+    "ttl_seconds": None,
+}
+
+# Memo phân phối từ tiếp theo của decoder theo (ảnh, prefix): trie token cho mỗi ảnh,
+# mỗi node lưu top-k (word indices + probs) thay vì cả vector vocab
+DECODER_MEMO_CONFIG = {
+    "enabled": True,
+    "top_k": 10,  # >= beam_width; node có ít hơn beam_width từ được coi là miss
+    "max_nodes": 50_000,  # ~25 MB; vượt quá thì evict trie của ảnh ít dùng nhất
+}
+
+# Persistent feature store (memory-mapped, dùng cho corpus lớn / warm restart)
+FEATURE_STORE_CONFIG = {
+    "enabled": False,
+    "path": DATA_DIR / "feature_store",
+    "dtype": "float32",  # "float16" giảm một nửa dung lượng (đọc sẽ phải copy)
+    "initial_capacity": 1024,
+    "writable": True,  # Lưu features mới tính vào store
+}
+
 # Model file paths
 MODEL_FILES = {
     "encoder": MODELS_DIR / "encoder_model.h5",
     "decoder": MODELS_DIR / "best_model_captioning.h5",  # No-mask version (retrained)
     "full_model": MODELS_DIR / "best_model_captioning.h5",
     "tokenizer": MODELS_DIR / "tokenizer.pkl",
+    "vocabulary": MODELS_DIR / "vocabulary.npz",  # Tự convert từ tokenizer.pkl (src/vocabulary.py)
     "feature_extractor": MODELS_DIR / "efficientnet_encoder.h5",
 }
 
+# Bulk captioning CLI (caption_cli.py)
+BULK_CAPTION_CONFIG = {
+    "batch_size": 16,  # Số ảnh mỗi lần gọi encoder/decoder
+    "workers": 4,      # Decode/resize workers
+    "prefetch": 64,    # Số ảnh đã decode tối đa đang chờ trong bộ nhớ
+}
+
 # API configurations
 API_CONFIG = {
     "host": "0.0.0.0",
@@ -55,6 +153,28 @@ API_CONFIG = {
     "version": "1.0.0",
     "allowed_image_types": ["image/jpeg", "image/png", "image/jpg"],
     "max_image_size_mb": 10,
+    "upload_chunk_kb": 64,  # Đọc upload theo chunk, dừng ngay khi vượt max_image_size_mb
+}
+
+# Warmup khi khởi động: chạy ảnh giả qua encoder + greedy/beam search ở từng batch size
+# (trace graph, cấp phát bộ nhớ) trước khi /health/ready trả về 200
+WARMUP_CONFIG = {
+    "enabled": True,
+    "batch_sizes": [1, 4],  # Nên gồm các batch size thường gặp (≤ PERFORMANCE_CONFIG["batch_size"])
+    "methods": ["greedy", "beam_search"],
+}
+
+# Pre-fork server (serve_prefork.py): master import code/modules, fork N workers;
+# mỗi worker load weights riêng (TensorFlow không fork-safe, không map weights từ file)
+# → bộ nhớ ~N lần (weights + runtime TF mỗi worker), trừ file .tflite của quantized inference
+SERVER_CONFIG = {
+    "workers": 0,           # 0 = số CPU cores
+    # Master load TFLite models (bật QUANTIZATION_CONFIG) một lần trước khi fork, workers dùng chung.
+    # False = mỗi worker load một bản float Keras models (RAM tăng ~N lần theo số workers)
+    "share_models": True,
+    "intra_op_threads": 0,  # 0 = cores / workers
+    "inter_op_threads": 1,
+    "pin_cpus": True,       # Gán mỗi worker vào nhóm cores riêng (Linux)
 }
 
 # CORS settings
@@ -70,6 +190,10 @@ PREPROCESSING_CONFIG = {
     # InceptionV3 preprocessing: scale to [-1, 1]
     "normalization_type": "inception",  # or "vgg", "standard"
     "resize_mode": "bilinear",
+    # JPEG: decode thẳng ở độ phân giải giảm (DCT scaling) gần image_size thay vì full-size
+    "jpeg_draft": True,
+    # Giới hạn pixels (width * height) kiểm tra từ header trước khi decode (decompression bomb)
+    "max_image_pixels": 50_000_000,
 }
 
 # Logging
@@ -80,7 +204,7 @@ LOGGING_CONFIG = {
 
 # Performance settings
 PERFORMANCE_CONFIG = {
-    "batch_size": 1,  # For single image inference
+    "batch_size": 8,  # Số ảnh tối đa mỗi lần gọi encoder
     "use_gpu": True,
     "gpu_memory_fraction": 0.8,
 }
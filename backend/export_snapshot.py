@@ -0,0 +1,60 @@
+"""
+Export Model Snapshot - Ghi encoder + decoder + vocabulary thành snapshot versioned
+Chạy một lần trên máy có model files (và mạng nếu encoder dùng ImageNet weights),
+rồi copy thư mục snapshots/ sang các node chạy API (kể cả node không có mạng)
+
+Ví dụ:
+    python export_snapshot.py
+    python export_snapshot.py --version v2 --output-dir /srv/models/snapshots
+"""
+
+import sys
+import argparse
+import logging
+from pathlib import Path
+
+# Import config
+sys.path.append(str(Path(__file__).parent))
+from config import LOGGING_CONFIG, SNAPSHOT_CONFIG, QUANTIZATION_CONFIG
+
+logging.basicConfig(
+    level=LOGGING_CONFIG["level"],
+    format=LOGGING_CONFIG["format"]
+)
+logger = logging.getLogger("export_snapshot")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export a fast-loading, offline model snapshot")
+    parser.add_argument("--output-dir", default=str(SNAPSHOT_CONFIG["dir"]),
+                        help="Thư mục gốc chứa các snapshot versions")
+    parser.add_argument("--version", help="Tên version (mặc định: thời gian hiện tại)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from src.model_loader import ModelLoader
+
+    # Luôn export từ model files gốc (không từ snapshot cũ), không cần quantized models
+    snapshot_enabled, quantization_enabled = SNAPSHOT_CONFIG["enabled"], QUANTIZATION_CONFIG["enabled"]
+    SNAPSHOT_CONFIG["enabled"] = QUANTIZATION_CONFIG["enabled"] = False
+    try:
+        loader = ModelLoader()
+        loader.load_all_models()
+    finally:
+        SNAPSHOT_CONFIG["enabled"], QUANTIZATION_CONFIG["enabled"] = snapshot_enabled, quantization_enabled
+
+    if loader.decoder is None:
+        logger.error("Decoder not loaded - nothing to export")
+        return 1
+
+    directory = loader.export_snapshot(output_dir=args.output_dir, version=args.version)
+    size = sum(path.stat().st_size for path in directory.iterdir())
+    print(f"Snapshot written to {directory} ({size / 1e6:.1f} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
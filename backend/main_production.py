@@ -2,21 +2,26 @@
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import json
 import logging
 import time
+import tempfile
 from pathlib import Path
 import sys
 
 # Import config
 sys.path.append(str(Path(__file__).parent.parent))
-from config import API_CONFIG, CORS_CONFIG, LOGGING_CONFIG
+from config import API_CONFIG, CORS_CONFIG, LOGGING_CONFIG, WARMUP_CONFIG
 
-# Import các modules
+# Import các modules (không import TensorFlow - models load trong background)
 from src.model_loader import get_model_loader
-from src.image_processor import get_image_processor
+from src.image_processor import get_image_processor, read_image_header, check_image_pixels
 from src.caption_generator import get_caption_generator
+from src.executors import get_inference_executor, ExecutorBusyError
+from src.caching import get_caption_cache
 
 # Setup logging
 logging.basicConfig(
@@ -45,6 +50,15 @@ app.add_middleware(
 model_loader = None
 image_processor = None
 caption_generator = None
+inference_executor = None
+caption_cache = None
+
+# Trạng thái khởi động (liveness/readiness probes)
+server_started_at = time.time()
+model_loading_task = None
+startup_error = None
+generator_status = {"status": "pending"}
+warmup_status = {"status": "pending"}
 
 
 # Pydantic models cho request/response
@@ -61,44 +75,105 @@ class CaptionResponse(BaseModel):
     method: str
     inference_time: float
     message: str = ""
+    cached: bool = False
+
+
+def load_models():
+    """
+    Load models + tạo caption generator + warmup (chạy trong background thread)
+    Endpoints caption trả 503 cho đến khi caption_generator sẵn sàng (sau warmup)
+    """
+    global caption_generator, startup_error, generator_status, warmup_status
+    
+    try:
+        # Load models (import TensorFlow, tokenizer, .h5 files)
+        logger.info("Loading models into memory...")
+        model_loader.load_all_models()
+        
+        # Initialize caption generator
+        logger.info("Initializing Caption Generator...")
+        generator_status = {"status": "loading"}
+        start = time.perf_counter()
+        generator = get_caption_generator(model_loader)
+        generator_status = {"status": "ready", "seconds": round(time.perf_counter() - start, 3)}
+        
+        # Warmup: trace graph + cấp phát bộ nhớ trước request thật đầu tiên.
+        # Lỗi warmup chỉ làm request đầu chậm hơn → vẫn đưa server vào trạng thái ready
+        if WARMUP_CONFIG["enabled"]:
+            logger.info(f"Warming up (batch sizes {WARMUP_CONFIG['batch_sizes']})...")
+            warmup_status = {"status": "loading"}
+            start = time.perf_counter()
+            try:
+                timings = generator.warmup()
+                warmup_status = {
+                    "status": "ready",
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "timings": {f"batch_{size}": timing for size, timing in timings.items()}
+                }
+            except Exception as e:
+                logger.warning(f"Warmup failed: {e}")
+                warmup_status = {"status": "failed", "error": str(e)}
+        else:
+            warmup_status = {"status": "skipped", "reason": "disabled in WARMUP_CONFIG"}
+        
+        caption_generator = generator
+        
+        logger.info("=" * 70)
+        logger.info(f"✓ SERVER READY - All models loaded in {time.time() - server_started_at:.1f}s")
+        logger.info("=" * 70)
+        
+    except Exception as e:
+        startup_error = str(e)
+        if generator_status["status"] == "loading":
+            generator_status = {"status": "failed", "error": startup_error}
+        logger.error(f"Error loading models: {e}")
+        logger.error("Server keeps running but models are not available")
 
 
-# Startup event - Load models vào bộ nhớ
+# Startup event - Server listen ngay, models load trong background
 @app.on_event("startup")
 async def startup_event():
     """
-    Load tất cả models vào bộ nhớ khi khởi động server
-    Giảm thiểu độ trễ inference
+    Khởi tạo các thành phần nhẹ rồi load models trong background:
+    server nhận request (/health/live, /health/ready) ngay lập tức
     """
-    global model_loader, image_processor, caption_generator
+    global model_loader, image_processor, inference_executor, caption_cache, model_loading_task
     
     logger.info("=" * 70)
     logger.info("STARTING IMAGE CAPTIONING API SERVER")
     logger.info("=" * 70)
     
     try:
+        # Initialize executor pools (preprocessing + inference ngoài event loop)
+        inference_executor = get_inference_executor()
+        
+        # Initialize caption result cache
+        caption_cache = get_caption_cache()
+        
         # Initialize image processor
         logger.info("Initializing Image Processor...")
         image_processor = get_image_processor()
         
-        # Load models
-        logger.info("Loading models into memory...")
-        model_loader = get_model_loader()
+        # ModelLoader chưa load gì: tiến trình load xem qua /health/ready
+        model_loader = get_model_loader(load=False)
+        model_loading_task = asyncio.get_running_loop().run_in_executor(None, load_models)
         
-        # Initialize caption generator
-        logger.info("Initializing Caption Generator...")
-        caption_generator = get_caption_generator(model_loader)
-        
-        logger.info("=" * 70)
-        logger.info("✓ SERVER READY - All models loaded successfully!")
-        logger.info(f"✓ API running at http://{API_CONFIG['host']}:{API_CONFIG['port']}")
-        logger.info("=" * 70)
+        logger.info(f"✓ API running at http://{API_CONFIG['host']}:{API_CONFIG['port']} (models loading)")
         
     except Exception as e:
         logger.error(f"Error during startup: {e}")
         logger.error("Server will start but models may not be available")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Đóng executor pools khi tắt server
+    """
+    if inference_executor is not None:
+        inference_executor.shutdown(wait=False)
+
+
 # Routes
 @app.get("/", response_model=HealthResponse)
 async def root():
@@ -108,7 +183,7 @@ async def root():
     return {
         "status": "online",
         "message": "Image Captioning API - LSTM-CNN Model",
-        "models_loaded": model_loader is not None
+        "models_loaded": caption_generator is not None
     }
 
 
@@ -123,17 +198,165 @@ async def health_check():
         caption_generator is not None
     ])
     
+    if models_loaded:
+        message = "All systems operational"
+    elif startup_error is None and model_loading_task is not None:
+        message = "Models loading"
+    else:
+        message = "Models not loaded"
+    
     return {
         "status": "healthy" if models_loaded else "degraded",
-        "message": "All systems operational" if models_loaded else "Models not loaded",
+        "message": message,
         "models_loaded": models_loaded
     }
 
 
+@app.get("/health/live")
+async def liveness():
+    """
+    Liveness probe: process đang chạy và event loop phản hồi (kể cả khi models đang load)
+    """
+    return {
+        "status": "alive",
+        "uptime_seconds": round(time.time() - server_started_at, 3)
+    }
+
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    Readiness probe: 200 khi nhận được request caption, 503 khi models đang load
+    hoặc load lỗi; kèm tiến trình load của từng component
+    """
+    ready = caption_generator is not None
+    components = model_loader.get_load_status() if model_loader is not None else {}
+    components["caption_generator"] = dict(generator_status)
+    components["warmup"] = dict(warmup_status)
+    
+    if ready:
+        status = "ready"
+    elif startup_error is not None:
+        status = "failed"
+    else:
+        status = "loading"
+    
+    body = {
+        "ready": ready,
+        "status": status,
+        "uptime_seconds": round(time.time() - server_started_at, 3),
+        "components": components,
+    }
+    if startup_error is not None:
+        body["error"] = startup_error
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+
+def validate_upload_type(file):
+    """
+    Kiểm tra content type của file upload
+    """
+    if file.content_type not in API_CONFIG["allowed_image_types"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {API_CONFIG['allowed_image_types']}"
+        )
+
+
+async def read_upload(file, sink=None):
+    """
+    Đọc file upload theo từng chunk:
+    - dừng ngay khi vượt max_image_size_mb (không đọc phần còn lại)
+    - kiểm tra format (PNG/JPEG) + số pixels từ header ngay khi đủ bytes,
+      trước khi decode (chặn decompression bomb)
+    
+    Args:
+        file: UploadFile
+        sink: File object (tùy chọn, vd: temp file trên đĩa) - các chunks được ghi
+            vào đây thay vì giữ trong RAM
+    
+    Returns:
+        bytes của ảnh, hoặc số bytes đã ghi vào sink
+    """
+    max_bytes = int(API_CONFIG["max_image_size_mb"] * 1024 * 1024)
+    too_large = HTTPException(
+        status_code=400,
+        detail=f"File too large. Max size: {API_CONFIG['max_image_size_mb']}MB"
+    )
+    # Kích thước do multipart parser ghi nhận (nếu có) → từ chối không cần đọc
+    if file.size is not None and file.size > max_bytes:
+        raise too_large
+    
+    # Cả file (không có sink) hoặc chỉ phần đầu cho tới khi đọc được header
+    buffer = bytearray()
+    size = 0
+    header = None
+    try:
+        while True:
+            chunk = await file.read(API_CONFIG["upload_chunk_kb"] * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise too_large
+            if sink is not None:
+                sink.write(chunk)
+            
+            if header is None or header[1] is None:
+                buffer += chunk
+                header = read_image_header(buffer)
+                if header is not None and header[1] is not None:
+                    check_image_pixels(header[1], header[2])
+            elif sink is None:
+                buffer += chunk
+
+        if header is None or header[1] is None:
+            raise ValueError("Truncated image header")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+    
+    return size if sink is not None else bytes(buffer)
+
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def validate_stream_format(format):
+    """
+    Kiểm tra format của streaming response
+    """
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid stream format. Allowed: {list(STREAM_MEDIA_TYPES)}"
+        )
+
+
+def format_stream_event(event, payload, format):
+    """
+    Đóng gói một event: một dòng JSON (ndjson) hoặc một Server-Sent Event (sse)
+    """
+    if format == "sse":
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, **payload}, ensure_ascii=False) + "\n"
+
+
+def streaming_response(events, format):
+    return StreamingResponse(
+        events,
+        media_type=STREAM_MEDIA_TYPES[format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/caption", response_model=CaptionResponse)
 async def generate_caption(
     file: UploadFile = File(...),
-    method: str = "beam_search"
+    method: str = "beam_search",
+    use_cache: bool = True
 ):
     """
     Main endpoint để generate caption cho ảnh
@@ -148,6 +371,7 @@ async def generate_caption(
     Args:
         file: UploadFile - Ảnh đầu vào (JPEG/PNG)
         method: str - 'beam_search' (default, k=3) hoặc 'greedy'
+        use_cache: bool - False để bỏ qua caption cache
     
     Returns:
         CaptionResponse với caption và metadata
@@ -159,44 +383,63 @@ async def generate_caption(
     logger.info("=" * 70)
     
     # Validate models loaded
-    if not all([model_loader, image_processor, caption_generator]):
+    if not all([model_loader, image_processor, caption_generator, inference_executor]):
         raise HTTPException(
             status_code=503,
             detail="Models not loaded. Please try again later."
         )
     
     # Validate file type
-    if file.content_type not in API_CONFIG["allowed_image_types"]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid file type. Allowed: {API_CONFIG['allowed_image_types']}"
-        )
+    validate_upload_type(file)
     
     try:
         # Step 1: Tiếp nhận Request
         logger.info(f"Step 1: Receiving image - {file.filename} ({file.content_type})")
-        image_bytes = await file.read()
-        file_size_mb = len(image_bytes) / (1024 * 1024)
+        image_bytes = await read_upload(file)
+        logger.info(f"Image size: {len(image_bytes) / (1024 * 1024):.2f} MB")
         
-        if file_size_mb > API_CONFIG["max_image_size_mb"]:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large. Max size: {API_CONFIG['max_image_size_mb']}MB"
+        # Ảnh giống hệt (retry, ảnh đăng lại) → trả kết quả từ cache
+        cache_key = None
+        if caption_cache is not None and use_cache:
+            cache_key = caption_cache.make_key(
+                image_bytes,
+                method,
+                beam_width=caption_generator.beam_width,
+                alpha=caption_generator.alpha
             )
+            cached_result = caption_cache.get(cache_key)
+            if cached_result is not None:
+                inference_time = time.time() - start_time
+                logger.info(f"Cache hit - returned in {inference_time:.3f}s")
+                return {
+                    "success": True,
+                    "caption": cached_result['caption'],
+                    "all_captions": cached_result.get('all_captions', []),
+                    "method": cached_result['method'],
+                    "inference_time": round(inference_time, 3),
+                    "message": "Caption served from cache",
+                    "cached": True
+                }
         
-        logger.info(f"Image size: {file_size_mb:.2f} MB")
-        
-        # Step 2: Tiền xử lý Ảnh
-        logger.info("Step 2: Preprocessing image (resize 299x299, normalize)")
-        preprocessed_image = image_processor.preprocess_from_bytes(image_bytes)
-        logger.info(f"Preprocessed shape: {preprocessed_image.shape}")
+        async with inference_executor.admit():
+            # Step 2: Tiền xử lý Ảnh (preprocess pool)
+            logger.info("Step 2: Preprocessing image (resize 299x299, normalize)")
+            preprocessed_image = await inference_executor.run_preprocess(
+                image_processor.preprocess_from_bytes,
+                image_bytes
+            )
+            logger.info(f"Preprocessed shape: {preprocessed_image.shape}")
+            
+            # Step 3 + 4: Trích xuất đặc trưng và Giải mã với Beam Search (inference pool)
+            logger.info(f"Step 3-4: Feature extraction + LSTM decoding (method: {method})")
+            result = await inference_executor.run_inference(
+                caption_generator.generate_caption,
+                preprocessed_image,
+                method=method
+            )
         
-        # Step 3 + 4: Trích xuất đặc trưng và Giải mã với Beam Search
-        logger.info(f"Step 3-4: Feature extraction + LSTM decoding (method: {method})")
-        result = caption_generator.generate_caption(
-            preprocessed_image,
-            method=method
-        )
+        if cache_key is not None:
+            caption_cache.put(cache_key, result)
         
         # Step 5: Phản hồi
         inference_time = time.time() - start_time
@@ -213,6 +456,14 @@ async def generate_caption(
             "message": "Caption generated successfully"
         }
         
+    except HTTPException:
+        raise
+    except ExecutorBusyError as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy. Please try again later."
+        )
     except Exception as e:
         logger.error(f"Error processing request: {e}", exc_info=True)
         raise HTTPException(
@@ -222,32 +473,430 @@ async def generate_caption(
 
 
 @app.post("/caption/batch")
-async def generate_captions_batch(files: list[UploadFile] = File(...)):
+async def generate_captions_batch(
+    files: list[UploadFile] = File(...),
+    method: str = "beam_search",
+    use_cache: bool = True
+):
     """
     Batch processing - Generate captions cho nhiều ảnh
     
+    Các ảnh được đọc song song rồi decode thẳng vào một batch buffer uint8,
+    CNN encoder chạy một lần trên cả batch và decoder giải mã tất cả ảnh trong cùng các batch.
+    
     Args:
         files: List of UploadFile
+        method: str - 'beam_search' (default, k=3) hoặc 'greedy'
+        use_cache: bool - False để bỏ qua caption cache
     
     Returns:
-        List of CaptionResponse
+        List of CaptionResponse (cùng thứ tự với files, lỗi được báo theo từng ảnh)
+    """
+    start_time = time.time()
+    logger.info(f"Batch request: {len(files)} images (method: {method})")
+    
+    if not all([model_loader, image_processor, caption_generator, inference_executor]):
+        raise HTTPException(
+            status_code=503,
+            detail="Models not loaded. Please try again later."
+        )
+    
+    results = [None] * len(files)
+    
+    def error_result(error):
+        message = error.detail if isinstance(error, HTTPException) else str(error)
+        return {
+            "success": False,
+            "caption": "",
+            "message": message,
+            "inference_time": 0
+        }
+    
+    async def load(index, file):
+        """
+        Đọc + validate một ảnh (hoặc lấy kết quả từ cache)
+        
+        Returns:
+            tuple: (image_bytes, cache_key) - (None, None) nếu đã có trong cache
+        """
+        validate_upload_type(file)
+        image_bytes = await read_upload(file)
+        
+        cache_key = None
+        if caption_cache is not None and use_cache:
+            cache_key = caption_cache.make_key(
+                image_bytes,
+                method,
+                beam_width=caption_generator.beam_width,
+                alpha=caption_generator.alpha
+            )
+            cached_result = caption_cache.get(cache_key)
+            if cached_result is not None:
+                results[index] = {
+                    "success": True,
+                    "caption": cached_result['caption'],
+                    "all_captions": cached_result.get('all_captions', []),
+                    "method": cached_result['method'],
+                    "message": "Caption served from cache",
+                    "cached": True
+                }
+                return None, None
+        
+        return image_bytes, cache_key
+    
+    try:
+        async with inference_executor.admit():
+            # Step 1: Đọc tất cả ảnh song song
+            loaded = await asyncio.gather(
+                *(load(i, file) for i, file in enumerate(files)),
+                return_exceptions=True
+            )
+            
+            pending = []
+            for i, item in enumerate(loaded):
+                if isinstance(item, Exception):
+                    logger.warning(f"Batch item {i} ({files[i].filename}) failed: {item}")
+                    results[i] = error_result(item)
+                elif results[i] is None:
+                    pending.append(i)
+            
+            # Step 2: Decode + resize thẳng vào một buffer (N, H, W, 3), ảnh lỗi được bỏ qua
+            if pending:
+                errors = {}
+                images = await inference_executor.run_preprocess(
+                    image_processor.preprocess_batch,
+                    [loaded[i][0] for i in pending],
+                    errors=errors
+                )
+                for j, error in errors.items():
+                    i = pending[j]
+                    logger.warning(f"Batch item {i} ({files[i].filename}) failed: {error}")
+                    results[i] = error_result(error)
+                pending = [i for j, i in enumerate(pending) if j not in errors]
+            
+            # Step 3-4: Một lần encoder cho cả batch + decoder chạy chung batch
+            if pending:
+                try:
+                    captions = await inference_executor.run_inference(
+                        caption_generator.generate_captions_batch,
+                        images,
+                        method=method
+                    )
+                    for i, result in zip(pending, captions):
+                        cache_key = loaded[i][1]
+                        if cache_key is not None:
+                            caption_cache.put(cache_key, result)
+                        results[i] = {
+                            "success": True,
+                            "caption": result['caption'],
+                            "all_captions": result.get('all_captions', []),
+                            "method": result['method'],
+                            "message": "Caption generated successfully"
+                        }
+                except Exception as e:
+                    logger.error(f"Error processing batch: {e}", exc_info=True)
+                    for i in pending:
+                        results[i] = error_result(e)
+    
+    except ExecutorBusyError as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy. Please try again later."
+        )
+    
+    # Step 5: Phản hồi
+    inference_time = round(time.time() - start_time, 3)
+    for file, result in zip(files, results):
+        result["filename"] = file.filename
+        if result["success"]:
+            result["inference_time"] = inference_time
+    
+    logger.info(f"Batch of {len(files)} images done in {inference_time:.2f}s")
+    
+    return {
+        "results": results,
+        "total": len(files),
+        "succeeded": sum(1 for result in results if result["success"]),
+        "inference_time": inference_time
+    }
+
+
+@app.post("/caption/stream")
+async def stream_caption(
+    file: UploadFile = File(...),
+    method: str = "beam_search",
+    format: str = "ndjson",
+    use_cache: bool = True
+):
+    """
+    Streaming variant của /caption - gửi caption tạm trong lúc giải mã
+    
+    Events:
+        token  - {"step", "caption"}: caption greedy / beam đang dẫn đầu sau mỗi bước
+        result - kết quả cuối cùng (cùng format với CaptionResponse)
+        error  - {"message"} nếu có lỗi trong lúc giải mã
+    
+    Args:
+        file: UploadFile - Ảnh đầu vào (JPEG/PNG)
+        method: str - 'beam_search' (default, k=3) hoặc 'greedy'
+        format: str - 'ndjson' (default) hoặc 'sse'
+        use_cache: bool - False để bỏ qua caption cache
+    """
+    start_time = time.time()
+    
+    if not all([model_loader, image_processor, caption_generator, inference_executor]):
+        raise HTTPException(
+            status_code=503,
+            detail="Models not loaded. Please try again later."
+        )
+    
+    validate_stream_format(format)
+    validate_upload_type(file)
+    # Đọc hết upload trước khi trả response: file bị đóng khi handler kết thúc
+    image_bytes = await read_upload(file)
+    
+    cache_key = None
+    if caption_cache is not None and use_cache:
+        cache_key = caption_cache.make_key(
+            image_bytes,
+            method,
+            beam_width=caption_generator.beam_width,
+            alpha=caption_generator.alpha
+        )
+    
+    async def events():
+        cached_result = caption_cache.get(cache_key) if cache_key is not None else None
+        if cached_result is not None:
+            yield format_stream_event("result", {
+                "success": True,
+                "caption": cached_result['caption'],
+                "all_captions": cached_result.get('all_captions', []),
+                "method": cached_result['method'],
+                "inference_time": round(time.time() - start_time, 3),
+                "message": "Caption served from cache",
+                "cached": True
+            }, format)
+            return
+        
+        steps = None
+        try:
+            async with inference_executor.admit():
+                image = await inference_executor.run_preprocess(
+                    image_processor.preprocess_from_bytes,
+                    image_bytes
+                )
+                steps = caption_generator.stream_caption(image, method=method)
+                
+                # Mỗi bước giải mã chạy trong inference pool, event được gửi ngay
+                while True:
+                    event = await inference_executor.run_inference(next, steps, None)
+                    if event is None:
+                        break
+                    
+                    name = event.pop('event')
+                    if name == 'result':
+                        if cache_key is not None:
+                            caption_cache.put(cache_key, event)
+                        event = {
+                            "success": True,
+                            "caption": event['caption'],
+                            "all_captions": event.get('all_captions', []),
+                            "method": event['method'],
+                            "inference_time": round(time.time() - start_time, 3),
+                            "message": "Caption generated successfully"
+                        }
+                    yield format_stream_event(name, event, format)
+        
+        except ExecutorBusyError as e:
+            logger.warning(str(e))
+            yield format_stream_event("error", {"message": "Server busy. Please try again later."}, format)
+        except Exception as e:
+            logger.error(f"Error streaming caption: {e}", exc_info=True)
+            yield format_stream_event("error", {"message": f"Error generating caption: {str(e)}"}, format)
+        finally:
+            # Client ngắt kết nối giữa chừng → giải phóng generator (nếu không đang chạy)
+            if steps is not None and not steps.gi_running:
+                steps.close()
+    
+    return streaming_response(events(), format)
+
+
+@app.post("/caption/batch/stream")
+async def stream_captions_batch(
+    files: list[UploadFile] = File(...),
+    method: str = "beam_search",
+    format: str = "ndjson",
+    use_cache: bool = True
+):
     """
-    logger.info(f"Batch request: {len(files)} images")
+    Streaming variant của /caption/batch - mỗi ảnh được gửi ngay khi xong
+    (theo thứ tự hoàn thành, không theo thứ tự input)
+    
+    Các ảnh chạy như các request riêng trong inference pool nên decode
+    scheduler vẫn gộp các bước giải mã của chúng. Uploads được copy sang temp
+    files trên đĩa, mỗi ảnh chỉ được đọc vào RAM khi bắt đầu xử lý (tối đa
+    `window` ảnh cùng lúc) và kết quả không được giữ lại sau khi gửi → trong lúc
+    stream, bộ nhớ không tăng theo số ảnh (multipart parser vẫn spool mỗi file
+    tối đa 1MB trong RAM tới khi handler trả về).
+    
+    Events:
+        item  - {"index", "filename", ...CaptionResponse} cho từng ảnh
+        done  - {"total", "succeeded", "inference_time"}
+    
+    Args:
+        files: List of UploadFile
+        method: str - 'beam_search' (default, k=3) hoặc 'greedy'
+        format: str - 'ndjson' (default) hoặc 'sse'
+        use_cache: bool - False để bỏ qua caption cache
+    """
+    start_time = time.time()
+    logger.info(f"Streaming batch request: {len(files)} images (method: {method})")
     
-    results = []
+    if not all([model_loader, image_processor, caption_generator, inference_executor]):
+        raise HTTPException(
+            status_code=503,
+            detail="Models not loaded. Please try again later."
+        )
+    
+    validate_stream_format(format)
+    
+    # UploadFiles bị đóng khi handler trả về → validate + copy từng upload sang
+    # temp file trên đĩa (theo chunk), không giữ bytes của cả batch trong RAM
+    uploads = []
     for file in files:
+        spool = tempfile.TemporaryFile()
         try:
-            result = await generate_caption(file)
-            results.append(result)
+            validate_upload_type(file)
+            await read_upload(file, sink=spool)
+            uploads.append((file.filename, spool))
+        except HTTPException as e:
+            spool.close()
+            uploads.append((file.filename, e))
+    
+    def close_uploads():
+        for index, (filename, upload) in enumerate(uploads):
+            if hasattr(upload, "close"):
+                upload.close()
+                uploads[index] = (filename, None)
+    
+    async def caption_one(index):
+        filename, upload = uploads[index]
+        uploads[index] = (filename, None)
+        result = {"index": index, "filename": filename}
+        
+        try:
+            if isinstance(upload, HTTPException):
+                raise upload
+            
+            # Ảnh chỉ vào RAM khi tới lượt (trong window)
+            with upload:
+                upload.seek(0)
+                image_bytes = upload.read()
+            
+            cache_key = None
+            if caption_cache is not None and use_cache:
+                cache_key = caption_cache.make_key(
+                    image_bytes,
+                    method,
+                    beam_width=caption_generator.beam_width,
+                    alpha=caption_generator.alpha
+                )
+                cached_result = caption_cache.get(cache_key)
+                if cached_result is not None:
+                    result.update({
+                        "success": True,
+                        "caption": cached_result['caption'],
+                        "all_captions": cached_result.get('all_captions', []),
+                        "method": cached_result['method'],
+                        "inference_time": round(time.time() - start_time, 3),
+                        "message": "Caption served from cache",
+                        "cached": True
+                    })
+                    return result
+            
+            image = await inference_executor.run_preprocess(
+                image_processor.preprocess_from_bytes,
+                image_bytes
+            )
+            caption = await inference_executor.run_inference(
+                caption_generator.generate_caption,
+                image,
+                method=method
+            )
+            if cache_key is not None:
+                caption_cache.put(cache_key, caption)
+            
+            result.update({
+                "success": True,
+                "caption": caption['caption'],
+                "all_captions": caption.get('all_captions', []),
+                "method": caption['method'],
+                "inference_time": round(time.time() - start_time, 3),
+                "message": "Caption generated successfully"
+            })
         except Exception as e:
-            results.append({
+            logger.warning(f"Batch item {index} ({filename}) failed: {e}")
+            result.update({
                 "success": False,
                 "caption": "",
-                "message": str(e),
+                "message": e.detail if isinstance(e, HTTPException) else str(e),
                 "inference_time": 0
             })
+        return result
+    
+    async def events():
+        succeeded = 0
+        running = set()
+        try:
+            async with inference_executor.admit():
+                window = inference_executor.inference_workers * 2
+                next_index = 0
+                
+                while running or next_index < len(uploads):
+                    while next_index < len(uploads) and len(running) < window:
+                        running.add(asyncio.ensure_future(caption_one(next_index)))
+                        next_index += 1
+                    
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        result = task.result()
+                        succeeded += result["success"]
+                        yield format_stream_event("item", result, format)
+        
+        except ExecutorBusyError as e:
+            logger.warning(str(e))
+            yield format_stream_event("error", {"message": "Server busy. Please try again later."}, format)
+            return
+        finally:
+            # Client ngắt kết nối giữa chừng → hủy các ảnh chưa xong, xóa temp files
+            for task in running:
+                task.cancel()
+            close_uploads()
+        
+        inference_time = round(time.time() - start_time, 3)
+        logger.info(f"Streaming batch of {len(uploads)} images done in {inference_time:.2f}s")
+        yield format_stream_event("done", {
+            "total": len(uploads),
+            "succeeded": succeeded,
+            "inference_time": inference_time
+        }, format)
     
-    return {"results": results, "total": len(files)}
+    return streaming_response(events(), format)
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Thống kê caption cache, feature cache và decoder memo (hit/miss counters)
+    """
+    feature_cache = caption_generator.feature_cache if caption_generator else None
+    decoder_memo = caption_generator.decoder_memo if caption_generator else None
+    return {
+        "caption_cache": caption_cache.stats() if caption_cache else {"enabled": False},
+        "feature_cache": feature_cache.stats() if feature_cache else {"enabled": False},
+        "decoder_memo": decoder_memo.stats() if decoder_memo else {"enabled": False},
+    }
 
 
 @app.get("/models/info")
@@ -255,7 +904,7 @@ async def get_model_info():
     """
     Get thông tin về models đang được load
     """
-    if not model_loader:
+    if not caption_generator:
         raise HTTPException(status_code=503, detail="Models not loaded")
     
     models = model_loader.get_models()
@@ -263,10 +912,13 @@ async def get_model_info():
     return {
         "encoder_loaded": models['encoder'] is not None,
         "decoder_loaded": models['decoder'] is not None,
+        "quantized": models['quantized_decoder'] is not None,
         "vocab_size": len(models['word_to_idx']) if models['word_to_idx'] else 0,
         "max_length": models['max_length'],
         "image_size": image_processor.image_size if image_processor else None,
-        "beam_width": caption_generator.beam_width if caption_generator else None
+        "beam_width": caption_generator.beam_width if caption_generator else None,
+        "snapshot": str(model_loader.snapshot_dir) if model_loader.snapshot_dir else None,
+        "memory": model_loader.memory_report()
     }
 
 
@@ -0,0 +1,249 @@
+"""
+Pre-fork Model Server - Master load models một lần, fork N worker processes
+Các workers dùng chung code/modules/models theo copy-on-write và cùng accept trên một socket
+
+Lưu ý: TensorFlow runtime không an toàn sau fork (process con bị treo ở op đầu tiên
+nếu master đã chạy op nào đó), nên master không chạy op TensorFlow nào.
+
+Bộ nhớ (SERVER_CONFIG["share_models"]): master load vocabulary + TFLite models
+(QUANTIZATION_CONFIG) trước khi fork - file .tflite được mmap nên mọi workers dùng
+chung một bản weights trong page cache; interpreters (tensor arenas) và threads được
+tạo sau fork trong từng worker. Thiếu/cũ .tflite thì convert trong một process con
+trước khi fork. Keras models không chia sẻ được (TensorFlow luôn copy weights vào
+allocator riêng), nên share_models=False → mỗi worker tự load một bản float models
++ TensorFlow runtime: bộ nhớ tăng ~N lần theo số workers.
+"""
+
+import os
+import gc
+import sys
+import signal
+import socket
+import logging
+from pathlib import Path
+
+# Import config
+sys.path.append(str(Path(__file__).parent))
+from config import API_CONFIG, LOGGING_CONFIG, SERVER_CONFIG, QUANTIZATION_CONFIG
+
+logging.basicConfig(
+    level=LOGGING_CONFIG["level"],
+    format=LOGGING_CONFIG["format"]
+)
+logger = logging.getLogger("prefork")
+
+
+def resolve_thread_counts(workers):
+    """
+    Chia số cores cho các workers để tránh oversubscription
+
+    Returns:
+        tuple: (intra_op_threads, inter_op_threads) cho mỗi worker
+    """
+    cpu_count = os.cpu_count() or 1
+    intra = SERVER_CONFIG["intra_op_threads"] or max(1, cpu_count // workers)
+    inter = SERVER_CONFIG["inter_op_threads"] or 1
+    return intra, inter
+
+
+def configure_tensorflow_threads(intra, inter):
+    """
+    Giới hạn thread pools của TensorFlow trong worker (trước khi load models)
+    """
+    os.environ["OMP_NUM_THREADS"] = str(intra)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(intra)
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(inter)
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra)
+    tf.config.threading.set_inter_op_parallelism_threads(inter)
+    logger.info(f"TensorFlow threads per worker: intra_op={intra}, inter_op={inter}")
+
+
+def convert_quantized_models():
+    """
+    Convert .tflite trong process con (cần TensorFlow + float models), để master
+    không chạy op TensorFlow nào và không giữ float weights
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            from src.model_loader import ModelLoader
+            # .tflite thiếu/cũ → load float models rồi convert
+            ModelLoader().load_all_models()
+            status = 0
+        except Exception:
+            logger.exception("Quantized model conversion failed")
+        finally:
+            os._exit(status)
+
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError("Quantized model conversion failed (see log above)")
+
+
+def preload_shared_models(intra):
+    """
+    Load vocabulary + TFLite models trong master trước khi fork (không khởi tạo
+    TensorFlow runtime): workers thừa hưởng models qua fork thay vì tự load
+
+    Args:
+        intra: Số threads mỗi interpreter khi QUANTIZATION_CONFIG["num_threads"] là None
+    """
+    from src.model_loader import get_model_loader
+
+    QUANTIZATION_CONFIG["enabled"] = True
+    QUANTIZATION_CONFIG["skip_float_models"] = True
+    if QUANTIZATION_CONFIG["num_threads"] is None:
+        QUANTIZATION_CONFIG["num_threads"] = intra
+
+    loader = get_model_loader(load=False)
+    if loader.validate_quantization_config()[2]:
+        logger.info("Quantized models missing or stale, converting in a child process...")
+        convert_quantized_models()
+        if loader.validate_quantization_config()[2]:
+            raise RuntimeError("Quantized models still missing or stale after conversion")
+
+    loader.load_all_models()
+
+
+def create_listen_socket(host, port):
+    """
+    Socket dùng chung cho mọi workers - kernel phân phối connections
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def pin_worker_cpus(worker_id, workers, intra):
+    """
+    Gán mỗi worker vào một nhóm cores riêng (Linux)
+    """
+    if not SERVER_CONFIG["pin_cpus"] or not hasattr(os, "sched_setaffinity"):
+        return
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < workers * intra:
+        return
+    start = worker_id * intra
+    os.sched_setaffinity(0, cpus[start:start + intra])
+
+
+def run_worker(worker_id, workers, intra, inter, sock, shared):
+    """
+    Entry point của worker process: chạy uvicorn trên socket dùng chung
+    """
+    import uvicorn
+    import main
+
+    pin_worker_cpus(worker_id, workers, intra)
+    if not shared:
+        configure_tensorflow_threads(intra, inter)
+    logger.info(f"Worker {worker_id} started (pid={os.getpid()})")
+
+    config = uvicorn.Config(
+        main.app,
+        log_level="info",
+        access_log=False,
+    )
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(worker_id, workers, intra, inter, sock, shared):
+    """
+    Fork một worker, trả về pid trong master
+    """
+    pid = os.fork()
+    if pid == 0:
+        # Worker: reset signal handlers của master
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            run_worker(worker_id, workers, intra, inter, sock, shared)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def serve():
+    """
+    Master process: import stack một lần, fork workers và giám sát chúng
+    """
+    workers = SERVER_CONFIG["workers"] or (os.cpu_count() or 1)
+    intra, inter = resolve_thread_counts(workers)
+
+    logger.info("=" * 70)
+    logger.info(f"PRE-FORK MODEL SERVER: {workers} workers")
+    logger.info("=" * 70)
+
+    shared = SERVER_CONFIG["share_models"]
+    if shared:
+        # Vocabulary + TFLite models load một lần trong master; workers dùng lại
+        # (ModelLoader singleton), chỉ tạo CaptionGenerator, interpreters và threads
+        import main  # noqa: F401
+        preload_shared_models(intra)
+    else:
+        # Chỉ import TensorFlow/Keras trong master (chưa chạy op nào):
+        # mỗi worker tự load một bản float models
+        import tensorflow  # noqa: F401
+        import main  # noqa: F401
+        # main.py không import các modules dùng TensorFlow (models load trong background)
+        import src.model_loader, src.inference_backend, src.graph_decoding, src.quantization  # noqa: F401,E401
+        logger.warning(
+            "share_models disabled: each worker loads its own Keras models "
+            f"(~{workers}x model memory)"
+        )
+
+    # Đưa mọi objects hiện có vào permanent generation để GC
+    # không ghi vào pages dùng chung sau khi fork
+    gc.collect()
+    gc.freeze()
+
+    sock = create_listen_socket(API_CONFIG["host"], API_CONFIG["port"])
+    logger.info(f"Listening on http://{API_CONFIG['host']}:{API_CONFIG['port']}")
+
+    children = {}
+    for worker_id in range(workers):
+        children[spawn_worker(worker_id, workers, intra, inter, sock, shared)] = worker_id
+
+    shutting_down = False
+
+    def handle_shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+
+    # Giám sát: restart worker nếu chết bất thường
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        worker_id = children.pop(pid, None)
+        if worker_id is None or shutting_down:
+            continue
+
+        logger.warning(f"Worker {worker_id} (pid={pid}) exited with status {status}, restarting")
+        children[spawn_worker(worker_id, workers, intra, inter, sock, shared)] = worker_id
+
+    sock.close()
+    logger.info("Pre-fork server stopped")
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,266 @@
+"""
+Batching - Gộp các lời gọi model nhỏ từ nhiều request thành batch lớn
+Continuous batching cho decoder và micro-batching cho CNN encoder
+"""
+
+import threading
+import queue
+import time
+import logging
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+# Import config
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import DECODE_SCHEDULER_CONFIG, ENCODER_BATCHER_CONFIG, PERFORMANCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class _BatchItem:
+    """
+    Một lời gọi model đang chờ: list input arrays có cùng số hàng
+    """
+
+    __slots__ = ("inputs", "rows", "future")
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.rows = inputs[0].shape[0]
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Worker thread gom các lời gọi model đang chờ thành một batch
+
+    Mỗi lời gọi submit() gồm list input arrays có cùng số hàng.
+    Worker nối input theo hàng, chạy model một lần rồi trả từng phần
+    kết quả về đúng Future của lời gọi đó.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=2.0, name="micro-batcher",
+                 dispatch_when_idle=False):
+        """
+        Args:
+            predict_fn: Hàm nhận list input arrays (đã nối), trả về numpy array
+            max_batch_size: Số hàng tối đa mỗi lần gọi model
+            max_wait_ms: Thời gian chờ tối đa (ms) để gom thêm lời gọi
+            name: Tên worker thread
+            dispatch_when_idle: Không có session nào đang mở và hàng đợi trống
+                → chạy ngay, không đợi max_wait_ms (mọi caller đều mở session)
+        """
+        self.predict_fn = predict_fn
+        self.dispatch_when_idle = dispatch_when_idle
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._carry = None  # Lời gọi không vừa batch trước, chạy ở batch sau
+        self._thread = None
+        self._lock = threading.Lock()
+        self._active_sessions = 0
+
+        self.stats = {"batches": 0, "calls": 0, "rows": 0}
+
+    def start(self):
+        """
+        Khởi động worker thread (idempotent)
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                logger.info(
+                    f"{self.name} started (max_batch_size={self.max_batch_size}, "
+                    f"max_wait_ms={self.max_wait * 1000:.1f})"
+                )
+        return self
+
+    @contextmanager
+    def session(self):
+        """
+        Đánh dấu một request đang giải mã
+
+        Khi mọi session đang hoạt động đều đã gửi bước tiếp theo,
+        worker chạy batch ngay thay vì đợi hết max_wait_ms.
+        """
+        with self._lock:
+            self._active_sessions += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_sessions -= 1
+
+    def submit(self, inputs):
+        """
+        Gửi một lời gọi model vào hàng đợi
+
+        Args:
+            inputs: List numpy arrays có cùng số hàng
+
+        Returns:
+            Future: Kết quả (numpy array) tương ứng với các hàng của lời gọi
+        """
+        if self._thread is None:
+            self.start()
+        item = _BatchItem([np.asarray(x) for x in inputs])
+        self._queue.put(item)
+        return item.future
+
+    def predict(self, inputs):
+        """
+        Gửi lời gọi và chờ kết quả (blocking)
+        """
+        return self.submit(inputs).result()
+
+    def _collect(self):
+        """
+        Gom các lời gọi thành một batch theo max_batch_size / max_wait_ms
+        """
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        batch = [first]
+        rows = first.rows
+        deadline = time.monotonic() + self.max_wait
+
+        while rows < self.max_batch_size:
+            # Mọi request đang giải mã đã có mặt (hoặc server rảnh) → không cần chờ thêm
+            with self._lock:
+                active = self._active_sessions
+            if self._queue.empty():
+                if active and len(batch) >= active:
+                    break
+                if not active and self.dispatch_when_idle:
+                    break
+
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if rows + item.rows > self.max_batch_size:
+                self._carry = item
+                break
+            batch.append(item)
+            rows += item.rows
+
+        return batch
+
+    def _run(self):
+        """
+        Vòng lặp worker: gom batch → chạy model → trả kết quả
+        """
+        while True:
+            batch = self._collect()
+            try:
+                if len(batch) == 1:
+                    outputs = self.predict_fn(batch[0].inputs)
+                else:
+                    stacked = [
+                        np.concatenate([item.inputs[i] for item in batch], axis=0)
+                        for i in range(len(batch[0].inputs))
+                    ]
+                    outputs = self.predict_fn(stacked)
+
+                offset = 0
+                for item in batch:
+                    item.future.set_result(outputs[offset:offset + item.rows])
+                    offset += item.rows
+
+                self.stats["batches"] += 1
+                self.stats["calls"] += len(batch)
+                self.stats["rows"] += offset
+
+            except Exception as e:
+                logger.error(f"{self.name} batch failed: {e}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+
+
+class DecodeScheduler(MicroBatcher):
+    """
+    Continuous batching cho LSTM decoder
+
+    Mỗi request (greedy hoặc beam search) gửi bước giải mã tiếp theo của nó;
+    scheduler gộp các bước của mọi request đang chạy vào chung một lần
+    decoder.predict. Request kết thúc thì rời batch, request mới có thể
+    tham gia ở bất kỳ bước nào.
+    """
+
+    def __init__(self, decoder, max_batch_size=None, max_wait_ms=None):
+        self.decoder = decoder
+        super().__init__(
+            predict_fn=lambda inputs: self.decoder.predict(inputs, verbose=0),
+            max_batch_size=max_batch_size or DECODE_SCHEDULER_CONFIG["max_batch_size"],
+            max_wait_ms=(
+                max_wait_ms if max_wait_ms is not None
+                else DECODE_SCHEDULER_CONFIG["max_wait_ms"]
+            ),
+            name="decode-scheduler",
+            dispatch_when_idle=True,
+        )
+
+
+def get_decode_scheduler(decoder):
+    """
+    Tạo DecodeScheduler cho decoder nếu được bật trong config
+
+    Args:
+        decoder: LSTM decoder model
+
+    Returns:
+        DecodeScheduler hoặc None
+    """
+    if decoder is None or not DECODE_SCHEDULER_CONFIG["enabled"]:
+        return None
+    return DecodeScheduler(decoder).start()
+
+
+class EncoderBatcher(MicroBatcher):
+    """
+    Micro-batching cho CNN encoder (EfficientNetB0)
+
+    Mỗi request gửi ảnh đã preprocess (1, 224, 224, 3); worker chạy encoder
+    trên tối đa PERFORMANCE_CONFIG["batch_size"] ảnh (hoặc số ảnh đến trong
+    cửa sổ max_wait_ms) rồi trả hàng features (1280,) về từng request.
+    """
+
+    def __init__(self, encoder, max_batch_size=None, max_wait_ms=None):
+        self.encoder = encoder
+        super().__init__(
+            predict_fn=lambda inputs: self.encoder.predict(inputs[0], verbose=0),
+            max_batch_size=max_batch_size or PERFORMANCE_CONFIG["batch_size"],
+            max_wait_ms=(
+                max_wait_ms if max_wait_ms is not None
+                else ENCODER_BATCHER_CONFIG["max_wait_ms"]
+            ),
+            name="encoder-batcher",
+        )
+
+
+def get_encoder_batcher(encoder):
+    """
+    Tạo EncoderBatcher cho encoder nếu được bật trong config
+
+    Args:
+        encoder: CNN encoder model
+
+    Returns:
+        EncoderBatcher hoặc None
+    """
+    if (encoder is None or not ENCODER_BATCHER_CONFIG["enabled"]
+            or PERFORMANCE_CONFIG["batch_size"] <= 1):
+        return None
+    return EncoderBatcher(encoder).start()
@@ -0,0 +1,378 @@
+"""
+Caching - Cache kết quả caption và image features theo nội dung ảnh (content-addressed)
+LRU eviction theo số entries hoặc bytes, TTL tùy chọn, thread-safe, có hit/miss counters
+Memo output của decoder theo (ảnh, prefix) dạng trie token
+"""
+
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+# Import config
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import CAPTION_CACHE_CONFIG, FEATURE_CACHE_CONFIG, DECODER_MEMO_CONFIG, MODEL_FILES, API_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    LRU cache thread-safe với TTL tùy chọn
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl_seconds=None,
+                 sizeof=None, name="cache"):
+        """
+        Args:
+            max_entries: Số entries tối đa trước khi evict (None = không giới hạn)
+            max_bytes: Tổng kích thước tối đa theo sizeof (None = không giới hạn)
+            ttl_seconds: Thời gian sống của entry (None = không hết hạn)
+            sizeof: Hàm tính kích thước (bytes) của value
+            name: Tên cache (dùng cho logging)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof or (lambda value: 0)
+        self.name = name
+
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Lấy value theo key, trả về None nếu không có hoặc đã hết hạn
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Thêm/cập nhật entry, evict entry ít dùng nhất khi đầy
+        """
+        expires_at = None
+        if self.ttl_seconds:
+            expires_at = time.monotonic() + self.ttl_seconds
+
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+
+            while self._data and (
+                (self.max_entries is not None and len(self._data) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """
+        Thống kê cache: hit/miss counters và kích thước
+        """
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def _default_model_version():
+    """
+    Version của model dựa trên API version + kích thước/thời gian sửa decoder file
+    → cache tự động vô hiệu khi thay model
+    """
+    decoder_path = Path(MODEL_FILES["decoder"])
+    if decoder_path.exists():
+        stat = decoder_path.stat()
+        return f"{API_CONFIG['version']}:{decoder_path.name}:{stat.st_size}:{int(stat.st_mtime)}"
+    return API_CONFIG["version"]
+
+
+class CaptionCache(LRUCache):
+    """
+    Cache kết quả caption theo hash của image bytes + tham số giải mã
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None, model_version=None):
+        super().__init__(
+            max_entries=max_entries or CAPTION_CACHE_CONFIG["max_entries"],
+            ttl_seconds=ttl_seconds or CAPTION_CACHE_CONFIG["ttl_seconds"],
+            name="caption_cache",
+        )
+        self.model_version = model_version or _default_model_version()
+
+    def make_key(self, image_bytes, method, beam_width=None, alpha=None):
+        """
+        Tạo cache key từ nội dung ảnh và tham số giải mã
+
+        Args:
+            image_bytes: Bytes của ảnh upload
+            method: 'beam_search' hoặc 'greedy'
+            beam_width: Beam width (chỉ dùng cho beam search)
+            alpha: Length penalty (chỉ dùng cho beam search)
+
+        Returns:
+            str: Cache key
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        if method != 'beam_search':
+            beam_width = alpha = None
+        return f"{digest}|{method}|{beam_width}|{alpha}|{self.model_version}"
+
+
+class FeatureCache(LRUCache):
+    """
+    Cache image features (1280,) của CNN encoder theo hash của ảnh đã preprocess
+
+    Đổi method (greedy ↔ beam search) hoặc beam width trên cùng ảnh
+    chỉ cần chạy lại phần decode, không chạy lại EfficientNetB0.
+    """
+
+    def __init__(self, max_bytes=None, ttl_seconds=None):
+        super().__init__(
+            max_entries=None,
+            max_bytes=max_bytes or FEATURE_CACHE_CONFIG["max_bytes"],
+            ttl_seconds=ttl_seconds or FEATURE_CACHE_CONFIG["ttl_seconds"],
+            sizeof=lambda features: features.nbytes,
+            name="feature_cache",
+        )
+
+    @staticmethod
+    def make_key(image):
+        """
+        Tạo cache key từ ảnh đã preprocess (numpy array)
+        """
+        image = np.ascontiguousarray(image)
+        digest = hashlib.blake2b(image.data, digest_size=16).hexdigest()
+        return f"{digest}|{image.shape}|{image.dtype.str}"
+
+    def put(self, key, features):
+        # Lưu bản copy read-only để caller không sửa được dữ liệu trong cache
+        features = np.array(features, copy=True)
+        features.setflags(write=False)
+        super().put(key, features)
+
+
+class _TrieNode:
+    __slots__ = ("children", "words", "probs")
+
+    def __init__(self):
+        self.children = {}  # token -> _TrieNode
+        self.words = None   # top-k word indices (int32), None = chưa có giá trị
+        self.probs = None   # xác suất tương ứng (float32)
+
+
+class DecoderMemo:
+    """
+    Memo phân phối từ tiếp theo của decoder theo (ảnh, prefix)
+
+    Decoder nhận cả prefix đã pad nên cùng (ảnh, prefix) luôn cho cùng phân phối:
+    lặp lại giữa greedy và beam search trên cùng ảnh, giữa các request có cùng ảnh,
+    và ở bước đầu (<start>) của mọi lần giải mã. Mỗi ảnh có một trie theo token,
+    node của prefix lưu top-k từ + xác suất (~80 bytes thay vì cả vector vocab).
+    Greedy (argmax) và beam search (top beam_width của mỗi beam) chỉ dùng top-k
+    nên kết quả giống hệt khi gọi decoder.
+
+    LRU theo ảnh: vượt quá max_nodes thì bỏ cả trie của ảnh ít dùng nhất.
+    """
+
+    def __init__(self, top_k=None, max_nodes=None):
+        """
+        Args:
+            top_k: Số từ lưu cho mỗi prefix
+            max_nodes: Tổng số prefix có giá trị tối đa (mọi ảnh)
+        """
+        self.top_k = top_k or DECODER_MEMO_CONFIG["top_k"]
+        self.max_nodes = max_nodes or DECODER_MEMO_CONFIG["max_nodes"]
+        self.name = "decoder_memo"
+
+        self._tries = OrderedDict()  # image key -> (root, số node có giá trị)
+        self._nodes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(features):
+        """
+        Tạo key của ảnh từ vector features (hoặc projection) của nó
+        """
+        features = np.ascontiguousarray(features)
+        return hashlib.blake2b(features.data, digest_size=16).hexdigest()
+
+    def get(self, key, prefix, min_k=1):
+        """
+        Lấy top-k đã lưu cho prefix
+
+        Args:
+            key: Key của ảnh (make_key)
+            prefix: List token (decoder input đã bỏ padding cuối)
+            min_k: Số từ tối thiểu cần có (beam width)
+
+        Returns:
+            tuple: (words, probs) hoặc None
+        """
+        with self._lock:
+            entry = self._tries.get(key)
+            node = entry[0] if entry is not None else None
+            for token in prefix:
+                if node is None:
+                    break
+                node = node.children.get(token)
+
+            if node is None or node.words is None or len(node.words) < min_k:
+                self.misses += 1
+                return None
+
+            self._tries.move_to_end(key)
+            self.hits += 1
+            return node.words, node.probs
+
+    def put(self, key, prefix, words, probs):
+        """
+        Lưu top-k (words, probs) cho prefix của ảnh
+        """
+        with self._lock:
+            root, count = self._tries.pop(key, (None, 0))
+            node = root = root or _TrieNode()
+            for token in prefix:
+                child = node.children.get(token)
+                if child is None:
+                    child = node.children[token] = _TrieNode()
+                node = child
+
+            if node.words is None:
+                count += 1
+                self._nodes += 1
+            node.words, node.probs = words, probs
+            self._tries[key] = (root, count)
+
+            while self._nodes > self.max_nodes and len(self._tries) > 1:
+                _, (_, evicted) = self._tries.popitem(last=False)
+                self._nodes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._tries.clear()
+            self._nodes = 0
+
+    def __len__(self):
+        return self._nodes
+
+    def stats(self):
+        """
+        Thống kê memo: hit/miss counters (theo từng hàng decoder) và kích thước
+        """
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "images": len(self._tries),
+            "nodes": self._nodes,
+            "max_nodes": self.max_nodes,
+            "top_k": self.top_k,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# Singleton instances
+_caption_cache_instance = None
+_feature_cache_instance = None
+_decoder_memo_instance = None
+
+def get_caption_cache():
+    """
+    Get singleton instance của CaptionCache (None nếu tắt trong config)
+    """
+    global _caption_cache_instance
+    if not CAPTION_CACHE_CONFIG["enabled"]:
+        return None
+    if _caption_cache_instance is None:
+        _caption_cache_instance = CaptionCache()
+        logger.info(
+            f"Caption cache enabled (max_entries={_caption_cache_instance.max_entries}, "
+            f"ttl={_caption_cache_instance.ttl_seconds}, version={_caption_cache_instance.model_version})"
+        )
+    return _caption_cache_instance
+
+
+def get_feature_cache():
+    """
+    Get singleton instance của FeatureCache (None nếu tắt trong config)
+    """
+    global _feature_cache_instance
+    if not FEATURE_CACHE_CONFIG["enabled"]:
+        return None
+    if _feature_cache_instance is None:
+        _feature_cache_instance = FeatureCache()
+        logger.info(f"Feature cache enabled (max_bytes={_feature_cache_instance.max_bytes})")
+    return _feature_cache_instance
+
+
+def get_decoder_memo():
+    """
+    Get singleton instance của DecoderMemo (None nếu tắt trong config)
+    """
+    global _decoder_memo_instance
+    if not DECODER_MEMO_CONFIG["enabled"]:
+        return None
+    if _decoder_memo_instance is None:
+        _decoder_memo_instance = DecoderMemo()
+        logger.info(
+            f"Decoder memo enabled (top_k={_decoder_memo_instance.top_k}, "
+            f"max_nodes={_decoder_memo_instance.max_nodes})"
+        )
+    return _decoder_memo_instance
@@ -3,14 +3,20 @@ Caption Generator - Sinh chú thích cho ảnh sử dụng LSTM Decoder và Beam
 Thực hiện giải mã chuỗi tuần tự với Beam Search optimization (k=3)
 """
 
+import time
 import numpy as np
 import logging
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 
 # Import config
 import sys
 sys.path.append(str(Path(__file__).parent.parent))
-from config import MODEL_CONFIG, BEAM_SEARCH_CONFIG
+from config import MODEL_CONFIG, BEAM_SEARCH_CONFIG, WARMUP_CONFIG, FEATURE_STORE_CONFIG
+from .batching import get_decode_scheduler, get_encoder_batcher
+from .caching import get_feature_cache, get_decoder_memo, FeatureCache
+from .feature_store import get_feature_store
+from .vocabulary import word_table
 
 logger = logging.getLogger(__name__)
 
@@ -20,9 +26,21 @@ class CaptionGenerator:
     Class để generate caption từ image features sử dụng LSTM Decoder
     """
     
-    def __init__(self, encoder, decoder, word_to_idx, idx_to_word, max_length=None):
+    def __init__(self, encoder, decoder, word_to_idx, idx_to_word, max_length=None,
+                 decode_scheduler=None, encoder_batcher=None, feature_cache=None,
+                 feature_store=None, graph_decoder=None, image_projection=None,
+                 decoder_memo=None):
         self.encoder = encoder
+        # Với decoder đã tách (ModelLoader.split_decoder): decoder là text decoder
+        # [projection, sequence] và image_projection chạy một lần cho mỗi ảnh
         self.decoder = decoder
+        self.image_projection = image_projection
+        self.graph_decoder = graph_decoder
+        self.decode_scheduler = decode_scheduler
+        self.encoder_batcher = encoder_batcher
+        self.feature_cache = feature_cache
+        self.feature_store = feature_store
+        self.decoder_memo = decoder_memo
         self.word_to_idx = word_to_idx
         self.idx_to_word = idx_to_word
         self.max_length = max_length or MODEL_CONFIG["max_length"]
@@ -36,26 +54,241 @@ class CaptionGenerator:
         self.end_token = MODEL_CONFIG["end_token"]
         self.pad_token = MODEL_CONFIG["pad_token"]
         
+        # Bảng id → từ: detokenize một caption = một lần take (id ngoài bảng → '<unk>' ở cuối)
+        output_shape = getattr(decoder, "output_shape", None)
+        self._id_words = word_table(idx_to_word, size=output_shape[-1] if output_shape else 0)
+        self._unknown_id = len(self._id_words) - 1
+        self._end_id = word_to_idx.get(self.end_token, -1)
+        
         logger.info(f"CaptionGenerator initialized with beam_width={self.beam_width}")
     
-    def extract_features(self, image):
+    def extract_features(self, image, feature_key=None):
         """
         Trích xuất đặc trưng từ ảnh sử dụng CNN Encoder
         
         Args:
-            image: Preprocessed image array (1, 299, 299, 3)
+            image: Preprocessed image array (1, 224, 224, 3), có thể None
+                nếu feature_key đã có trong feature store
+            feature_key: Key tùy chọn (vd: đường dẫn ảnh trong corpus);
+                mặc định là hash của ảnh đã preprocess
         
         Returns:
-            numpy array: Image features (1, 8, 8, 2048) hoặc (1, 256) tùy model
+            numpy array: Image features (1, 1280)
+        """
+        return self.extract_features_batch([image], feature_keys=[feature_key])
+    
+    def extract_features_batch(self, images, feature_keys=None):
+        """
+        Trích xuất đặc trưng cho nhiều ảnh với một lần gọi CNN Encoder
+        
+        Ảnh đã có features trong feature cache/store được bỏ qua,
+        chỉ những ảnh còn thiếu mới được stack và chạy qua encoder.
+        
+        Args:
+            images: List ảnh đã preprocess (1, 224, 224, 3) hoặc array (N, 224, 224, 3);
+                phần tử có thể None nếu feature key tương ứng đã có trong store
+            feature_keys: List keys tùy chọn (cùng độ dài với images)
+        
+        Returns:
+            numpy array: Image features (N, 1280)
         """
         try:
-            features = self.encoder.predict(image, verbose=0)
-            logger.info(f"Extracted features shape: {features.shape}")
+            # Batch buffer (N, H, W, 3) từ preprocess_batch → encoder dùng thẳng, không stack lại
+            array = images if isinstance(images, np.ndarray) else None
+            if array is not None:
+                images = [array[i:i + 1] for i in range(array.shape[0])]
+            
+            keys = list(feature_keys) if feature_keys is not None else [None] * len(images)
+            use_keys = self.feature_cache is not None or self.feature_store is not None
+            
+            rows = [None] * len(images)
+            missing = []
+            for i, image in enumerate(images):
+                if image is None and keys[i] is None:
+                    raise ValueError(f"Image {i}: either image or feature_key is required")
+                
+                # Features chỉ phụ thuộc vào ảnh → dùng lại khi đổi method/beam width
+                if keys[i] is None and use_keys:
+                    keys[i] = FeatureCache.make_key(image)
+                
+                features = self._lookup_features(keys[i])
+                if features is not None:
+                    rows[i] = features
+                elif image is None:
+                    raise KeyError(f"Features not found for key: {keys[i]}")
+                else:
+                    missing.append(i)
+            
+            if missing:
+                if array is not None:
+                    batch = array if len(missing) == len(array) else array[missing]
+                else:
+                    batch = np.concatenate([images[i] for i in missing], axis=0)
+                encoded = self._encode(batch)
+                for j, i in enumerate(missing):
+                    rows[i] = encoded[j:j + 1]
+                    self._save_features(keys[i], rows[i])
+            
+            features = np.concatenate(rows, axis=0)
+            logger.info(
+                f"Extracted features shape: {features.shape} "
+                f"({len(missing)} encoded, {len(images) - len(missing)} cached)"
+            )
             return features
         except Exception as e:
             logger.error(f"Error extracting features: {e}")
             raise
     
+    def _lookup_features(self, key):
+        """
+        Tìm features trong feature cache rồi feature store
+        """
+        if key is None:
+            return None
+        
+        if self.feature_cache is not None:
+            features = self.feature_cache.get(key)
+            if features is not None:
+                return features
+        
+        # Features đã lưu trên đĩa (memmap, không chạy encoder)
+        if self.feature_store is not None:
+            return self.feature_store.get(key)
+        
+        return None
+    
+    def _save_features(self, key, features):
+        """
+        Lưu features vừa tính vào feature cache/store
+        """
+        if key is None:
+            return
+        if self.feature_cache is not None:
+            self.feature_cache.put(key, features)
+        if self.feature_store is not None and self.feature_store.writable:
+            self.feature_store.put(key, features)
+    
+    def _encode(self, batch):
+        """
+        Chạy CNN encoder trên batch ảnh (N, 224, 224, 3)
+        """
+        if self.encoder_batcher is not None:
+            # Gộp với ảnh của các request khác
+            return self.encoder_batcher.predict([batch])
+        return self.encoder.predict(batch, verbose=0)
+    
+    def _project_features(self, features):
+        """
+        Chạy nhánh ảnh của decoder đã tách một lần cho cả batch features
+        
+        Args:
+            features: Image features (N, 1280)
+        
+        Returns:
+            numpy array: Projection (N, 256) dùng cho mọi bước giải mã,
+                hoặc features nguyên vẹn nếu decoder không được tách
+        """
+        if self.image_projection is None:
+            return features
+        return self.image_projection.predict(features, verbose=0)
+    
+    def _memo_keys(self, features):
+        """
+        Key của từng ảnh trong decoder memo (None nếu memo tắt)
+        """
+        if self.decoder_memo is None:
+            return None
+        return [self.decoder_memo.make_key(row) for row in features]
+    
+    def _predict_next(self, features, sequences, memo_keys=None):
+        """
+        Dự đoán phân phối từ tiếp theo cho nhiều chuỗi trong một lần gọi decoder
+        
+        Args:
+            features: Image features (1, 1280) dùng chung cho mọi chuỗi,
+                hoặc (len(sequences), 1280) - mỗi chuỗi một hàng
+                (projection (.., 256) nếu decoder đã tách)
+            sequences: List các chuỗi token (bắt đầu bằng <start>),
+                hoặc mảng (num_sequences, max_length) đã pad bằng 0
+            memo_keys: Key ảnh của từng chuỗi trong decoder memo (None = không dùng memo)
+        
+        Returns:
+            numpy array: Word probabilities, shape (len(sequences), vocab_size)
+        """
+        # Pad tất cả chuỗi vào một batch (num_sequences, max_length)
+        if isinstance(sequences, np.ndarray):
+            padded = sequences.astype(np.float32)
+        else:
+            padded = np.zeros((len(sequences), self.max_length), dtype=np.float32)
+            for i, sequence in enumerate(sequences):
+                padded[i, :len(sequence)] = sequence
+        
+        # Tile features để khớp với số chuỗi trong batch
+        if features.shape[0] != len(sequences):
+            features = np.repeat(features[:1], len(sequences), axis=0)
+        
+        if memo_keys is not None and self.decoder_memo is not None:
+            return self._predict_next_memo(features, padded, memo_keys)
+        return self._run_decoder(features, padded)
+    
+    def _run_decoder(self, features, padded):
+        # Gộp với các request khác qua decode scheduler (nếu bật)
+        if self.decode_scheduler is not None:
+            return self.decode_scheduler.predict([features, padded])
+        
+        return self.decoder.predict([features, padded], verbose=0)
+    
+    def _predict_next_memo(self, features, padded, memo_keys):
+        """
+        _predict_next qua decoder memo: chỉ các hàng chưa có trong memo mới chạy decoder
+        
+        Hàng lấy từ memo có xác suất của top-k từ, các từ còn lại = 0
+        (đủ cho argmax và top beam_width của beam search).
+        """
+        memo = self.decoder_memo
+        min_k = self.beam_width
+        
+        # Prefix = input của decoder bỏ padding cuối (cùng input → cùng output)
+        tokens = padded.astype(np.int64)
+        nonzero = tokens != 0
+        ends = np.where(nonzero.any(axis=1), tokens.shape[1] - np.argmax(nonzero[:, ::-1], axis=1), 0)
+        prefixes = [tokens[i, :ends[i]].tolist() for i in range(tokens.shape[0])]
+        
+        cached = [memo.get(key, prefix, min_k) for key, prefix in zip(memo_keys, prefixes)]
+        missing = [i for i, entry in enumerate(cached) if entry is None]
+        if not missing:
+            probs = np.zeros((len(cached), self.decoder.output_shape[-1]), dtype=np.float32)
+        else:
+            predicted = self._run_decoder(features[missing], padded[missing])
+            if len(missing) == len(cached):
+                probs = predicted
+            else:
+                probs = np.zeros((len(cached),) + predicted.shape[1:], dtype=predicted.dtype)
+                probs[missing] = predicted
+            
+            # Lưu top-k của các hàng vừa tính
+            top_k = min(max(memo.top_k, min_k), predicted.shape[1])
+            top_words = np.argpartition(predicted, -top_k, axis=1)[:, -top_k:].astype(np.int32)
+            top_probs = np.take_along_axis(predicted, top_words, axis=1)
+            for j, i in enumerate(missing):
+                memo.put(memo_keys[i], prefixes[i], top_words[j], top_probs[j])
+        
+        for i, entry in enumerate(cached):
+            if entry is not None:
+                words, word_probs = entry
+                probs[i, words] = word_probs
+        return probs
+    
+    def _indices_to_caption(self, sequence):
+        """
+        Chuyển chuỗi indices thành caption (bỏ <start>, dừng ở <end>)
+        """
+        ids = np.asarray(sequence[1:], dtype=np.int64)
+        end = np.flatnonzero(ids == self._end_id)
+        if end.size:
+            ids = ids[:end[0]]
+        return ' '.join(self._id_words[np.minimum(ids, self._unknown_id)])
+    
     def greedy_search(self, features):
         """
         Greedy search - chọn từ có xác suất cao nhất mỗi bước
@@ -69,41 +302,78 @@ class CaptionGenerator:
         """
         logger.info("Generating caption using Greedy Search...")
         
+        caption_text = self.greedy_search_batch(features[:1])[0]
+        logger.info(f"Generated caption: {caption_text}")
+        return caption_text
+    
+    def greedy_search_batch(self, features):
+        """
+        Greedy search cho nhiều ảnh: mỗi bước một lần gọi decoder
+        cho tất cả captions chưa kết thúc
+        
+        Args:
+            features: Image features (N, 1280)
+        
+        Returns:
+            list[str]: N captions
+        """
         try:
-            # Bắt đầu với <start> token
-            caption = [self.word_to_idx.get(self.start_token, 1)]
+            if self.graph_decoder is not None:
+                # Cả vòng lặp chạy trong graph: một lần gọi cho cả batch
+                captions = self.graph_decoder.greedy(features)
+            else:
+                captions = None
+                for captions in self._greedy_steps(features):
+                    pass
+            return [self._indices_to_caption(caption) for caption in captions]
             
-            for _ in range(self.max_length):
-                # Pad sequence to max_length
-                sequence = np.zeros((1, self.max_length))
-                sequence[0, :len(caption)] = caption
-                
-                # Predict next word
-                # Input: [features, sequence]
-                predictions = self.decoder.predict([features, sequence], verbose=0)
-                
+        except Exception as e:
+            logger.error(f"Error in greedy search: {e}")
+            raise
+    
+    def _greedy_steps(self, features):
+        """
+        Generator các bước greedy search, yield captions (list indices) sau mỗi bước
+        
+        Args:
+            features: Image features (N, 1280)
+        """
+        memo_keys = self._memo_keys(features)
+        features = self._project_features(features)
+        
+        # Bắt đầu với <start> token
+        start_idx = self.word_to_idx.get(self.start_token, 1)
+        captions = [[start_idx] for _ in range(features.shape[0])]
+        active = list(range(features.shape[0]))
+        
+        for _ in range(self.max_length):
+            if not active:
+                break
+            
+            # Predict next word cho mọi caption còn đang sinh
+            # Input: [features, sequence]
+            predictions = self._predict_next(
+                features[active],
+                [captions[i] for i in active],
+                memo_keys=[memo_keys[i] for i in active] if memo_keys else None
+            )
+            
+            still_active = []
+            for row, i in enumerate(active):
                 # Get word with highest probability (model outputs [batch, vocab])
-                predicted_idx = np.argmax(predictions[0, :])
-                
-                # Convert index to word
-                predicted_word = self.idx_to_word.get(predicted_idx, '<unk>')
+                predicted_idx = np.argmax(predictions[row, :])
                 
                 # Stop if <end> token
-                if predicted_word == self.end_token:
-                    break
+                if predicted_idx == self._end_id:
+                    continue
                 
-                caption.append(predicted_idx)
+                captions[i].append(predicted_idx)
+                still_active.append(i)
+            active = still_active
             
-            # Convert indices to words
-            caption_words = [self.idx_to_word.get(idx, '<unk>') for idx in caption[1:]]
-            caption_text = ' '.join(caption_words)
-            
-            logger.info(f"Generated caption: {caption_text}")
-            return caption_text
-            
-        except Exception as e:
-            logger.error(f"Error in greedy search: {e}")
-            raise
+            yield captions
+        
+        yield captions
     
     def beam_search(self, features):
         """
@@ -119,114 +389,247 @@ class CaptionGenerator:
         logger.info(f"Generating caption using Beam Search (k={self.beam_width})...")
         
         try:
-            # Initialize với <start> token
-            start_idx = self.word_to_idx.get(self.start_token, 1)
-            logger.info(f"Start token: '{self.start_token}' -> idx={start_idx}")
-            logger.info(f"End token: '{self.end_token}' -> idx={self.word_to_idx.get(self.end_token, 2)}")
-            
-            # Beam: list of (sequence, score)
-            beams = [([start_idx], 0.0)]
-            
-            for step in range(self.max_length):
-                candidates = []
-                
-                for sequence, score in beams:
-                    # Nếu sequence đã kết thúc, giữ nguyên
-                    if sequence[-1] == self.word_to_idx.get(self.end_token, 2):
-                        candidates.append((sequence, score))
-                        continue
-                    
-                    # Pad sequence
-                    padded_seq = np.zeros((1, self.max_length))
-                    padded_seq[0, :len(sequence)] = sequence
-                    
-                    # Predict next word probabilities
-                    predictions = self.decoder.predict([features, padded_seq], verbose=0)
-                    # Model outputs [batch, vocab] not [batch, seq, vocab]
-                    word_probs = predictions[0, :]
-                    
-                    # Get top k words
-                    top_k_indices = np.argsort(word_probs)[-self.beam_width:]
-                    
-                    # Debug: show top predictions on first step
-                    if step == 0 and len(sequence) == 1:
-                        top_5_indices = np.argsort(word_probs)[-5:][::-1]
-                        logger.info(f"Top 5 predictions after start token:")
-                        for i, idx in enumerate(top_5_indices):
-                            word = self.idx_to_word.get(idx, f'<idx_{idx}>')
-                            prob = word_probs[idx]
-                            logger.info(f"  {i+1}. '{word}' (idx={idx}, prob={prob:.4f})")
-                    
-                    # Expand beam
-                    for idx in top_k_indices:
-                        new_sequence = sequence + [idx]
-                        # Log probability
-                        new_score = score + np.log(word_probs[idx] + 1e-10)
-                        candidates.append((new_sequence, new_score))
-                
-                # Sort by score và chọn top k
-                # Apply length penalty: score / (len^alpha)
-                candidates = sorted(
-                    candidates,
-                    key=lambda x: x[1] / (len(x[0]) ** self.alpha),
-                    reverse=True
-                )
-                beams = candidates[:self.beam_width]
-                
-                # Early stopping nếu tất cả beams đã kết thúc
-                if all(seq[-1] == self.word_to_idx.get(self.end_token, 2) 
-                       for seq, _ in beams):
-                    break
+            return self.beam_search_batch(features[:1])[0]
+        except Exception as e:
+            logger.error(f"Error in beam search: {e}")
+            # Fallback to greedy search
+            logger.warning("Falling back to greedy search...")
+            return self.greedy_search(features), []
+    
+    def beam_search_batch(self, features):
+        """
+        Beam Search cho nhiều ảnh: beams còn sống của mọi ảnh được
+        gộp vào một lần gọi decoder mỗi bước
+        
+        Args:
+            features: Image features (N, 1280)
+        
+        Returns:
+            list[tuple]: N phần tử (caption, all_captions)
+        """
+        if self.graph_decoder is not None:
+            # Cả vòng lặp chạy trong graph: một lần gọi cho cả batch
+            all_beams = self.graph_decoder.beam(features)
+        else:
+            state = None
+            for state in self._beam_search_steps(features):
+                pass
+            all_beams = [self._beam_list(state, i) for i in range(features.shape[0])]
+        return [self._format_beams(beams) for beams in all_beams]
+    
+    def _beam_search_steps(self, features):
+        """
+        Generator các bước beam search với beams dạng mảng; beams còn sống của
+        mọi ảnh được gộp vào một lần gọi decoder mỗi bước
+        
+        State (N ảnh, k = beam_width):
+            tokens   (N, k, max_length + 1) int32 - <start> + các từ đã sinh
+            lengths  (N, k) int32 - số token hợp lệ (tính cả <start>)
+            scores   (N, k) float64 - tổng log-prob (-inf = slot trống)
+            finished (N, k) bool - beam đã kết thúc bằng <end>
+        Beams của mỗi ảnh luôn được sắp xếp theo score / len^alpha giảm dần.
+        
+        Args:
+            features: Image features (N, 1280)
+        
+        Yields:
+            tuple: (tokens, lengths, scores, finished) sau mỗi bước
+        """
+        num_images = features.shape[0]
+        k = self.beam_width
+        memo_keys = self._memo_keys(features)
+        features = self._project_features(features)
+        
+        # Initialize với <start> token
+        start_idx = self.word_to_idx.get(self.start_token, 1)
+        end_idx = self.word_to_idx.get(self.end_token, 2)
+        logger.info(f"Start token: '{self.start_token}' -> idx={start_idx}")
+        logger.info(f"End token: '{self.end_token}' -> idx={end_idx}")
+        
+        # Ban đầu mỗi ảnh chỉ có một beam thật (<start>) ở slot 0,
+        # các slot còn lại trống (score -inf, coi như đã kết thúc)
+        tokens = np.zeros((num_images, k, self.max_length + 1), dtype=np.int32)
+        tokens[:, :, 0] = start_idx
+        lengths = np.ones((num_images, k), dtype=np.int32)
+        scores = np.full((num_images, k), -np.inf)
+        scores[:, 0] = 0.0
+        finished = np.ones((num_images, k), dtype=bool)
+        finished[:, 0] = False
+        
+        image_rows = np.arange(num_images)[:, None]
+        
+        for step in range(self.max_length):
+            # Gộp tất cả beams chưa kết thúc (của mọi ảnh) thành một batch
+            # → chỉ một lần gọi decoder cho mỗi bước
+            live_images, live_beams = np.nonzero(~finished)
+            if live_images.size == 0:
+                break
             
-            # Chọn best sequence
-            best_sequence, best_score = beams[0]
+            # Model outputs [batch, vocab] not [batch, seq, vocab]
+            word_probs = self._predict_next(
+                features[live_images],
+                tokens[live_images, live_beams, :self.max_length],
+                memo_keys=[memo_keys[i] for i in live_images] if memo_keys else None
+            )
             
-            logger.info(f"Best sequence indices: {best_sequence}")
-            logger.info(f"Best sequence length: {len(best_sequence)}")
+            # Debug: show top predictions on first step
+            if num_images == 1 and step == 0:
+                logger.info(f"Top 5 predictions after start token:")
+                top_5 = np.argsort(word_probs[0])[-5:][::-1]
+                for rank, idx in enumerate(top_5):
+                    word = self._id_words[min(idx, self._unknown_id)]
+                    logger.info(f"  {rank+1}. '{word}' (idx={idx}, prob={word_probs[0, idx]:.4f})")
             
-            # Convert indices to words (skip <start> và <end>)
-            caption_words = []
-            for idx in best_sequence[1:]:
-                word = self.idx_to_word.get(idx, '<unk>')
-                logger.info(f"  idx={idx} -> word='{word}'")
-                if word == self.end_token:
-                    break
-                caption_words.append(word)
+            # Top k phần mở rộng của mỗi ảnh (N, k): cột = (score, beam nguồn, từ)
+            expand_scores, expand_beams, expand_words = self._top_expansions(
+                word_probs, live_images, live_beams, scores, num_images
+            )
             
-            caption_text = ' '.join(caption_words)
+            # Ứng viên (N, 2k): k beam đã kết thúc (giữ nguyên) + k phần mở rộng tốt nhất.
+            # Mọi beam còn sống của một ảnh có cùng độ dài nên top k phần mở rộng
+            # theo score chứa mọi phần mở rộng có thể lọt vào top k sau length penalty
+            candidate_scores = np.concatenate([np.where(finished, scores, -np.inf), expand_scores], axis=1)
+            candidate_beams = np.concatenate([np.broadcast_to(np.arange(k), (num_images, k)), expand_beams], axis=1)
+            candidate_words = np.concatenate([np.full((num_images, k), -1, dtype=np.int32), expand_words], axis=1)
+            candidate_lengths = lengths[image_rows, candidate_beams] + (candidate_words >= 0)
             
-            logger.info(f"Best caption (score={best_score:.4f}): {caption_text}")
+            # Length penalty: score / (len^alpha), chọn top k của mỗi ảnh trong một lần sort
+            normalized = candidate_scores / (candidate_lengths ** self.alpha)
+            best = np.argsort(-normalized, axis=1, kind='stable')[:, :k]
+            source_beams = np.take_along_axis(candidate_beams, best, axis=1)
+            new_words = np.take_along_axis(candidate_words, best, axis=1)
             
-            # Return top 3 captions nếu muốn
-            all_captions = []
-            for sequence, score in beams[:3]:
-                words = []
-                for idx in sequence[1:]:
-                    word = self.idx_to_word.get(idx, '<unk>')
-                    if word == self.end_token:
-                        break
-                    words.append(word)
-                all_captions.append({
-                    'caption': ' '.join(words),
-                    'score': float(score),
-                    'normalized_score': float(score / (len(sequence) ** self.alpha))
-                })
+            tokens = tokens[image_rows, source_beams]
+            lengths = lengths[image_rows, source_beams]
+            scores = np.take_along_axis(candidate_scores, best, axis=1)
+            was_finished = new_words < 0
             
-            return caption_text, all_captions
+            # Thêm từ mới vào các beam vừa mở rộng
+            appended = ~was_finished
+            append_images, append_beams = np.nonzero(appended)
+            tokens[append_images, append_beams, lengths[appended]] = new_words[appended]
+            lengths = lengths + appended
+            finished = was_finished | (new_words == end_idx) | np.isneginf(scores)
             
-        except Exception as e:
-            logger.error(f"Error in beam search: {e}")
-            # Fallback to greedy search
-            logger.warning("Falling back to greedy search...")
-            return self.greedy_search(features), []
+            yield tokens, lengths, scores, finished
+        
+        yield tokens, lengths, scores, finished
+    
+    def _top_expansions(self, word_probs, live_images, live_beams, scores, num_images):
+        """
+        Top k phần mở rộng (beam sống × từ) của mỗi ảnh theo score + log(prob)
+        
+        Không sort/partition cả (k, vocab): ngưỡng của mỗi ảnh lấy từ từ thứ k
+        của beam sống tốt nhất (cận dưới của score thứ k), rồi chỉ những
+        (beam, từ) vượt ngưỡng mới được tính log-prob và xếp hạng.
+        
+        Returns:
+            tuple: scores (N, k) float64 (-inf nếu không có), beam nguồn (N, k),
+                từ (N, k) - mỗi hàng giảm dần theo score
+        """
+        k = self.beam_width
+        vocab_size = word_probs.shape[1]
+        live_scores = scores[live_images, live_beams]
+        
+        # Beam sống đầu tiên của mỗi ảnh là beam có score cao nhất (beams đã sort)
+        images, first_rows = np.unique(live_images, return_index=True)
+        kth_probs = np.partition(word_probs[first_rows], vocab_size - k, axis=1)[:, vocab_size - k]
+        thresholds = live_scores[first_rows] + np.log(kth_probs.astype(np.float64) + 1e-10)
+        
+        # log(p + 1e-10) >= threshold - score  ⇔  p >= exp(threshold - score) - 1e-10
+        row_thresholds = np.exp(thresholds[np.searchsorted(images, live_images)] - live_scores) - 1e-10
+        rows, words = np.nonzero(word_probs >= (row_thresholds * (1 - 1e-6))[:, None])
+        
+        probs = word_probs[rows, words]
+        candidate_scores = live_scores[rows] + np.log(probs.astype(np.float64) + 1e-10)
+        candidate_images = live_images[rows]
+        
+        # Sort theo (ảnh, score giảm dần, beam, prob tăng dần) - thứ tự như bản cũ khi bằng điểm
+        order = np.lexsort((probs, live_beams[rows], -candidate_scores, candidate_images))
+        sorted_images = candidate_images[order]
+        rank = np.arange(order.size) - np.searchsorted(sorted_images, sorted_images)
+        keep = order[rank < k]
+        keep_rank = rank[rank < k]
+        
+        expand_scores = np.full((num_images, k), -np.inf)
+        expand_beams = np.zeros((num_images, k), dtype=np.int64)
+        expand_words = np.full((num_images, k), -1, dtype=np.int32)
+        keep_images = candidate_images[keep]
+        expand_scores[keep_images, keep_rank] = candidate_scores[keep]
+        expand_beams[keep_images, keep_rank] = live_beams[rows[keep]]
+        expand_words[keep_images, keep_rank] = words[keep]
+        return expand_scores, expand_beams, expand_words
+    
+    def _beam_list(self, state, image_index):
+        """
+        Beams của một ảnh dạng list [(sequence, score), ...] (đã sort, bỏ slot trống)
+        """
+        tokens, lengths, scores, _ = state
+        return [
+            (tokens[image_index, j, :lengths[image_index, j]].tolist(), float(scores[image_index, j]))
+            for j in range(tokens.shape[1])
+            if np.isfinite(scores[image_index, j])
+        ]
+    
+    def _format_beams(self, beams):
+        """
+        Chuyển beams cuối cùng (đã sort) thành (caption, all_captions)
+        """
+        # Chọn best sequence
+        best_sequence, best_score = beams[0]
+        
+        logger.info(f"Best sequence indices: {best_sequence}")
+        logger.info(f"Best sequence length: {len(best_sequence)}")
+        
+        # Convert indices to words (skip <start> và <end>)
+        caption_text = self._indices_to_caption(best_sequence)
+        
+        logger.info(f"Best caption (score={best_score:.4f}): {caption_text}")
+        
+        # Return top 3 captions nếu muốn
+        all_captions = []
+        for sequence, score in beams[:3]:
+            all_captions.append({
+                'caption': self._indices_to_caption(sequence),
+                'score': float(score),
+                'normalized_score': float(score / (len(sequence) ** self.alpha))
+            })
+        
+        return caption_text, all_captions
+    
+    def _decode_session(self):
+        """
+        Đăng ký request với decode scheduler trong lúc giải mã
+        """
+        if self.decode_scheduler is None:
+            return nullcontext()
+        return self.decode_scheduler.session()
+    
+    def _make_result(self, method, caption, all_captions=None):
+        """
+        Đóng gói kết quả theo format của API
+        """
+        if method == 'beam_search':
+            return {
+                'caption': caption,
+                'all_captions': all_captions or [],
+                'method': 'beam_search',
+                'beam_width': self.beam_width
+            }
+        return {
+            'caption': caption,
+            'all_captions': [],
+            'method': 'greedy'
+        }
     
-    def generate_caption(self, image, method='beam_search'):
+    def generate_caption(self, image, method='beam_search', feature_key=None):
         """
         Main function để generate caption
         
         Args:
-            image: Preprocessed image array
+            image: Preprocessed image array (None nếu features có trong store)
             method: 'beam_search' hoặc 'greedy'
+            feature_key: Key tùy chọn cho feature cache/store
         
         Returns:
             dict: {
@@ -241,30 +644,191 @@ class CaptionGenerator:
         
         try:
             # Extract features
-            features = self.extract_features(image)
+            features = self.extract_features(image, feature_key=feature_key)
             
             # Generate caption
+            with self._decode_session():
+                if method == 'beam_search':
+                    caption, all_captions = self.beam_search(features)
+                    return self._make_result('beam_search', caption, all_captions)
+                else:
+                    caption = self.greedy_search(features)
+                    return self._make_result('greedy', caption)
+                
+        except Exception as e:
+            logger.error(f"Error generating caption: {e}")
+            raise
+    
+    def stream_caption(self, image, method='beam_search', feature_key=None):
+        """
+        Generate caption dạng stream: yield caption tạm mỗi khi một bước giải mã
+        làm nó thay đổi (greedy: caption hiện tại, beam search: beam đang dẫn đầu),
+        cuối cùng yield kết quả đầy đủ
+        
+        Args:
+            image: Preprocessed image array
+            method: 'beam_search' hoặc 'greedy'
+            feature_key: Key tùy chọn cho feature cache/store
+        
+        Yields:
+            dict: {'event': 'token', 'step': int, 'caption': str}
+                  rồi {'event': 'result', **kết quả như generate_caption}
+        """
+        features = self.extract_features(image, feature_key=feature_key)[:1]
+        
+        # Đăng ký decode session trong suốt quá trình stream (kể cả khi client đọc chậm:
+        # scheduler chỉ đợi tối đa max_wait_ms); session đóng khi generator kết thúc/bị close()
+        with self._decode_session():
+            step = 0
+            partial = None
             if method == 'beam_search':
-                caption, all_captions = self.beam_search(features)
-                return {
-                    'caption': caption,
-                    'all_captions': all_captions,
-                    'method': 'beam_search',
-                    'beam_width': self.beam_width
-                }
+                state = None
+                for state in self._beam_search_steps(features):
+                    step += 1
+                    tokens, lengths = state[0], state[1]
+                    caption = self._indices_to_caption(tokens[0, 0, :lengths[0, 0]].tolist())
+                    if caption != partial:
+                        partial = caption
+                        yield {'event': 'token', 'step': step, 'caption': caption}
+                caption, all_captions = self._format_beams(self._beam_list(state, 0))
+                yield {'event': 'result', **self._make_result('beam_search', caption, all_captions)}
             else:
-                caption = self.greedy_search(features)
-                return {
-                    'caption': caption,
-                    'all_captions': [],
-                    'method': 'greedy'
-                }
+                captions = None
+                for captions in self._greedy_steps(features):
+                    step += 1
+                    caption = self._indices_to_caption(captions[0])
+                    if caption != partial:
+                        partial = caption
+                        yield {'event': 'token', 'step': step, 'caption': caption}
+                caption = self._indices_to_caption(captions[0])
+                yield {'event': 'result', **self._make_result('greedy', caption)}
+    
+    @contextmanager
+    def _without_caches(self):
+        """
+        Tạm tắt feature cache/store và decoder memo (warmup không ghi dữ liệu giả vào cache)
+        """
+        saved = self.feature_cache, self.feature_store, self.decoder_memo
+        self.feature_cache = self.feature_store = self.decoder_memo = None
+        try:
+            yield
+        finally:
+            self.feature_cache, self.feature_store, self.decoder_memo = saved
+    
+    def warmup(self, batch_sizes=None, methods=None):
+        """
+        Chạy ảnh giả qua extract_features và greedy/beam search ở từng batch size
+        để request thật đầu tiên không phải trả chi phí trace graph/cấp phát bộ nhớ
+        
+        Chỉ gọi trước khi server nhận request (caches bị tắt trong lúc warmup).
+        
+        Args:
+            batch_sizes: List batch sizes (mặc định WARMUP_CONFIG["batch_sizes"])
+            methods: List methods (mặc định WARMUP_CONFIG["methods"])
+        
+        Returns:
+            dict: {batch_size: {'encoder': s, 'greedy': s, 'beam_search': s}}
+        """
+        batch_sizes = batch_sizes or WARMUP_CONFIG["batch_sizes"]
+        methods = methods or WARMUP_CONFIG["methods"]
+        height, width = MODEL_CONFIG["image_size"]
+        rng = np.random.default_rng(0)
+        
+        timings = {}
+        with self._without_caches():
+            for batch_size in batch_sizes:
+                # Ảnh nhiễu (không phải ảnh đen) để caption chạy đủ nhiều bước
+                images = rng.integers(0, 256, (batch_size, height, width, 3), dtype=np.uint8)
+                
+                start = time.perf_counter()
+                features = self.extract_features_batch(images)
+                timings[batch_size] = {'encoder': round(time.perf_counter() - start, 3)}
+                
+                with self._decode_session():
+                    for method in methods:
+                        start = time.perf_counter()
+                        if method == 'beam_search':
+                            self.beam_search_batch(features)
+                        else:
+                            self.greedy_search_batch(features)
+                        timings[batch_size][method] = round(time.perf_counter() - start, 3)
+                
+                logger.info(f"Warmup batch_size={batch_size}: {timings[batch_size]}")
+        return timings
+    
+    def generate_captions_batch(self, images, method='beam_search', feature_keys=None):
+        """
+        Generate caption cho nhiều ảnh: một lần gọi encoder cho cả batch,
+        decoder chạy chung batch cho tất cả ảnh ở mỗi bước
+        
+        Args:
+            images: List ảnh đã preprocess hoặc array (N, 224, 224, 3)
+            method: 'beam_search' hoặc 'greedy'
+            feature_keys: List keys tùy chọn cho feature cache/store
+        
+        Returns:
+            list[dict]: Kết quả cho từng ảnh (cùng format với generate_caption)
+        """
+        logger.info(f"GENERATING CAPTIONS FOR BATCH OF {len(images)} IMAGES")
+        
+        try:
+            features = self.extract_features_batch(images, feature_keys=feature_keys)
+            
+            with self._decode_session():
+                if method == 'beam_search':
+                    try:
+                        decoded = self.beam_search_batch(features)
+                    except Exception as e:
+                        logger.error(f"Error in batched beam search: {e}")
+                        logger.warning("Falling back to greedy search...")
+                        decoded = [(caption, []) for caption in self.greedy_search_batch(features)]
+                    return [
+                        self._make_result('beam_search', caption, all_captions)
+                        for caption, all_captions in decoded
+                    ]
+                else:
+                    return [
+                        self._make_result('greedy', caption)
+                        for caption in self.greedy_search_batch(features)
+                    ]
                 
         except Exception as e:
-            logger.error(f"Error generating caption: {e}")
+            logger.error(f"Error generating captions batch: {e}")
             raise
 
 
+def _keras_inference_models(models):
+    """
+    Encoder/decoder Keras theo INFERENCE_CONFIG (backend, decoder đã tách, graph decoding)
+    
+    Returns:
+        tuple: (encoder, decoder, image_projection, graph_decoder)
+    """
+    # Các modules dùng TensorFlow: import khi tạo generator (sau khi models đã load)
+    from .inference_backend import get_inference_model, with_image_normalization
+    from .graph_decoding import get_graph_decoder
+    
+    encoder = get_inference_model(with_image_normalization(models['encoder']))
+    if models.get('text_decoder') is not None:
+        # Decoder đã tách: nhánh ảnh một lần mỗi ảnh, nhánh text mỗi bước
+        graph_decoder = get_graph_decoder(
+            models['text_decoder'], models['word_to_idx'],
+            image_projection=models['image_projection'],
+            max_length=models['max_length']
+        )
+        return (
+            encoder,
+            get_inference_model(models['text_decoder']),
+            get_inference_model(models['image_projection']),
+            graph_decoder
+        )
+    
+    graph_decoder = get_graph_decoder(
+        models['decoder'], models['word_to_idx'], max_length=models['max_length']
+    )
+    return encoder, get_inference_model(models['decoder']), None, graph_decoder
+
+
 def get_caption_generator(model_loader):
     """
     Factory function để tạo CaptionGenerator
@@ -276,11 +840,28 @@ def get_caption_generator(model_loader):
         CaptionGenerator instance
     """
     models = model_loader.get_models()
+    graph_decoder = None
+    image_projection = None
+    if models.get('quantized_decoder') is not None:
+        # TFLite interpreters (QUANTIZATION_CONFIG) thay cho Keras models - không cần TensorFlow
+        encoder = models['quantized_encoder']
+        decoder = models['quantized_decoder']
+    else:
+        encoder, decoder, image_projection, graph_decoder = _keras_inference_models(models)
     
     return CaptionGenerator(
-        encoder=models['encoder'],
-        decoder=models['decoder'],
+        encoder=encoder,
+        decoder=decoder,
         word_to_idx=models['word_to_idx'],
         idx_to_word=models['idx_to_word'],
-        max_length=models['max_length']
+        max_length=models['max_length'],
+        decode_scheduler=get_decode_scheduler(decoder),
+        encoder_batcher=get_encoder_batcher(encoder),
+        feature_cache=get_feature_cache(),
+        feature_store=get_feature_store(
+            model_loader.encoder_fingerprint() if FEATURE_STORE_CONFIG["enabled"] else None
+        ),
+        graph_decoder=graph_decoder,
+        image_projection=image_projection,
+        decoder_memo=get_decoder_memo()
     )
@@ -0,0 +1,126 @@
+"""
+Executors - Chạy preprocessing và inference ngoài asyncio event loop
+Thread/process pools có giới hạn để event loop (và /health) luôn phản hồi
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+# Import config
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import EXECUTOR_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBusyError(RuntimeError):
+    """
+    Số request đang chờ vượt quá max_pending
+    """
+
+
+class InferenceExecutor:
+    """
+    Quản lý các pool chạy công việc blocking cho API
+
+    - preprocess pool: decode + resize ảnh (thread hoặc process)
+    - inference pool: CNN encoder + LSTM decoder (thread, dùng chung models)
+    """
+
+    def __init__(self, preprocess_workers=None, inference_workers=None,
+                 preprocess_pool=None, max_pending=None):
+        preprocess_workers = preprocess_workers or EXECUTOR_CONFIG["preprocess_workers"]
+        inference_workers = inference_workers or EXECUTOR_CONFIG["inference_workers"]
+        preprocess_pool = preprocess_pool or EXECUTOR_CONFIG["preprocess_pool"]
+        self.max_pending = max_pending or EXECUTOR_CONFIG["max_pending"]
+        self.inference_workers = inference_workers
+
+        if preprocess_pool == "process":
+            self.preprocess_pool = ProcessPoolExecutor(max_workers=preprocess_workers)
+        else:
+            self.preprocess_pool = ThreadPoolExecutor(
+                max_workers=preprocess_workers,
+                thread_name_prefix="preprocess"
+            )
+
+        # Models chỉ load một lần trong process → inference luôn chạy bằng threads
+        self.inference_pool = ThreadPoolExecutor(
+            max_workers=inference_workers,
+            thread_name_prefix="inference"
+        )
+
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        logger.info(
+            f"InferenceExecutor initialized: preprocess={preprocess_pool} x{preprocess_workers}, "
+            f"inference=thread x{inference_workers}, max_pending={self.max_pending}"
+        )
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        Giới hạn số request đang xử lý (admission control)
+
+        Raises:
+            ExecutorBusyError: Khi đã có max_pending request đang chờ
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ExecutorBusyError(
+                    f"Server busy: {self._pending} requests in progress"
+                )
+            self._pending += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def run_preprocess(self, fn, *args, **kwargs):
+        """
+        Chạy hàm preprocessing (decode/resize) trong preprocess pool
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.preprocess_pool, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def run_inference(self, fn, *args, **kwargs):
+        """
+        Chạy hàm inference (encoder + decoder) trong inference pool
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.inference_pool, functools.partial(fn, *args, **kwargs)
+        )
+
+    def shutdown(self, wait=True):
+        """
+        Đóng các pools
+        """
+        self.preprocess_pool.shutdown(wait=wait)
+        self.inference_pool.shutdown(wait=wait)
+
+
+# Singleton instance
+_inference_executor_instance = None
+
+def get_inference_executor():
+    """
+    Get singleton instance của InferenceExecutor
+    """
+    global _inference_executor_instance
+    if _inference_executor_instance is None:
+        _inference_executor_instance = InferenceExecutor()
+    return _inference_executor_instance
@@ -0,0 +1,272 @@
+"""
+Feature Store - Lưu image features (1280,) xuống đĩa, đọc lại bằng memory-map
+Chạy EfficientNetB0 một lần cho cả corpus; re-caption chỉ tốn thời gian decoder
+"""
+
+import os
+import json
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có file lock giữa processes
+    fcntl = None
+
+import numpy as np
+
+# Import config
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import MODEL_CONFIG, FEATURE_STORE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16  # blake2b digest size của mỗi key trong index
+
+
+class FeatureStore:
+    """
+    Append-only feature store trên đĩa, dùng chung được giữa nhiều processes
+    (prefork workers, caption_cli) cùng ghi
+
+    Cấu trúc thư mục:
+        meta.json     - dim, dtype, encoder (fingerprint của encoder đã tính features)
+        features.npy  - ma trận (capacity, dim) dạng .npy, mở bằng memmap
+        keys.bin      - index: KEY_BYTES bytes/hàng, hàng i ↔ features[i]
+        store.lock    - file lock (fcntl.flock) giữa các processes
+
+    Số hàng hợp lệ = kích thước keys.bin / KEY_BYTES, nên một hàng chỉ
+    "tồn tại" sau khi features đã được ghi xong. Mọi lần ghi giữ lock exclusive
+    và đọc lại keys.bin + features.npy (có thể đã được process khác ghi thêm /
+    grow) trước khi chọn hàng; đọc lại index khi miss dưới lock shared.
+    """
+
+    def __init__(self, path, dim=None, dtype=None, initial_capacity=None, writable=True,
+                 encoder_fingerprint=None):
+        """
+        Args:
+            path: Thư mục chứa store
+            dim: Số chiều features (mặc định MODEL_CONFIG["feature_shape"])
+            dtype: 'float32' hoặc 'float16'
+            initial_capacity: Số hàng cấp phát ban đầu
+            writable: False để mở read-only
+            encoder_fingerprint: Fingerprint của encoder đang dùng
+                (ModelLoader.encoder_fingerprint); khác với fingerprint trong meta.json
+                → ValueError (features của encoder khác không được dùng lại)
+        """
+        self.path = Path(path)
+        self.writable = writable
+        self._lock = threading.Lock()
+        self._features_path = self.path / "features.npy"
+        self._keys_path = self.path / "keys.bin"
+        self._lock_path = self.path / "store.lock"
+
+        meta_path = self.path / "meta.json"
+        if not meta_path.exists() and not writable:
+            raise FileNotFoundError(f"Feature store not found: {self.path}")
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        with self._file_lock(exclusive=not meta_path.exists()):
+            if meta_path.exists():
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            else:
+                meta = {
+                    "dim": dim or MODEL_CONFIG["feature_shape"][0],
+                    "dtype": np.dtype(dtype or FEATURE_STORE_CONFIG["dtype"]).name,
+                    "encoder": encoder_fingerprint,
+                }
+                with open(meta_path, "w") as f:
+                    json.dump(meta, f)
+
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+            self.encoder_fingerprint = meta.get("encoder")
+            if encoder_fingerprint is not None and self.encoder_fingerprint != encoder_fingerprint:
+                raise ValueError(
+                    f"Feature store {self.path} was built by encoder {self.encoder_fingerprint}, "
+                    f"current encoder is {encoder_fingerprint}"
+                )
+
+            if not self._features_path.exists():
+                capacity = initial_capacity or FEATURE_STORE_CONFIG["initial_capacity"]
+                np.lib.format.open_memmap(
+                    self._features_path, mode="w+", dtype=self.dtype, shape=(capacity, self.dim)
+                ).flush()
+                self._keys_path.touch()
+
+            self._matrix = None
+            self._matrix_inode = None
+            self._index = {}
+            self._keys_read = 0
+            self._sync()
+
+        logger.info(
+            f"Feature store opened at {self.path}: {len(self._index)} vectors, "
+            f"dim={self.dim}, dtype={self.dtype.name}, encoder={self.encoder_fingerprint}"
+        )
+
+    @staticmethod
+    def digest(key):
+        """
+        Chuyển key (str) thành digest cố định KEY_BYTES bytes
+        """
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """
+        Lock giữa các processes (flock trên store.lock); không có fcntl (Windows)
+        → chỉ an toàn với một process ghi
+        """
+        if fcntl is None or (not exclusive and not self._lock_path.exists()):
+            yield
+            return
+        with open(self._lock_path, "a+b" if exclusive else "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """
+        Đọc lại trạng thái do các processes khác ghi (gọi khi đang giữ file lock):
+        mở lại features.npy nếu đã bị thay (grow), đọc các keys mới append vào keys.bin
+        """
+        inode = os.stat(self._features_path).st_ino
+        if inode != self._matrix_inode:
+            self._matrix = np.load(self._features_path, mmap_mode="r+" if self.writable else "r")
+            self._matrix_inode = inode
+
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._keys_read)
+            raw = f.read()
+        count = min(len(raw) // KEY_BYTES, self._matrix.shape[0] - len(self._index))
+        start = len(self._index)
+        for i in range(count):
+            self._index[raw[i * KEY_BYTES:(i + 1) * KEY_BYTES]] = start + i
+        self._keys_read += count * KEY_BYTES
+
+    def _row(self, digest):
+        """
+        Hàng của digest; miss → đọc lại index (có thể process khác vừa ghi)
+        """
+        row = self._index.get(digest)
+        if row is None:
+            with self._lock, self._file_lock(exclusive=False):
+                self._sync()
+                row = self._index.get(digest)
+        return row
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return self._row(self.digest(key)) is not None
+
+    def get(self, key):
+        """
+        Lấy features theo key
+
+        Returns:
+            numpy array (1, dim) - view trên memmap (zero-copy với float32),
+            hoặc None nếu không có
+        """
+        row = self._row(self.digest(key))
+        if row is None:
+            return None
+        features = self._matrix[row:row + 1]
+        if features.dtype != np.float32:
+            features = features.astype(np.float32)
+        return features
+
+    def put(self, key, features):
+        """
+        Ghi features cho key (bỏ qua nếu key đã có)
+
+        Args:
+            key: str
+            features: numpy array (dim,) hoặc (1, dim)
+        """
+        if not self.writable:
+            raise PermissionError("Feature store is read-only")
+
+        digest = self.digest(key)
+        features = np.asarray(features, dtype=self.dtype).reshape(self.dim)
+
+        with self._lock, self._file_lock(exclusive=True):
+            # Process khác có thể đã ghi thêm hàng / grow file từ lần đọc trước
+            self._sync()
+            if digest in self._index:
+                return
+            row = len(self._index)
+            if row >= self._matrix.shape[0]:
+                self._grow()
+            # Ghi features trước, key sau: key chỉ xuất hiện khi hàng đã đầy đủ
+            self._matrix[row] = features
+            self._matrix.flush()
+            with open(self._keys_path, "ab") as f:
+                f.write(digest)
+            self._index[digest] = row
+            self._keys_read += KEY_BYTES
+
+    def _grow(self):
+        """
+        Tăng gấp đôi capacity: ghi file mới rồi thay thế atomically
+        (đang giữ lock exclusive; processes khác mở lại file ở lần _sync sau)
+        """
+        old = self._matrix
+        capacity = old.shape[0] * 2
+        tmp_path = self._features_path.with_suffix(".npy.tmp")
+        grown = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=self.dtype, shape=(capacity, self.dim)
+        )
+        grown[:old.shape[0]] = old
+        grown.flush()
+        del grown
+        os.replace(tmp_path, self._features_path)
+        self._matrix = np.load(self._features_path, mmap_mode="r+")
+        self._matrix_inode = os.stat(self._features_path).st_ino
+        logger.info(f"Feature store grown to capacity {capacity}")
+
+    def flush(self):
+        """
+        Đẩy dữ liệu memmap xuống đĩa
+        """
+        if self.writable:
+            self._matrix.flush()
+
+
+# Singleton instance
+_feature_store_instance = None
+
+def get_feature_store(encoder_fingerprint=None):
+    """
+    Get singleton instance của FeatureStore (None nếu tắt trong config,
+    hoặc store được tạo bởi encoder khác)
+    
+    Args:
+        encoder_fingerprint: Fingerprint của encoder đang dùng (ModelLoader.encoder_fingerprint)
+    """
+    global _feature_store_instance
+    if not FEATURE_STORE_CONFIG["enabled"]:
+        return None
+    if _feature_store_instance is None:
+        try:
+            _feature_store_instance = FeatureStore(
+                FEATURE_STORE_CONFIG["path"],
+                writable=FEATURE_STORE_CONFIG["writable"],
+                encoder_fingerprint=encoder_fingerprint
+            )
+        except ValueError as e:
+            logger.error(
+                f"Feature store disabled: {e}. Delete it or set FEATURE_STORE_CONFIG['path'] "
+                f"to a new directory"
+            )
+            return None
+    return _feature_store_instance
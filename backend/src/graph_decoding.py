@@ -0,0 +1,260 @@
+"""
+Graph Decoding - Greedy search và Beam search chạy trọn vòng lặp trong một TF graph
+Một caption (hoặc một batch ảnh) = một lần gọi vào runtime, không quay về Python giữa các bước
+"""
+
+import logging
+from pathlib import Path
+
+import tensorflow as tf
+
+# Import config
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import MODEL_CONFIG, BEAM_SEARCH_CONFIG, INFERENCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class GraphDecoder:
+    """
+    Giải mã trong graph bằng tf.while_loop, cho kết quả giống
+    CaptionGenerator.greedy_search_batch / beam_search_batch:
+
+    - Greedy: argmax mỗi bước, chuỗi dừng khi gặp <end> (không thêm <end>)
+    - Beam: top-k mỗi beam, beam đã kết thúc giữ nguyên, chọn top-k theo
+      score / len^alpha (len tính cả <start>), dừng khi mọi beam kết thúc
+    - Score tính bằng float64 như bản NumPy
+    """
+
+    def __init__(self, decoder, start_idx, end_idx, max_length=None,
+                 beam_width=None, alpha=None, jit_compile=False, image_projection=None):
+        """
+        Args:
+            decoder: Keras decoder model ([features, sequence] -> probs),
+                hoặc text decoder ([projection, sequence] -> probs) nếu có image_projection
+            start_idx: Index của <start>
+            end_idx: Index của <end>
+            max_length: Số bước giải mã tối đa (= độ dài input sequence)
+            beam_width: Beam width
+            alpha: Length penalty
+            jit_compile: Biên dịch vòng lặp bằng XLA
+            image_projection: Nhánh ảnh của decoder đã tách (features -> projection),
+                chạy một lần trước vòng lặp
+        """
+        self.decoder = decoder
+        self.image_projection = image_projection
+        self.start_idx = int(start_idx)
+        self.end_idx = int(end_idx)
+        self.max_length = max_length or MODEL_CONFIG["max_length"]
+        self.beam_width = beam_width or BEAM_SEARCH_CONFIG["beam_width"]
+        self.alpha = BEAM_SEARCH_CONFIG["alpha"] if alpha is None else alpha
+
+        self._feature_input = (image_projection or decoder).inputs[0]
+        feature_spec = tf.TensorSpec(
+            shape=(None,) + tuple(self._feature_input.shape[1:]),
+            dtype=self._feature_input.dtype
+        )
+        self._sequence_dtype = decoder.inputs[1].dtype
+
+        self._greedy = tf.function(
+            self._greedy_graph, input_signature=[feature_spec], jit_compile=jit_compile
+        )
+        self._beam = tf.function(
+            self._beam_graph, input_signature=[feature_spec], jit_compile=jit_compile
+        )
+
+    def _project(self, features):
+        if self.image_projection is None:
+            return features
+        return self.image_projection(features, training=False)
+    
+    def _predict(self, features, tokens):
+        """
+        Gọi decoder cho mỗi hàng tokens (rows, max_length + 1);
+        input sequence là max_length cột đầu, phần sau độ dài chuỗi là 0
+        """
+        sequences = tf.cast(tokens[:, :self.max_length], self._sequence_dtype)
+        return self.decoder([features, sequences], training=False)
+
+    def _greedy_graph(self, features):
+        num_images = tf.shape(features)[0]
+        features = self._project(features)
+        width = self.max_length + 1
+
+        tokens = tf.concat([
+            tf.fill([num_images, 1], self.start_idx),
+            tf.zeros([num_images, self.max_length], tf.int32)
+        ], axis=1)
+        lengths = tf.ones([num_images], tf.int32)
+        finished = tf.zeros([num_images], tf.bool)
+
+        def cond(step, tokens, lengths, finished):
+            return tf.logical_and(step < self.max_length, tf.logical_not(tf.reduce_all(finished)))
+
+        def body(step, tokens, lengths, finished):
+            probs = self._predict(features, tokens)
+            predicted = tf.argmax(probs, axis=-1, output_type=tf.int32)
+
+            # Gặp <end> → dừng, không thêm token
+            finished = tf.logical_or(finished, tf.equal(predicted, self.end_idx))
+            append = tf.logical_not(finished)
+
+            position = tf.one_hot(lengths, width, on_value=True, off_value=False)
+            write = tf.logical_and(position, append[:, None])
+            tokens = tf.where(write, predicted[:, None], tokens)
+            lengths = lengths + tf.cast(append, tf.int32)
+            return step + 1, tokens, lengths, finished
+
+        _, tokens, lengths, _ = tf.while_loop(
+            cond, body, [tf.constant(0), tokens, lengths, finished]
+        )
+        return tokens, lengths
+
+    def _beam_graph(self, features):
+        k = self.beam_width
+        num_images = tf.shape(features)[0]
+        rows = num_images * k
+        width = self.max_length + 1
+        neg_inf = tf.constant(-float('inf'), tf.float64)
+
+        # Mỗi ảnh có k slots; ban đầu chỉ slot 0 là beam thật (<start>),
+        # các slot còn lại là beam rỗng (score -inf, coi như đã kết thúc)
+        tokens = tf.concat([
+            tf.fill([rows, 1], self.start_idx),
+            tf.zeros([rows, self.max_length], tf.int32)
+        ], axis=1)
+        lengths = tf.ones([rows], tf.int32)
+        first_slot = tf.tile(tf.range(k) < 1, [num_images])
+        scores = tf.where(first_slot, tf.constant(0.0, tf.float64), neg_inf)
+        finished = tf.logical_not(first_slot)
+        beam_features = tf.repeat(self._project(features), k, axis=0)
+
+        def cond(step, tokens, lengths, scores, finished):
+            return tf.logical_and(step < self.max_length, tf.logical_not(tf.reduce_all(finished)))
+
+        def body(step, tokens, lengths, scores, finished):
+            probs = self._predict(beam_features, tokens)
+
+            # Top-k mỗi beam, xếp tăng dần như np.argsort(...)[-k:]
+            top_probs, top_indices = tf.math.top_k(probs, k=k)
+            top_probs = tf.reverse(top_probs, axis=[1])
+            top_indices = tf.reverse(top_indices, axis=[1])
+
+            # Ứng viên (rows, k): beam đang sống → k phần mở rộng;
+            # beam đã kết thúc → chính nó ở cột 0, các cột còn lại -inf
+            expanded = scores[:, None] + tf.math.log(tf.cast(top_probs, tf.float64) + 1e-10)
+            kept = tf.where(tf.range(k)[None, :] < 1, scores[:, None], neg_inf)
+            candidate_scores = tf.where(finished[:, None], kept, expanded)
+            candidate_lengths = lengths[:, None] + tf.where(finished[:, None], 0, 1)
+
+            normalized = candidate_scores / tf.pow(
+                tf.cast(candidate_lengths, tf.float64), self.alpha
+            )
+
+            # Chọn top-k ứng viên của mỗi ảnh (k*k ứng viên, thứ tự ổn định như sorted())
+            normalized = tf.reshape(normalized, [num_images, k * k])
+            _, best = tf.math.top_k(normalized, k=k)
+            source_beam = best // k
+            source_column = best % k
+
+            image_offset = tf.range(num_images)[:, None] * k
+            source_rows = tf.reshape(source_beam + image_offset, [-1])
+            candidate_ids = tf.reshape(best + image_offset * k, [-1])
+            source_column = tf.reshape(source_column, [-1])
+
+            new_tokens = tf.gather(tokens, source_rows)
+            new_lengths = tf.gather(lengths, source_rows)
+            was_finished = tf.gather(finished, source_rows)
+            new_scores = tf.gather(tf.reshape(candidate_scores, [-1]), candidate_ids)
+            new_words = tf.gather_nd(
+                top_indices, tf.stack([source_rows, source_column], axis=1)
+            )
+
+            # Thêm từ mới vào beam chưa kết thúc
+            append = tf.logical_not(was_finished)
+            position = tf.one_hot(new_lengths, width, on_value=True, off_value=False)
+            write = tf.logical_and(position, append[:, None])
+            new_tokens = tf.where(write, new_words[:, None], new_tokens)
+            new_lengths = new_lengths + tf.cast(append, tf.int32)
+            new_finished = tf.logical_or(
+                was_finished, tf.logical_and(append, tf.equal(new_words, self.end_idx))
+            )
+            return step + 1, new_tokens, new_lengths, new_scores, new_finished
+
+        _, tokens, lengths, scores, _ = tf.while_loop(
+            cond, body, [tf.constant(0), tokens, lengths, scores, finished]
+        )
+        return (
+            tf.reshape(tokens, [num_images, k, width]),
+            tf.reshape(lengths, [num_images, k]),
+            tf.reshape(scores, [num_images, k])
+        )
+
+    def greedy(self, features):
+        """
+        Greedy search cho batch features
+
+        Args:
+            features: numpy array (N, 1280)
+
+        Returns:
+            list[list[int]]: N chuỗi indices (bắt đầu bằng <start>)
+        """
+        tokens, lengths = self._greedy(tf.convert_to_tensor(features, self._feature_input.dtype))
+        tokens, lengths = tokens.numpy(), lengths.numpy()
+        return [tokens[i, :lengths[i]].tolist() for i in range(tokens.shape[0])]
+
+    def beam(self, features):
+        """
+        Beam search cho batch features
+
+        Args:
+            features: numpy array (N, 1280)
+
+        Returns:
+            list: N danh sách beams [(sequence, score), ...] đã sort như beam_search_batch
+        """
+        tokens, lengths, scores = self._beam(
+            tf.convert_to_tensor(features, self._feature_input.dtype)
+        )
+        tokens, lengths, scores = tokens.numpy(), lengths.numpy(), scores.numpy()
+        return [
+            [
+                (tokens[i, j, :lengths[i, j]].tolist(), float(scores[i, j]))
+                for j in range(tokens.shape[1])
+                if scores[i, j] != -float('inf')
+            ]
+            for i in range(tokens.shape[0])
+        ]
+
+
+def get_graph_decoder(decoder, word_to_idx, image_projection=None, max_length=None):
+    """
+    Tạo GraphDecoder nếu INFERENCE_CONFIG["decode_mode"] == "graph"
+
+    Args:
+        decoder: Keras decoder model (chưa bọc), hoặc text decoder nếu đã tách
+        word_to_idx: Mapping từ → index
+        image_projection: Nhánh ảnh của decoder đã tách (hoặc None)
+        max_length: Độ dài sequence của decoder (ModelLoader.max_length)
+
+    Returns:
+        GraphDecoder hoặc None
+    """
+    if decoder is None or INFERENCE_CONFIG["decode_mode"] != "graph":
+        return None
+
+    graph_decoder = GraphDecoder(
+        decoder,
+        start_idx=word_to_idx.get(MODEL_CONFIG["start_token"], 1),
+        end_idx=word_to_idx.get(MODEL_CONFIG["end_token"], 2),
+        max_length=max_length,
+        jit_compile=INFERENCE_CONFIG["jit_compile"],
+        image_projection=image_projection
+    )
+    logger.info(
+        f"Graph decoding enabled (beam_width={graph_decoder.beam_width}, "
+        f"alpha={graph_decoder.alpha}, max_length={graph_decoder.max_length})"
+    )
+    return graph_decoder
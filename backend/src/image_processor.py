@@ -16,6 +16,82 @@ from config import MODEL_CONFIG, PREPROCESSING_CONFIG
 
 logger = logging.getLogger(__name__)
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+# Markers SOFn (kích thước ảnh); C4 (DHT), C8 (JPG), CC (DAC) không phải SOF
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers không có phần length: TEM, RST0-7, SOI
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+def read_image_header(data):
+    """
+    Đọc format + kích thước ảnh chỉ từ header (không decode), dùng được với
+    phần đầu của file đang upload: PNG (IHDR) hoặc JPEG (marker SOFn)
+    
+    Args:
+        data: Bytes đầu của file (có thể chưa đủ)
+    
+    Returns:
+        tuple (format, width, height); (format, None, None) nếu chưa đủ bytes
+        để thấy kích thước; None nếu chưa đủ bytes để nhận ra format
+    
+    Raises:
+        ValueError: Không phải PNG/JPEG hoặc header hỏng
+    """
+    if len(data) < len(PNG_SIGNATURE):
+        if PNG_SIGNATURE.startswith(bytes(data)) or JPEG_SIGNATURE.startswith(bytes(data[:3])):
+            return None
+        raise ValueError("Unsupported image format")
+    
+    if data[:8] == PNG_SIGNATURE:
+        if len(data) < 24:
+            return 'PNG', None, None
+        if data[12:16] != b'IHDR':
+            raise ValueError("Corrupt PNG header")
+        return 'PNG', int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    
+    if data[:3] == JPEG_SIGNATURE:
+        i = 2
+        while i + 4 <= len(data):
+            if data[i] != 0xFF:
+                raise ValueError("Corrupt JPEG header")
+            marker = data[i + 1]
+            if marker == 0xFF:
+                # Byte đệm giữa các markers
+                i += 1
+                continue
+            if marker in JPEG_STANDALONE_MARKERS:
+                i += 2
+                continue
+            if marker in JPEG_SOF_MARKERS:
+                if i + 9 > len(data):
+                    break
+                height = int.from_bytes(data[i + 5:i + 7], 'big')
+                width = int.from_bytes(data[i + 7:i + 9], 'big')
+                return 'JPEG', width, height
+            if marker == 0xD9 or marker == 0xDA:
+                # EOI / SOS trước SOF: không có kích thước
+                raise ValueError("Corrupt JPEG header")
+            i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+        return 'JPEG', None, None
+    
+    raise ValueError("Unsupported image format")
+
+
+def check_image_pixels(width, height, max_pixels=None):
+    """
+    Chặn ảnh có kích thước 0 hoặc quá nhiều pixels (decompression bomb) trước khi decode
+    
+    Raises:
+        ValueError: Kích thước không hợp lệ / vượt giới hạn
+    """
+    max_pixels = max_pixels or PREPROCESSING_CONFIG["max_image_pixels"]
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid image dimensions: {width}x{height}")
+    if width * height > max_pixels:
+        raise ValueError(f"Image too large: {width}x{height} pixels (max {max_pixels} pixels)")
+
 
 class ImageProcessor:
     """
@@ -25,6 +101,29 @@ class ImageProcessor:
     def __init__(self, image_size=None):
         self.image_size = image_size or MODEL_CONFIG["image_size"]
         self.normalization_type = PREPROCESSING_CONFIG["normalization_type"]
+        self.jpeg_draft = PREPROCESSING_CONFIG.get("jpeg_draft", True)
+    
+    def _open_image(self, source):
+        """
+        Mở + decode ảnh sang RGB. JPEG được decode ở độ phân giải giảm sẵn (DCT scaling
+        1/2, 1/4, 1/8 - draft mode) nhỏ nhất mà vẫn >= image_size, thay vì decode
+        toàn bộ ảnh rồi resize; các format khác decode đầy đủ như cũ
+        
+        Dùng draft mode của PIL thay vì cv2.IMREAD_REDUCED_*: opencv-python có trong
+        requirements.txt nhưng backend không dùng, mọi bước sau (kiểm tra header,
+        resize) đều làm trên PIL.Image nên giữ một đường decode duy nhất
+        
+        Args:
+            source: Path hoặc file object
+        
+        Returns:
+            PIL.Image: Ảnh RGB
+        """
+        img = Image.open(source)
+        check_image_pixels(*img.size)
+        if self.jpeg_draft and img.format == 'JPEG':
+            img.draft('RGB', tuple(self.image_size))
+        return img.convert('RGB')
         
     def load_image_from_path(self, image_path):
         """
@@ -37,7 +136,7 @@ class ImageProcessor:
             PIL.Image: Ảnh đã load
         """
         try:
-            img = Image.open(image_path).convert('RGB')
+            img = self._open_image(image_path)
             logger.info(f"Loaded image from {image_path}, size: {img.size}")
             return img
         except Exception as e:
@@ -55,7 +154,7 @@ class ImageProcessor:
             PIL.Image: Ảnh đã load
         """
         try:
-            img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            img = self._open_image(io.BytesIO(image_bytes))
             logger.info(f"Loaded image from bytes, size: {img.size}")
             return img
         except Exception as e:
@@ -85,6 +184,9 @@ class ImageProcessor:
         Normalize pixel values using EfficientNet's preprocess_input
         This ensures EXACT same preprocessing as during training
         
+        Pipeline serving không gọi hàm này: normalization đã nằm trong graph encoder
+        (inference_backend.with_image_normalization)
+        
         Args:
             image_array: numpy array (H, W, 3) với giá trị [0, 255]
         
@@ -114,35 +216,22 @@ class ImageProcessor:
     
     def preprocess_image(self, image):
         """
-        Full preprocessing pipeline:
+        Full preprocessing pipeline cho một ảnh:
         1. Resize
-        2. Convert to array
-        3. Normalize
-        4. Add batch dimension
+        2. Convert to array uint8
+        3. Add batch dimension
+        
+        Normalization (EfficientNet preprocess_input) chạy trong graph của encoder
+        (inference_backend.with_image_normalization) nên ảnh giữ nguyên pixels uint8
         
         Args:
             image: PIL.Image hoặc numpy array
         
         Returns:
-            numpy array: Ảnh đã preprocess, shape (1, 299, 299, 3)
+            numpy array: Ảnh đã preprocess, shape (1, 224, 224, 3) uint8
         """
         try:
-            # Nếu input là PIL Image
-            if isinstance(image, Image.Image):
-                # Resize
-                image = self.resize_image(image)
-                # Convert to array
-                image_array = np.array(image)
-            else:
-                # Nếu đã là numpy array
-                image_array = image
-            
-            # Normalize
-            normalized = self.normalize_image(image_array.astype(np.float32))
-            
-            # Add batch dimension: (299, 299, 3) -> (1, 299, 299, 3)
-            batched = np.expand_dims(normalized, axis=0)
-            
+            batched = self.preprocess_batch([image])
             logger.info(f"Preprocessed image shape: {batched.shape}")
             return batched
             
@@ -150,6 +239,58 @@ class ImageProcessor:
             logger.error(f"Error in preprocessing pipeline: {e}")
             raise
     
+    def preprocess_batch(self, images, out=None, errors=None):
+        """
+        Preprocess nhiều ảnh vào một buffer uint8 (N, 224, 224, 3) cấp phát sẵn:
+        mỗi ảnh được decode + resize rồi copy thẳng vào hàng của nó
+        
+        Args:
+            images: List ảnh - PIL.Image, bytes, đường dẫn hoặc numpy array (H, W, 3) / (1, H, W, 3)
+            out: Buffer uint8 (>= N, H, W, 3) để ghi vào (mặc định cấp phát mới)
+            errors: Dict index → exception (tùy chọn). Nếu có, ảnh lỗi được ghi vào đây
+                thay vì raise, và các ảnh còn lại được ghi liền nhau theo thứ tự
+        
+        Returns:
+            numpy array: out[:số ảnh thành công]
+        """
+        width, height = self.image_size
+        if out is None:
+            out = np.empty((len(images), height, width, 3), dtype=np.uint8)
+        elif out.dtype != np.uint8 or out.shape[1:] != (height, width, 3) or len(out) < len(images):
+            raise ValueError(f"Buffer shape {out.shape} ({out.dtype}) cannot hold {len(images)} images")
+        
+        row = 0
+        for i, image in enumerate(images):
+            try:
+                self._write_row(image, out[row])
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors[i] = e
+                continue
+            row += 1
+        return out[:row]
+    
+    def _write_row(self, image, row):
+        """
+        Decode + resize một ảnh và ghi vào row (H, W, 3) của batch buffer
+        """
+        width, height = self.image_size
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = self.load_image_from_bytes(bytes(image))
+        elif isinstance(image, (str, Path)):
+            image = self.load_image_from_path(image)
+        
+        if isinstance(image, Image.Image):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            if image.size != (width, height):
+                image = self.resize_image(image)
+            row[...] = np.asarray(image)
+        else:
+            # Numpy array đã đúng kích thước
+            row[...] = np.reshape(image, (height, width, 3))
+    
     def preprocess_from_path(self, image_path):
         """
         Load và preprocess ảnh từ path
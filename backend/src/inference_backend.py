@@ -0,0 +1,130 @@
+"""
+Inference Backend - Chạy encoder/decoder qua tf.function thay vì Keras predict()
+Keras predict() tạo data adapter + callback loop mỗi lần gọi; ở batch size nhỏ
+phần overhead này lớn hơn cả thời gian chạy graph
+"""
+
+import logging
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+# Import config
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import INFERENCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledModel:
+    """
+    Bọc Keras model trong tf.function với input signature cố định
+
+    - Trace một lần (batch dimension = None) → không retrace theo batch size
+    - jit_compile=True: biên dịch bằng XLA; batch được pad lên lũy thừa của 2
+      để XLA chỉ biên dịch một số ít shapes
+    - predict(inputs, verbose=0) trả về numpy array như Keras predict()
+    """
+
+    def __init__(self, model, jit_compile=False):
+        """
+        Args:
+            model: Keras model đã load
+            jit_compile: Bật XLA JIT compilation
+        """
+        self.model = model
+        self.jit_compile = jit_compile
+
+        self._single_input = not isinstance(model.input, (list, tuple))
+        self.input_signature = [
+            tf.TensorSpec(shape=(None,) + tuple(tensor.shape[1:]), dtype=tensor.dtype)
+            for tensor in model.inputs
+        ]
+        self._dtypes = [spec.dtype.as_numpy_dtype for spec in self.input_signature]
+
+        @tf.function(input_signature=self.input_signature, jit_compile=jit_compile)
+        def serve(*inputs):
+            inputs = inputs[0] if self._single_input else list(inputs)
+            return model(inputs, training=False)
+
+        self._serve = serve
+
+    def __getattr__(self, name):
+        # Các thuộc tính khác (inputs, output_shape, ...) lấy từ Keras model
+        return getattr(self.model, name)
+
+    @staticmethod
+    def _bucket(batch_size):
+        return 1 << max(batch_size - 1, 0).bit_length()
+
+    def predict(self, inputs, verbose=0):
+        """
+        Tương đương model.predict(inputs, verbose=0)
+
+        Args:
+            inputs: numpy array hoặc list numpy arrays (theo thứ tự model.inputs)
+
+        Returns:
+            numpy array outputs
+        """
+        if self._single_input and not isinstance(inputs, (list, tuple)):
+            inputs = [inputs]
+        arrays = [np.asarray(x, dtype=dtype) for x, dtype in zip(inputs, self._dtypes)]
+
+        batch_size = arrays[0].shape[0]
+        if self.jit_compile:
+            padded_size = self._bucket(batch_size)
+            if padded_size != batch_size:
+                arrays = [
+                    np.concatenate([x, np.zeros((padded_size - batch_size,) + x.shape[1:], x.dtype)])
+                    for x in arrays
+                ]
+
+        outputs = self._serve(*arrays)
+        if isinstance(outputs, (list, tuple)):
+            return [output.numpy()[:batch_size] for output in outputs]
+        return outputs.numpy()[:batch_size]
+
+
+def with_image_normalization(encoder):
+    """
+    Encoder nhận pixels uint8: cast + EfficientNet preprocess_input chạy trong graph
+    (dùng chung layers/weights với encoder) → host không phải normalize/convert float32
+
+    Args:
+        encoder: Keras CNN encoder (input float32 [0, 255])
+
+    Returns:
+        Keras model: uint8 (N, H, W, 3) -> features
+    """
+    from tensorflow.keras.applications.efficientnet import preprocess_input
+
+    pixels = tf.keras.Input(shape=encoder.input_shape[1:], dtype=tf.uint8, name="pixels")
+    normalized = preprocess_input(tf.cast(pixels, encoder.input.dtype))
+    return tf.keras.Model(pixels, encoder(normalized, training=False), name=f"{encoder.name}_uint8")
+
+
+def get_inference_model(model):
+    """
+    Bọc model theo INFERENCE_CONFIG["backend"]
+
+    Args:
+        model: Keras model (hoặc None)
+
+    Returns:
+        Model có phương thức predict(): Keras model gốc ("keras")
+        hoặc CompiledModel ("compiled")
+    """
+    if model is None or INFERENCE_CONFIG["backend"] == "keras":
+        return model
+    if INFERENCE_CONFIG["backend"] != "compiled":
+        raise ValueError(f"Unknown inference backend: {INFERENCE_CONFIG['backend']}")
+
+    compiled = CompiledModel(model, jit_compile=INFERENCE_CONFIG["jit_compile"])
+    logger.info(
+        f"Compiled inference backend for {model.name} "
+        f"(jit_compile={compiled.jit_compile}, signature={compiled.input_signature})"
+    )
+    return compiled
@@ -1,23 +1,28 @@
 """
 Model Loader - Load pre-trained LSTM-CNN models and tokenizer
 Tải và quản lý các model đã huấn luyện vào bộ nhớ
+
+TensorFlow/Keras chỉ được import khi load models (không phải khi import module)
+→ API server bắt đầu listen ngay, models load trong background
 """
 
-import pickle
+import json
+import time
+import hashlib
+import threading
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras.models import load_model, Model
-from tensorflow.keras.applications import EfficientNetB0
-from tensorflow.keras.applications.efficientnet import preprocess_input as efficientnet_preprocess
-from tensorflow.keras.preprocessing.sequence import pad_sequences
 import logging
+from contextlib import contextmanager
 from pathlib import Path
 
 # Import config
 import sys
 sys.path.append(str(Path(__file__).parent.parent))
-from config import MODEL_CONFIG, MODEL_FILES, PREPROCESSING_CONFIG
+from config import (
+    MODEL_CONFIG, MODEL_FILES, PREPROCESSING_CONFIG, QUANTIZATION_CONFIG,
+    INFERENCE_CONFIG, SNAPSHOT_CONFIG
+)
+from .model_registry import get_model_registry
 
 logger = logging.getLogger(__name__)
 
@@ -27,15 +32,70 @@ class ModelLoader:
     Class để load và quản lý models cho Image Captioning
     """
     
-    def __init__(self):
+    def __init__(self, registry=None):
+        """
+        Args:
+            registry: ModelRegistry (mặc định singleton) - mỗi file model chỉ load một lần
+        """
+        self.registry = registry or get_model_registry()
         self.encoder = None
         self.decoder = None
         self.full_model = None
+        self.image_projection = None
+        self.text_decoder = None
+        self.quantized_encoder = None
+        self.quantized_decoder = None
         self.tokenizer = None
+        self.vocabulary = None
         self.word_to_idx = None
         self.idx_to_word = None
         self.max_length = MODEL_CONFIG["max_length"]
         self.image_size = MODEL_CONFIG["image_size"]
+        self.snapshot_dir = None
+        self._encoder_fingerprint = None
+        self._loaded_models = None
+        
+        # Tiến trình load của từng component (cho readiness probe)
+        components = ["tensorflow", "tokenizer", "encoder", "decoder", "full_model"]
+        if QUANTIZATION_CONFIG["enabled"]:
+            components.append("quantized_models")
+        self.load_status = {name: {"status": "pending"} for name in components}
+        self._status_lock = threading.Lock()
+    
+    @contextmanager
+    def _track(self, component):
+        """
+        Ghi trạng thái loading → ready/failed (kèm thời gian) của một component
+        """
+        start = time.perf_counter()
+        with self._status_lock:
+            self.load_status[component] = {"status": "loading"}
+        try:
+            yield
+        except Exception as e:
+            with self._status_lock:
+                self.load_status[component] = {
+                    "status": "failed",
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "error": str(e)
+                }
+            raise
+        with self._status_lock:
+            self.load_status[component] = {
+                "status": "ready",
+                "seconds": round(time.perf_counter() - start, 3)
+            }
+    
+    def _skip(self, component, reason):
+        with self._status_lock:
+            self.load_status[component] = {"status": "skipped", "reason": reason}
+    
+    def get_load_status(self):
+        """
+        Snapshot trạng thái load của các components
+        """
+        with self._status_lock:
+            return {name: dict(status) for name, status in self.load_status.items()}
         
     def load_cnn_encoder(self, custom_weights_path=None):
         """
@@ -48,20 +108,22 @@ class ModelLoader:
             Model: CNN encoder model
         """
         logger.info("Loading CNN Encoder (EfficientNetB0)...")
+        from tensorflow.keras.models import load_model
+        from tensorflow.keras.applications import EfficientNetB0
         
         try:
             if custom_weights_path and Path(custom_weights_path).exists():
                 # Load custom encoder
-                self.encoder = load_model(custom_weights_path)
+                self.encoder = self.registry.load("encoder", custom_weights_path, load_model)
                 logger.info(f"Loaded custom encoder from {custom_weights_path}")
             else:
                 # Load pretrained EfficientNetB0 với average pooling
                 # Output shape: (batch, 1280) - matches training code
-                self.encoder = EfficientNetB0(
+                self.encoder = self.registry.register("encoder", EfficientNetB0(
                     weights='imagenet',
                     include_top=False,
                     pooling='avg'  # Global average pooling → (1280,)
-                )
+                ))
                 logger.info("Loaded EfficientNetB0 encoder from ImageNet weights")
             
             logger.info(f"Encoder output shape: {self.encoder.output_shape}")
@@ -82,13 +144,14 @@ class ModelLoader:
             Model: LSTM decoder model
         """
         logger.info(f"Loading LSTM Decoder from {decoder_path}...")
+        import tensorflow as tf
         
         try:
             if Path(decoder_path).exists():
                 # Load model directly - no custom objects needed with no_mask version
-                self.decoder = tf.keras.models.load_model(
-                    decoder_path,
-                    compile=False
+                self.decoder = self.registry.load(
+                    "decoder", decoder_path,
+                    lambda path: tf.keras.models.load_model(path, compile=False)
                 )
                 
                 logger.info(f"✓ LSTM decoder loaded successfully")
@@ -103,6 +166,94 @@ class ModelLoader:
             logger.error(f"Error loading LSTM decoder: {e}")
             raise
     
+    def split_decoder(self, decoder=None):
+        """
+        Tách decoder [features, sequence] -> probs thành hai model dùng chung layers/weights:
+        - image_projection: features -> projection (nhánh chỉ phụ thuộc vào ảnh,
+          ví dụ Dropout + Dense(256)), chạy một lần cho mỗi ảnh
+        - text_decoder: [projection, sequence] -> probs, chạy ở mỗi bước giải mã
+        
+        Điểm cắt là tensor duy nhất của nhánh ảnh được đưa vào layer gộp với nhánh text.
+        
+        Args:
+            decoder: Keras decoder model (mặc định self.decoder)
+        
+        Returns:
+            tuple: (image_projection, text_decoder) hoặc None nếu không tách được
+        """
+        decoder = decoder or self.decoder
+        if decoder is None or len(decoder.inputs) != 2:
+            return None
+        
+        # Dựa vào graph nội bộ của Keras → lỗi bất kỳ thì giữ decoder gốc
+        try:
+            split = self._build_split_decoder(decoder)
+        except Exception as e:
+            logger.warning(f"Decoder not split, using unsplit decoder: {e}")
+            return None
+        if split is None:
+            return None
+        
+        image_projection, text_decoder = split
+        self.image_projection, self.text_decoder = image_projection, text_decoder
+        logger.info(
+            f"✓ Decoder split: image projection {tuple(image_projection.output_shape)} "
+            f"({image_projection.count_params()} params, once per image) + "
+            f"text decoder ({text_decoder.count_params()} params, every step)"
+        )
+        return self.image_projection, self.text_decoder
+    
+    def _build_split_decoder(self, decoder):
+        """
+        Tạo (image_projection, text_decoder) và kiểm tra chúng tái tạo đúng output decoder
+        
+        Returns:
+            tuple hoặc None nếu không tách được / không qua bước kiểm tra
+        """
+        import tensorflow as tf
+        from tensorflow.keras.models import Model
+        feature_input, sequence_input = decoder.inputs
+        
+        # Duyệt graph từ input ra output: tensor nào chỉ phụ thuộc vào features
+        image_only = {feature_input.ref()}
+        boundary = {}
+        for depth in sorted(decoder._nodes_by_depth, reverse=True):
+            for node in decoder._nodes_by_depth[depth]:
+                inputs = node.keras_inputs
+                if not inputs:
+                    continue
+                if all(tensor.ref() in image_only for tensor in inputs):
+                    image_only.update(tensor.ref() for tensor in tf.nest.flatten(node.outputs))
+                else:
+                    boundary.update(
+                        (tensor.ref(), tensor) for tensor in inputs if tensor.ref() in image_only
+                    )
+        
+        if len(boundary) != 1:
+            logger.info(f"Decoder not split: image branch has {len(boundary)} merge points")
+            return None
+        projection = next(iter(boundary.values()))
+        if projection is feature_input:
+            logger.info("Decoder not split: features are merged without projection")
+            return None
+        
+        image_projection = Model(feature_input, projection, name=f"{decoder.name}_image_projection")
+        text_decoder = Model([projection, sequence_input], decoder.output, name=f"{decoder.name}_text")
+        
+        # Kiểm tra hai model ghép lại cho cùng output với decoder gốc
+        rng = np.random.default_rng(0)
+        features = rng.random((2,) + tuple(feature_input.shape[1:])).astype(np.float32)
+        sequences = np.zeros((2,) + tuple(sequence_input.shape[1:]), dtype=np.float32)
+        sequences[:, 0] = self.word_to_idx.get(MODEL_CONFIG["start_token"], 1) if self.word_to_idx else 1
+        expected = decoder([features, sequences], training=False).numpy()
+        actual = text_decoder(
+            [image_projection(features, training=False), sequences], training=False
+        ).numpy()
+        if not np.allclose(expected, actual, rtol=1e-4, atol=1e-6):
+            logger.warning("Decoder not split: split models do not reproduce decoder output")
+            return None
+        return image_projection, text_decoder
+    
     def load_full_model(self, model_path):
         """
         Load full end-to-end model (nếu bạn train như vậy)
@@ -114,22 +265,27 @@ class ModelLoader:
             Model: Full model
         """
         logger.info(f"Loading full model from {model_path}...")
+        import tensorflow as tf
+        from tensorflow.keras.models import load_model
         
         try:
             if Path(model_path).exists():
-                # Load with safe_mode=False to skip unknown layers/ops
-                try:
-                    self.full_model = tf.keras.models.load_model(
-                        model_path,
-                        compile=False,
-                        safe_mode=False
-                    )
-                except Exception as e:
-                    logger.warning(f"Safe mode loading failed: {e}")
-                    logger.info("Trying legacy loading method...")
-                    # Fallback: try loading without safe_mode
-                    self.full_model = load_model(model_path, compile=False)
-                    
+                def load(path):
+                    # Load with safe_mode=False to skip unknown layers/ops
+                    try:
+                        return tf.keras.models.load_model(
+                            path,
+                            compile=False,
+                            safe_mode=False
+                        )
+                    except Exception as e:
+                        logger.warning(f"Safe mode loading failed: {e}")
+                        logger.info("Trying legacy loading method...")
+                        # Fallback: try loading without safe_mode
+                        return load_model(path, compile=False)
+                
+                # Thường cùng file với decoder → registry trả về model đã load
+                self.full_model = self.registry.load("full_model", model_path, load)
                 logger.info("Loaded full model successfully")
                 return self.full_model
             else:
@@ -140,27 +296,27 @@ class ModelLoader:
             logger.error(f"Error loading full model: {e}")
             raise
     
-    def load_tokenizer(self, tokenizer_path):
+    def load_tokenizer(self, tokenizer_path, vocabulary_path=None):
         """
-        Load tokenizer (word <-> index mapping)
+        Load vocabulary (word <-> index mapping) từ file .npz gọn,
+        convert từ tokenizer pickle (không cần Keras) nếu chưa có
         
         Args:
             tokenizer_path: Path đến tokenizer pickle file
+            vocabulary_path: Path đến vocabulary .npz (mặc định MODEL_FILES["vocabulary"])
         
         Returns:
-            Tokenizer object
+            Vocabulary object
         """
-        logger.info(f"Loading tokenizer from {tokenizer_path}...")
+        from .vocabulary import Vocabulary, load_vocabulary
+        
+        vocabulary_path = vocabulary_path or MODEL_FILES.get("vocabulary")
+        logger.info(f"Loading vocabulary from {vocabulary_path} (source: {tokenizer_path})...")
         
         try:
-            if Path(tokenizer_path).exists():
-                with open(tokenizer_path, 'rb') as f:
-                    self.tokenizer = pickle.load(f)
-                
-                # Create word-index mappings
-                self.word_to_idx = self.tokenizer.word_index
-                self.idx_to_word = {v: k for k, v in self.word_to_idx.items()}
-                
+            vocabulary = load_vocabulary(vocabulary_path, tokenizer_path)
+            if vocabulary is not None:
+                self._set_vocabulary(vocabulary)
                 logger.info(f"Tokenizer loaded. Vocabulary size: {len(self.word_to_idx)}")
                 return self.tokenizer
                 
@@ -168,51 +324,421 @@ class ModelLoader:
                 logger.warning(f"Tokenizer file not found: {tokenizer_path}")
                 logger.info("Creating dummy tokenizer for demo purposes")
                 # Create dummy mapping
-                self.word_to_idx = {
+                self._set_vocabulary(Vocabulary.from_word_index({
                     '<pad>': 0, '<start>': 1, '<end>': 2,
                     'a': 3, 'dog': 4, 'cat': 5, 'on': 6, 'the': 7, 'beach': 8
-                }
-                self.idx_to_word = {v: k for k, v in self.word_to_idx.items()}
+                }))
+                self.tokenizer = None
                 return None
                 
         except Exception as e:
             logger.error(f"Error loading tokenizer: {e}")
             raise
     
+    def _set_vocabulary(self, vocabulary):
+        # Vocabulary thay cho Keras Tokenizer: word_to_idx là Mapping, idx_to_word là array id → từ
+        self.tokenizer = self.vocabulary = vocabulary
+        self.word_to_idx = vocabulary
+        self.idx_to_word = vocabulary.words
+    
+    def _calibration_datasets(self, images, decoder_batch_size):
+        """
+        Tạo representative datasets cho int8 calibration
+        
+        Encoder: các ảnh mẫu. Decoder: features của ảnh mẫu + các prefix
+        sinh bởi greedy search của model float32 (phân phối giống lúc serve).
+        """
+        batch = np.concatenate(images, axis=0).astype(np.float32)
+        features = self.encoder.predict(batch, verbose=0).astype(np.float32)
+        
+        start_idx = self.word_to_idx.get(MODEL_CONFIG["start_token"], 1)
+        sequences = np.zeros((len(batch), self.max_length), dtype=np.float32)
+        sequences[:, 0] = start_idx
+        decoder_samples = []
+        for step in range(1, self.max_length):
+            decoder_samples.append([features, sequences.copy()])
+            probs = self.decoder.predict([features, sequences], verbose=0)
+            sequences[:, step] = np.argmax(probs, axis=-1)
+        
+        # Samples theo tên input (input_0, input_1, ...): thứ tự tensors trong
+        # TFLite model không nhất thiết giống thứ tự inputs của Keras model
+        def encoder_dataset():
+            for i in range(len(batch)):
+                yield {"input_0": batch[i:i + 1]}
+        
+        def decoder_dataset():
+            for sample_features, sample_sequences in decoder_samples:
+                for start in range(0, len(batch), decoder_batch_size):
+                    # Chunk cuối lấy vòng lại từ đầu cho đủ batch cố định
+                    rows = np.arange(start, start + decoder_batch_size) % len(batch)
+                    yield {
+                        "input_0": sample_features[rows],
+                        "input_1": sample_sequences[rows]
+                    }
+        
+        return encoder_dataset, decoder_dataset
+    
+    def _quantization_dir(self, mode, decoder_mode):
+        name = mode if decoder_mode == mode else f"{mode}+{decoder_mode}"
+        return Path(QUANTIZATION_CONFIG["output_dir"]) / name
+    
+    def quantize_models(self, mode=None, calibration_images=None, decoder_mode=None):
+        """
+        Convert encoder + decoder sang TFLite đã quantize
+        
+        Args:
+            mode: 'dynamic_int8', 'int8' hoặc 'float16' (mặc định theo config)
+            calibration_images: List ảnh đã preprocess cho int8 calibration
+                (mặc định load từ QUANTIZATION_CONFIG["calibration_dir"])
+            decoder_mode: Mode riêng cho decoder (mặc định xem resolve_decoder_mode)
+        
+        Returns:
+            dict: {'encoder': Path, 'decoder': Path}
+        """
+        import tensorflow as tf
+        from .quantization import convert_to_tflite, load_calibration_images, resolve_decoder_mode
+        
+        mode = mode or QUANTIZATION_CONFIG["mode"]
+        decoder_mode = resolve_decoder_mode(mode, decoder_mode)
+        if self.encoder is None or self.decoder is None:
+            raise RuntimeError("Float models must be loaded before quantization")
+        
+        logger.info(f"Quantizing encoder ({mode}) + decoder ({decoder_mode})...")
+        output_dir = self._quantization_dir(mode, decoder_mode)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        
+        encoder_dataset = decoder_dataset = None
+        if "int8" in (mode, decoder_mode):
+            if calibration_images is None:
+                from .image_processor import get_image_processor
+                calibration_images = load_calibration_images(get_image_processor())
+            if not calibration_images:
+                raise ValueError(
+                    f"int8 quantization needs calibration images in {QUANTIZATION_CONFIG['calibration_dir']}"
+                )
+            encoder_dataset, decoder_dataset = self._calibration_datasets(
+                calibration_images, QUANTIZATION_CONFIG["decoder_batch_size"]
+            )
+        
+        encoder_signature = [tf.TensorSpec((None,) + tuple(self.image_size) + (3,), tf.float32)]
+        # LSTM trong TFLite có state theo batch size → decoder dùng batch cố định
+        decoder_batch_size = QUANTIZATION_CONFIG["decoder_batch_size"]
+        decoder_signature = [
+            tf.TensorSpec((decoder_batch_size,) + tuple(tensor.shape[1:]), tensor.dtype)
+            for tensor in self.decoder.inputs
+        ]
+        
+        paths = {
+            "encoder": output_dir / "encoder.tflite",
+            "decoder": output_dir / "decoder.tflite",
+        }
+        paths["encoder"].write_bytes(
+            convert_to_tflite(self.encoder, encoder_signature, mode, encoder_dataset)
+        )
+        paths["decoder"].write_bytes(
+            convert_to_tflite(self.decoder, decoder_signature, decoder_mode, decoder_dataset)
+        )
+        from .quantization import write_conversion_meta
+        write_conversion_meta(output_dir, self._quantization_meta(mode, decoder_mode))
+        
+        for name, path in paths.items():
+            logger.info(f"✓ Quantized {name}: {path} ({path.stat().st_size / 1e6:.1f} MB)")
+        return paths
+    
+    def _quantization_meta(self, mode, decoder_mode):
+        from .quantization import model_fingerprint
+        encoder_path = MODEL_FILES.get("encoder") or MODEL_FILES.get("feature_extractor")
+        return {
+            "mode": mode,
+            "decoder_mode": decoder_mode,
+            "decoder_batch_size": QUANTIZATION_CONFIG["decoder_batch_size"],
+            "encoder": model_fingerprint(encoder_path) if encoder_path else None,
+            "decoder": model_fingerprint(MODEL_FILES["decoder"]),
+        }
+    
+    def validate_quantization_config(self, mode=None, decoder_mode=None):
+        """
+        Kiểm tra QUANTIZATION_CONFIG (mode, ảnh calibration cho int8) mà không cần load models
+        
+        Returns:
+            tuple: (mode, decoder_mode, needs_conversion)
+        
+        Raises:
+            ValueError: Cấu hình không dùng được (xem quantization.validate_config)
+        """
+        from .quantization import read_conversion_meta, resolve_decoder_mode, validate_config
+        
+        mode = mode or QUANTIZATION_CONFIG["mode"]
+        decoder_mode = resolve_decoder_mode(mode, decoder_mode)
+        needs_conversion = (
+            read_conversion_meta(self._quantization_dir(mode, decoder_mode))
+            != self._quantization_meta(mode, decoder_mode)
+        )
+        validate_config(
+            mode, decoder_mode,
+            needs_conversion=needs_conversion and QUANTIZATION_CONFIG["convert_if_missing"]
+        )
+        return mode, decoder_mode, needs_conversion
+    
+    def load_quantized_models(self, mode=None, decoder_mode=None):
+        """
+        Load encoder + decoder TFLite (convert trước nếu chưa có hoặc model nguồn đã đổi)
+        
+        Returns:
+            tuple: (quantized_encoder, quantized_decoder) - TFLiteModel
+        """
+        from .quantization import TFLiteModel
+        
+        mode, decoder_mode, needs_conversion = self.validate_quantization_config(mode, decoder_mode)
+        output_dir = self._quantization_dir(mode, decoder_mode)
+        
+        if needs_conversion:
+            if not QUANTIZATION_CONFIG["convert_if_missing"]:
+                raise FileNotFoundError(f"Quantized models not found or stale: {output_dir}")
+            self.quantize_models(mode, decoder_mode=decoder_mode)
+        
+        num_threads = QUANTIZATION_CONFIG["num_threads"]
+        self.quantized_encoder = TFLiteModel(output_dir / "encoder.tflite", num_threads)
+        self.quantized_decoder = TFLiteModel(output_dir / "decoder.tflite", num_threads)
+        logger.info(f"✓ Quantized models loaded from {output_dir}")
+        return self.quantized_encoder, self.quantized_decoder
+    
     def load_all_models(self):
         """
         Load tất cả models và tokenizer vào bộ nhớ
         Gọi hàm này khi khởi động API để giảm độ trễ inference
         """
+        # Đã load sẵn (vd: master của serve_prefork load trước khi fork) → dùng lại
+        if self._loaded_models is not None:
+            logger.info("✓ Models already loaded (shared with parent process)")
+            return self._loaded_models
+        
         logger.info("=" * 50)
         logger.info("LOADING ALL MODELS INTO MEMORY")
         logger.info("=" * 50)
         
-        # Load tokenizer trước
-        self.load_tokenizer(MODEL_FILES["tokenizer"])
+        # Lỗi cấu hình quantization báo ngay, trước khi mất thời gian load float models
+        if QUANTIZATION_CONFIG["enabled"]:
+            _, _, needs_conversion = self.validate_quantization_config()
+            if not needs_conversion and QUANTIZATION_CONFIG["skip_float_models"]:
+                self._load_quantized_only()
+                self._loaded_models = {
+                    "encoder": self.quantized_encoder,
+                    "decoder": self.quantized_decoder,
+                    "full_model": None,
+                    "tokenizer": self.tokenizer
+                }
+                return self._loaded_models
         
-        # Load CNN encoder
-        encoder_path = MODEL_FILES.get("encoder") or MODEL_FILES.get("feature_extractor")
-        self.load_cnn_encoder(encoder_path)
+        # Import TensorFlow/Keras (phần lớn thời gian cold start)
+        with self._track("tensorflow"):
+            import tensorflow  # noqa: F401
         
-        # Load LSTM decoder
-        if MODEL_FILES["decoder"].exists():
-            self.load_lstm_decoder(MODEL_FILES["decoder"])
+        # Snapshot (export_snapshot.py) nếu có: nhanh hơn .h5, không cần mạng
+        snapshot_dir = self._find_snapshot() if SNAPSHOT_CONFIG["enabled"] else None
+        if snapshot_dir is not None:
+            self.load_snapshot(snapshot_dir)
+        else:
+            self._load_model_files()
         
-        # Hoặc load full model
-        if MODEL_FILES["full_model"].exists():
-            self.load_full_model(MODEL_FILES["full_model"])
+        # Quantized encoder + decoder cho CPU inference
+        if QUANTIZATION_CONFIG["enabled"]:
+            if self.decoder is not None:
+                with self._track("quantized_models"):
+                    self.load_quantized_models()
+            else:
+                self._skip("quantized_models", "decoder not loaded")
         
         logger.info("=" * 50)
         logger.info("ALL MODELS LOADED SUCCESSFULLY")
         logger.info("=" * 50)
         
-        return {
+        self._loaded_models = {
             "encoder": self.encoder,
             "decoder": self.decoder,
             "full_model": self.full_model,
             "tokenizer": self.tokenizer
         }
+        return self._loaded_models
+    
+    def encoder_fingerprint(self):
+        """
+        Fingerprint của encoder đang dùng để tính features (weights Keras hoặc file
+        .tflite khi quantized) + kích thước ảnh / cách decode JPEG - features trong
+        feature store chỉ dùng lại được với cùng fingerprint
+        
+        Returns:
+            str: 16 ký tự hex (None nếu chưa load encoder)
+        """
+        if self.encoder is None and self.quantized_encoder is None:
+            return None
+        if self._encoder_fingerprint is None:
+            digest = hashlib.sha256()
+            if self.quantized_encoder is not None:
+                digest.update(b"tflite:")
+                digest.update(Path(self.quantized_encoder.model_path).read_bytes())
+            else:
+                for weight in self.encoder.get_weights():
+                    digest.update(str((weight.shape, weight.dtype.str)).encode())
+                    digest.update(np.ascontiguousarray(weight))
+            digest.update(json.dumps({
+                "image_size": list(self.image_size),
+                "jpeg_draft": PREPROCESSING_CONFIG.get("jpeg_draft", True),
+            }, sort_keys=True).encode())
+            self._encoder_fingerprint = digest.hexdigest()[:16]
+        return self._encoder_fingerprint
+    
+    def memory_report(self):
+        """
+        Weight bytes của từng model đã load (model dùng chung chỉ tính một lần)
+        """
+        return self.registry.stats()
+    
+    def _load_quantized_only(self):
+        """
+        Chỉ load vocabulary + TFLite models (file .tflite đã có và còn mới):
+        không import TensorFlow, float weights không nằm trong bộ nhớ
+        """
+        reason = "fresh quantized models, float models not needed"
+        for component in ("tensorflow", "encoder", "decoder", "full_model"):
+            self._skip(component, reason)
+        
+        with self._track("tokenizer"):
+            snapshot_dir = self._find_snapshot() if SNAPSHOT_CONFIG["enabled"] else None
+            if snapshot_dir is not None:
+                from .snapshot import read_manifest, load_vocabulary
+                self._set_vocabulary(load_vocabulary(snapshot_dir, read_manifest(snapshot_dir)))
+                self.snapshot_dir = Path(snapshot_dir)
+            else:
+                self.load_tokenizer(MODEL_FILES["tokenizer"])
+        
+        with self._track("quantized_models"):
+            self.load_quantized_models()
+        # Độ dài sequence lấy từ input của decoder TFLite (như từ Keras decoder)
+        self.max_length = int(self.quantized_decoder.inputs[1].shape[1])
+        logger.info("✓ Serving TFLite models only (TensorFlow not imported)")
+    
+    def _load_model_files(self):
+        """
+        Load tokenizer + encoder + decoder + full model từ các file trong MODEL_FILES
+        """
+        # Load tokenizer trước
+        with self._track("tokenizer"):
+            self.load_tokenizer(MODEL_FILES["tokenizer"])
+        
+        # Load CNN encoder
+        encoder_path = MODEL_FILES.get("encoder") or MODEL_FILES.get("feature_extractor")
+        with self._track("encoder"):
+            self.load_cnn_encoder(encoder_path)
+        
+        # Load LSTM decoder
+        if MODEL_FILES["decoder"].exists():
+            with self._track("decoder"):
+                self.load_lstm_decoder(MODEL_FILES["decoder"])
+                
+                # Tách nhánh ảnh khỏi vòng lặp giải mã
+                if INFERENCE_CONFIG["split_decoder"]:
+                    self.split_decoder()
+        else:
+            self._skip("decoder", f"{MODEL_FILES['decoder']} not found")
+        
+        # Hoặc load full model
+        if MODEL_FILES["full_model"].exists():
+            with self._track("full_model"):
+                self.load_full_model(MODEL_FILES["full_model"])
+        else:
+            self._skip("full_model", f"{MODEL_FILES['full_model']} not found")
+    
+    def _find_snapshot(self):
+        """
+        Snapshot cần load trong SNAPSHOT_CONFIG["dir"] (None nếu chưa export snapshot nào)
+        
+        Khi đã có snapshot thì không quay về load file nguồn (.h5 có thể tải
+        ImageNet weights qua mạng) mà báo lỗi để export lại.
+        
+        Raises:
+            RuntimeError: Snapshot không đọc được, sai format hoặc cũ hơn file nguồn
+        """
+        from .snapshot import find_snapshot, read_manifest, stale_sources
+        
+        try:
+            directory = find_snapshot()
+            if directory is None:
+                return None
+            manifest = read_manifest(directory)
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f"{e} (re-run export_snapshot.py or disable SNAPSHOT_CONFIG)") from e
+        
+        stale = stale_sources(manifest)
+        if stale:
+            raise RuntimeError(
+                f"Snapshot {directory} does not match current {stale} "
+                f"(re-run export_snapshot.py or disable SNAPSHOT_CONFIG)"
+            )
+        return directory
+    
+    def load_snapshot(self, directory):
+        """
+        Load vocabulary + encoder + decoder từ snapshot (không truy cập mạng)
+        
+        Args:
+            directory: Thư mục snapshot (một version)
+        """
+        from .snapshot import read_manifest, load_model, load_vocabulary
+        
+        logger.info(f"Loading snapshot {directory}...")
+        manifest = read_manifest(directory)
+        
+        with self._track("tokenizer"):
+            self._set_vocabulary(load_vocabulary(directory, manifest))
+            self.max_length = manifest["max_length"]
+            logger.info(f"Vocabulary loaded. Vocabulary size: {len(self.word_to_idx)}")
+        
+        with self._track("encoder"):
+            self.encoder = self.registry.register("encoder", load_model(directory, manifest, "encoder"))
+            logger.info(f"Encoder output shape: {self.encoder.output_shape}")
+        
+        if "decoder" in manifest["models"]:
+            with self._track("decoder"):
+                self.decoder = self.registry.register("decoder", load_model(directory, manifest, "decoder"))
+                if INFERENCE_CONFIG["split_decoder"]:
+                    self.split_decoder()
+        else:
+            self._skip("decoder", "not in snapshot")
+        
+        # Full model thường là alias của decoder (cùng file .h5 lúc export)
+        if manifest["aliases"].get("full_model") == "decoder":
+            with self._track("full_model"):
+                self.full_model = self.registry.register("full_model", self.decoder)
+        elif "full_model" in manifest["models"]:
+            with self._track("full_model"):
+                self.full_model = self.registry.register(
+                    "full_model", load_model(directory, manifest, "full_model")
+                )
+        else:
+            self._skip("full_model", "not in snapshot")
+        
+        self.snapshot_dir = Path(directory)
+        logger.info(f"✓ Snapshot {manifest['version']} loaded")
+    
+    def export_snapshot(self, output_dir=None, version=None):
+        """
+        Ghi models đang load (encoder, decoder, full model) + vocabulary thành snapshot mới
+        
+        Returns:
+            Path: Thư mục snapshot
+        """
+        from .snapshot import export_snapshot
+        
+        if self.encoder is None or self.vocabulary is None:
+            raise RuntimeError("Models must be loaded before exporting a snapshot")
+        return export_snapshot(
+            {"encoder": self.encoder, "decoder": self.decoder, "full_model": self.full_model},
+            self.vocabulary,
+            output_dir=output_dir,
+            version=version,
+            max_length=self.max_length
+        )
     
     def get_models(self):
         """
@@ -222,6 +748,10 @@ class ModelLoader:
             "encoder": self.encoder,
             "decoder": self.decoder,
             "full_model": self.full_model,
+            "image_projection": self.image_projection,
+            "text_decoder": self.text_decoder,
+            "quantized_encoder": self.quantized_encoder,
+            "quantized_decoder": self.quantized_decoder,
             "tokenizer": self.tokenizer,
             "word_to_idx": self.word_to_idx,
             "idx_to_word": self.idx_to_word,
@@ -232,12 +762,17 @@ class ModelLoader:
 # Singleton instance
 _model_loader_instance = None
 
-def get_model_loader():
+def get_model_loader(load=True):
     """
     Get singleton instance của ModelLoader
+    
+    Args:
+        load: Load models ngay khi tạo instance; False → caller tự gọi
+            load_all_models() (vd: trong background khi server khởi động)
     """
     global _model_loader_instance
     if _model_loader_instance is None:
         _model_loader_instance = ModelLoader()
-        _model_loader_instance.load_all_models()
+        if load:
+            _model_loader_instance.load_all_models()
     return _model_loader_instance
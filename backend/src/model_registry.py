@@ -0,0 +1,158 @@
+"""
+Model Registry - Mỗi model artifact chỉ load một lần trong process
+Artifacts được nhận diện theo đường dẫn thật + SHA-256 nội dung: hai entries trong
+MODEL_FILES trỏ cùng một file (hoặc hai bản copy giống hệt) dùng chung một model
+"""
+
+import os
+import time
+import hashlib
+import threading
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def weight_bytes(model):
+    """
+    Tổng kích thước weights của Keras model (bytes), không copy dữ liệu
+    """
+    return int(sum(
+        int(np.prod(weight.shape)) * weight.dtype.size
+        for weight in model.weights
+    ))
+
+
+class ModelRegistry:
+    """
+    Registry thread-safe: load(path, loader) trả về model dùng chung
+    cho mọi tên (aliases) trỏ đến cùng nội dung file
+    """
+
+    def __init__(self):
+        self._entries = {}  # key (sha256 hoặc tên) -> entry dict
+        self._aliases = {}  # tên -> key
+        self._hashes = {}   # (realpath, size, mtime_ns) -> sha256
+        self._lock = threading.RLock()
+
+    def content_hash(self, path):
+        """
+        SHA-256 của file, cache theo (realpath, size, mtime) để không đọc lại file
+        """
+        real_path = os.path.realpath(path)
+        stat = os.stat(real_path)
+        signature = (real_path, stat.st_size, stat.st_mtime_ns)
+
+        digest = self._hashes.get(signature)
+        if digest is None:
+            sha256 = hashlib.sha256()
+            with open(real_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha256.update(chunk)
+            digest = self._hashes[signature] = sha256.hexdigest()
+        return digest
+
+    def load(self, name, path, loader):
+        """
+        Load model từ file hoặc trả về model đã load có cùng nội dung
+
+        Args:
+            name: Tên dùng trong báo cáo (vd: 'decoder', 'full_model')
+            path: Đường dẫn file model
+            loader: Hàm loader(path) -> model, chỉ được gọi khi chưa có trong registry
+
+        Returns:
+            Model dùng chung
+        """
+        with self._lock:
+            key = self.content_hash(path)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if name not in entry["aliases"]:
+                    entry["aliases"].append(name)
+                self._aliases[name] = key
+                logger.info(
+                    f"✓ {name}: reusing {Path(entry['path']).name} already loaded as "
+                    f"{entry['aliases'][0]} (sha256 {key[:12]})"
+                )
+                return entry["model"]
+
+            start = time.perf_counter()
+            model = loader(path)
+            if model is None:
+                return None
+            self._add(key, name, model, path=os.path.realpath(path), sha256=key,
+                      load_seconds=time.perf_counter() - start)
+            return model
+
+    def register(self, name, model):
+        """
+        Ghi nhận model không load qua load() (vd: EfficientNetB0 ImageNet, snapshot)
+        để báo cáo bộ nhớ; model đã có thì chỉ thêm alias
+        """
+        with self._lock:
+            # Cùng object đã có trong registry → chỉ thêm alias
+            for key, entry in self._entries.items():
+                if entry["model"] is model:
+                    if name not in entry["aliases"]:
+                        entry["aliases"].append(name)
+                    self._aliases[name] = key
+                    return model
+            self._add(f"name:{name}", name, model, path=None, sha256=None, load_seconds=None)
+            return model
+
+    def _add(self, key, name, model, path, sha256, load_seconds):
+        self._entries[key] = {
+            "model": model,
+            "aliases": [name],
+            "path": path,
+            "sha256": sha256,
+            "weight_bytes": weight_bytes(model),
+            "load_seconds": round(load_seconds, 3) if load_seconds is not None else None,
+        }
+        self._aliases[name] = key
+
+    def get(self, name):
+        """
+        Model đã load theo tên (hoặc None)
+        """
+        with self._lock:
+            key = self._aliases.get(name)
+            return self._entries[key]["model"] if key is not None else None
+
+    def stats(self):
+        """
+        Báo cáo models trong registry: aliases, file, hash và weight bytes
+        (mỗi model chỉ tính một lần dù có nhiều aliases)
+        """
+        with self._lock:
+            models = [
+                {
+                    "aliases": list(entry["aliases"]),
+                    "path": entry["path"],
+                    "sha256": entry["sha256"],
+                    "weight_bytes": entry["weight_bytes"],
+                    "load_seconds": entry["load_seconds"],
+                }
+                for entry in self._entries.values()
+            ]
+        return {
+            "models": models,
+            "total_weight_bytes": sum(model["weight_bytes"] for model in models),
+        }
+
+
+# Singleton instance
+_model_registry_instance = None
+
+def get_model_registry():
+    """
+    Get singleton instance của ModelRegistry
+    """
+    global _model_registry_instance
+    if _model_registry_instance is None:
+        _model_registry_instance = ModelRegistry()
+    return _model_registry_instance
@@ -0,0 +1,293 @@
+"""
+Quantization - Chuyển encoder/decoder sang TFLite (int8 / float16) và chạy bằng interpreter
+Dùng cho CPU-only nodes: weights nhỏ hơn 2-4 lần, kernels int8 nhanh hơn float32
+
+TensorFlow chỉ được import khi convert; TFLiteModel chạy được chỉ với tflite-runtime
+"""
+
+import json
+import threading
+import logging
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+try:
+    # Runtime nhẹ (pip install tflite-runtime), không cần cả TensorFlow khi serve
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    Interpreter = None
+
+# Import config
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import QUANTIZATION_CONFIG
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# dynamic_int8: weights int8, activations float (không cần calibration)
+# int8: weights + activations int8, ranges lấy từ calibration set (input/output vẫn float32)
+# float16: weights float16
+QUANTIZATION_MODES = ("dynamic_int8", "int8", "float16")
+
+# Converter của TF 2.15 treo khi quantize LSTM decoder sang float16
+DECODER_FALLBACK_MODES = {"float16": "dynamic_int8"}
+
+# Shape/dtype của một input (thay cho tf.TensorSpec, không cần TensorFlow)
+TensorInfo = namedtuple("TensorInfo", ["shape", "dtype"])
+
+
+def resolve_decoder_mode(mode, decoder_mode=None):
+    """
+    Mode dùng cho decoder: tham số > QUANTIZATION_CONFIG["decoder_mode"] > theo mode của encoder
+    """
+    return decoder_mode or QUANTIZATION_CONFIG["decoder_mode"] or DECODER_FALLBACK_MODES.get(mode, mode)
+
+
+def validate_config(mode=None, decoder_mode=None, needs_conversion=True):
+    """
+    Kiểm tra QUANTIZATION_CONFIG trước khi load models (lỗi cấu hình báo ngay khi khởi động,
+    không phải sau khi đã load xong float models)
+
+    Args:
+        mode: Mode của encoder (mặc định QUANTIZATION_CONFIG["mode"])
+        decoder_mode: Mode của decoder (mặc định xem resolve_decoder_mode)
+        needs_conversion: Có phải convert không (False nếu file .tflite đã có và còn mới)
+
+    Returns:
+        tuple: (mode, decoder_mode)
+
+    Raises:
+        ValueError: Mode không hợp lệ hoặc int8 nhưng không có ảnh calibration
+    """
+    mode = mode or QUANTIZATION_CONFIG["mode"]
+    decoder_mode = resolve_decoder_mode(mode, decoder_mode)
+    for name in (mode, decoder_mode):
+        if name not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {name}. Allowed: {QUANTIZATION_MODES}")
+
+    if needs_conversion and "int8" in (mode, decoder_mode) and not calibration_paths():
+        raise ValueError(
+            f"QUANTIZATION_CONFIG: int8 needs calibration images ({', '.join(sorted(IMAGE_EXTENSIONS))}) "
+            f"in {QUANTIZATION_CONFIG['calibration_dir']}, none found. "
+            f"Add ~{QUANTIZATION_CONFIG['calibration_samples']} representative images "
+            f"or use mode 'dynamic_int8'"
+        )
+    return mode, decoder_mode
+
+
+def convert_to_tflite(model, input_signature, mode, representative_dataset=None):
+    """
+    Chuyển Keras model sang TFLite flatbuffer đã quantize
+
+    Args:
+        model: Keras model
+        input_signature: List tf.TensorSpec; batch dimension None (resize được lúc chạy)
+            hoặc cố định (bắt buộc với LSTM: state tensors có kích thước theo batch)
+        mode: Một trong QUANTIZATION_MODES
+        representative_dataset: Callable sinh list inputs (bắt buộc với mode "int8")
+
+    Returns:
+        bytes: TFLite model
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}. Allowed: {QUANTIZATION_MODES}")
+    import tensorflow as tf
+
+    single_input = len(input_signature) == 1
+    # Đặt tên inputs theo thứ tự → TFLiteModel sắp xếp lại được input details
+    input_signature = [
+        tf.TensorSpec(spec.shape, spec.dtype, name=f"input_{i}")
+        for i, spec in enumerate(input_signature)
+    ]
+
+    @tf.function(input_signature=input_signature)
+    def serve(*inputs):
+        return model(inputs[0] if single_input else list(inputs), training=False)
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [serve.get_concrete_function()], model
+    )
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        if representative_dataset is None:
+            raise ValueError("int8 quantization requires a calibration dataset")
+        converter.representative_dataset = representative_dataset
+
+    return converter.convert()
+
+
+def calibration_paths(directory=None):
+    """
+    Các file ảnh calibration (sắp theo tên) trong QUANTIZATION_CONFIG["calibration_dir"]
+    """
+    directory = Path(directory or QUANTIZATION_CONFIG["calibration_dir"])
+    if not directory.exists():
+        return []
+    return sorted(path for path in directory.rglob("*") if path.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def load_calibration_images(image_processor, directory=None, limit=None):
+    """
+    Load ảnh calibration đã preprocess từ thư mục mẫu
+
+    Args:
+        image_processor: ImageProcessor instance
+        directory: Thư mục ảnh (mặc định QUANTIZATION_CONFIG["calibration_dir"])
+        limit: Số ảnh tối đa
+
+    Returns:
+        list: Ảnh đã preprocess, mỗi ảnh (1, H, W, 3)
+    """
+    directory = Path(directory or QUANTIZATION_CONFIG["calibration_dir"])
+    limit = limit or QUANTIZATION_CONFIG["calibration_samples"]
+
+    paths = calibration_paths(directory)
+
+    images = []
+    for path in paths[:limit]:
+        try:
+            images.append(image_processor.preprocess_from_path(path).astype(np.float32))
+        except Exception as e:
+            logger.warning(f"Skipping calibration image {path}: {e}")
+
+    logger.info(f"Loaded {len(images)} calibration images from {directory}")
+    return images
+
+
+class TFLiteModel:
+    """
+    Chạy TFLite model với API giống Keras: predict(inputs, verbose=0)
+
+    Interpreter không thread-safe → mỗi thread có interpreters riêng.
+    - Model có batch động: một interpreter cho mỗi batch size
+      (pad lên lũy thừa của 2 để giới hạn số lần resize)
+    - Model có batch cố định (decoder LSTM): input được chia thành các
+      chunks đúng batch size đó (chunk cuối được pad)
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        """
+        Args:
+            model_path: Path đến file .tflite
+            num_threads: Số threads cho mỗi interpreter (None = mặc định)
+        """
+        self.model_path = str(model_path)
+        self.num_threads = num_threads
+        self._local = threading.local()
+
+        interpreter = self._create_interpreter()
+        self._input_details = sorted(interpreter.get_input_details(), key=lambda d: d["name"])
+        self._output_index = interpreter.get_output_details()[0]["index"]
+
+        batch_dim = int(self._input_details[0]["shape_signature"][0])
+        self.fixed_batch_size = batch_dim if batch_dim > 0 else None
+
+        self.inputs = [
+            TensorInfo(shape=(None,) + tuple(detail["shape"][1:]), dtype=np.dtype(detail["dtype"]))
+            for detail in self._input_details
+        ]
+        self.output_shape = (None,) + tuple(interpreter.get_output_details()[0]["shape"][1:])
+
+    def _create_interpreter(self):
+        interpreter_class = Interpreter
+        if interpreter_class is None:
+            # Không có tflite-runtime → dùng interpreter trong TensorFlow
+            import tensorflow as tf
+            interpreter_class = tf.lite.Interpreter
+        return interpreter_class(model_path=self.model_path, num_threads=self.num_threads)
+
+    def _interpreter_for(self, batch_size):
+        interpreters = getattr(self._local, "interpreters", None)
+        if interpreters is None:
+            interpreters = self._local.interpreters = {}
+
+        interpreter = interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = self._create_interpreter()
+            if self.fixed_batch_size is None:
+                for detail in self._input_details:
+                    interpreter.resize_tensor_input(
+                        detail["index"], [batch_size] + list(detail["shape"][1:])
+                    )
+            interpreter.allocate_tensors()
+            interpreters[batch_size] = interpreter
+        return interpreter
+
+    @staticmethod
+    def _bucket(batch_size):
+        return 1 << max(batch_size - 1, 0).bit_length()
+
+    @staticmethod
+    def _pad(x, size):
+        if x.shape[0] == size:
+            return x
+        return np.concatenate([x, np.zeros((size - x.shape[0],) + x.shape[1:], x.dtype)])
+
+    def _invoke(self, interpreter, arrays, size):
+        for detail, x in zip(self._input_details, arrays):
+            interpreter.set_tensor(detail["index"], self._pad(x, size))
+        interpreter.invoke()
+        return interpreter.get_tensor(self._output_index)
+
+    def predict(self, inputs, verbose=0):
+        """
+        Tương đương model.predict(inputs, verbose=0)
+
+        Args:
+            inputs: numpy array hoặc list numpy arrays (theo thứ tự inputs của model)
+
+        Returns:
+            numpy array outputs
+        """
+        if not isinstance(inputs, (list, tuple)):
+            inputs = [inputs]
+        arrays = [
+            np.asarray(x, dtype=detail["dtype"])
+            for detail, x in zip(self._input_details, inputs)
+        ]
+        batch_size = arrays[0].shape[0]
+
+        if self.fixed_batch_size is None:
+            size = self._bucket(batch_size)
+            output = self._invoke(self._interpreter_for(size), arrays, size)
+            return output[:batch_size].copy()
+
+        size = self.fixed_batch_size
+        interpreter = self._interpreter_for(size)
+        outputs = []
+        for start in range(0, batch_size, size):
+            chunk = [x[start:start + size] for x in arrays]
+            rows = chunk[0].shape[0]
+            outputs.append(self._invoke(interpreter, chunk, size)[:rows].copy())
+        return np.concatenate(outputs, axis=0)
+
+
+def model_fingerprint(path):
+    """
+    Fingerprint của model nguồn (kích thước + mtime) → convert lại khi model thay đổi
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return {"file": path.name, "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def read_conversion_meta(directory):
+    meta_path = Path(directory) / "meta.json"
+    if not meta_path.exists():
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def write_conversion_meta(directory, meta):
+    with open(Path(directory) / "meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
@@ -0,0 +1,247 @@
+"""
+Model Snapshot - Encoder + decoder + vocabulary trong một thư mục versioned, không cần mạng
+Mỗi model gồm kiến trúc (JSON) và weights trong một file .npy (memory-mapped khi load),
+không phải parse HDF5 và không tải ImageNet weights lúc khởi động
+
+Cấu trúc:
+    snapshots/
+        LATEST                  # tên version hiện tại
+        <version>/
+            manifest.json       # format, models, aliases, SHA-256 của file nguồn
+            encoder.json        # model.to_json()
+            encoder.weights.npy # uint8, các weights nối tiếp (offset căn 64 bytes)
+            decoder.json
+            decoder.weights.npy
+            vocabulary.npz      # src/vocabulary.py (bảng từ packed + ids sắp theo từ)
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+from pathlib import Path
+
+import numpy as np
+
+# Import config
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import SNAPSHOT_CONFIG, MODEL_CONFIG, MODEL_FILES
+from .vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 3
+ALIGNMENT = 64  # Offset của mỗi weight căn theo 64 bytes → view() không bị lệch
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_weights(model, path):
+    """
+    Ghi toàn bộ weights của model vào một file .npy uint8
+
+    Returns:
+        list: Mô tả từng weight {name, shape, dtype, offset} theo thứ tự get_weights()
+    """
+    arrays = model.get_weights()
+    entries = []
+    offset = 0
+    for variable, array in zip(model.weights, arrays):
+        offset = _align(offset)
+        entries.append({
+            "name": variable.name,
+            "shape": list(array.shape),
+            "dtype": array.dtype.str,
+            "offset": offset,
+        })
+        offset += array.nbytes
+
+    blob = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(max(offset, 1),))
+    for entry, array in zip(entries, arrays):
+        start = entry["offset"]
+        blob[start:start + array.nbytes] = np.ascontiguousarray(array).view(np.uint8).reshape(-1)
+    blob.flush()
+    del blob
+    return entries
+
+
+def read_weights(path, entries):
+    """
+    Đọc weights từ file .npy bằng memory map (không copy trước khi set vào model)
+
+    Returns:
+        list: numpy arrays (read-only views) theo thứ tự get_weights()
+    """
+    blob = np.load(path, mmap_mode="r")
+    arrays = []
+    for entry in entries:
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        start = entry["offset"]
+        arrays.append(
+            blob[start:start + count * dtype.itemsize].view(dtype).reshape(entry["shape"])
+        )
+    return arrays
+
+
+def source_fingerprints():
+    """
+    SHA-256 nội dung của các file model nguồn đang có
+    (copy/touch file không làm snapshot bị coi là cũ, sửa nội dung thì có)
+    """
+    from .model_registry import get_model_registry
+
+    registry = get_model_registry()
+    fingerprints = {}
+    for name in ("encoder", "decoder", "tokenizer"):
+        path = MODEL_FILES.get(name)
+        if path is not None and Path(path).exists():
+            fingerprints[name] = registry.content_hash(path)
+    return fingerprints
+
+
+def export_snapshot(models, vocabulary, output_dir=None, version=None, max_length=None):
+    """
+    Ghi snapshot các models đã load + vocabulary vào thư mục version mới
+
+    Args:
+        models: Dict tên -> Keras model (vd: encoder, decoder, full_model);
+            model trùng object chỉ ghi một lần, các tên còn lại là aliases
+        vocabulary: Vocabulary (hoặc mapping từ → index)
+        output_dir: Thư mục gốc của snapshots (mặc định SNAPSHOT_CONFIG["dir"])
+        version: Tên version (mặc định theo thời gian)
+        max_length: Độ dài sequence của decoder
+
+    Returns:
+        Path: Thư mục snapshot vừa tạo (được ghi vào LATEST)
+    """
+    root = Path(output_dir or SNAPSHOT_CONFIG["dir"])
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    target = root / version
+    if target.exists():
+        raise FileExistsError(f"Snapshot version already exists: {target}")
+
+    # Ghi vào thư mục tạm rồi rename → không bao giờ có snapshot dở dang
+    staging = root / f".{version}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "max_length": max_length or MODEL_CONFIG["max_length"],
+        "sources": source_fingerprints(),
+        "models": {},
+        "aliases": {},
+    }
+
+    written = {}  # id(model) -> tên đã ghi
+    for name, model in models.items():
+        if model is None:
+            continue
+        if id(model) in written:
+            manifest["aliases"][name] = written[id(model)]
+            continue
+
+        (staging / f"{name}.json").write_text(model.to_json())
+        entries = write_weights(model, staging / f"{name}.weights.npy")
+        manifest["models"][name] = {
+            "architecture": f"{name}.json",
+            "weights": f"{name}.weights.npy",
+            "tensors": entries,
+        }
+        written[id(model)] = name
+        logger.info(f"✓ Snapshot {name}: {len(entries)} weights")
+
+    if not isinstance(vocabulary, Vocabulary):
+        vocabulary = Vocabulary.from_word_index(vocabulary)
+    vocabulary.save(staging / "vocabulary.npz")
+    manifest["vocabulary"] = "vocabulary.npz"
+
+    with open(staging / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    staging.rename(target)
+    # LATEST cũng thay bằng rename → server đang khởi động không đọc phải file rỗng
+    latest_tmp = root / f".LATEST.{os.getpid()}.tmp"
+    latest_tmp.write_text(version)
+    os.replace(latest_tmp, root / "LATEST")
+    logger.info(f"✓ Snapshot exported to {target}")
+    return target
+
+
+def find_snapshot(root=None, version=None):
+    """
+    Thư mục snapshot cần load: version chỉ định, hoặc version trong LATEST
+
+    Returns:
+        Path hoặc None nếu không có snapshot nào được chỉ định
+
+    Raises:
+        FileNotFoundError: Version được chỉ định (config hoặc LATEST) nhưng không có manifest
+    """
+    root = Path(root or SNAPSHOT_CONFIG["dir"])
+    version = version or SNAPSHOT_CONFIG["version"]
+    if version is None:
+        latest = root / "LATEST"
+        if not latest.exists():
+            return None
+        version = latest.read_text().strip()
+
+    directory = root / version
+    if not (directory / "manifest.json").exists():
+        raise FileNotFoundError(f"Snapshot version {version!r} not found in {root}")
+    return directory
+
+
+def read_manifest(directory):
+    with open(Path(directory) / "manifest.json") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format')} in {directory}")
+    return manifest
+
+
+def stale_sources(manifest):
+    """
+    Các file nguồn đang có nhưng khác lúc export (snapshot cũ hơn model)
+    File nguồn không có (node air-gapped chỉ có snapshot) không tính là khác
+    """
+    current = source_fingerprints()
+    return [
+        name for name, fingerprint in current.items()
+        if name in manifest["sources"] and manifest["sources"][name] != fingerprint
+    ]
+
+
+def load_model(directory, manifest, name):
+    """
+    Dựng model từ kiến trúc JSON rồi nạp weights memory-mapped
+
+    Args:
+        directory: Thư mục snapshot
+        manifest: Manifest đã đọc
+        name: Tên model (hoặc alias)
+
+    Returns:
+        Keras model
+    """
+    import tensorflow as tf
+
+    name = manifest["aliases"].get(name, name)
+    spec = manifest["models"][name]
+    directory = Path(directory)
+
+    model = tf.keras.models.model_from_json((directory / spec["architecture"]).read_text())
+    model.set_weights(read_weights(directory / spec["weights"], spec["tensors"]))
+    return model
+
+
+def load_vocabulary(directory, manifest):
+    vocabulary, _ = Vocabulary.load(Path(directory) / manifest["vocabulary"])
+    return vocabulary
@@ -0,0 +1,241 @@
+"""
+Vocabulary - Bảng từ gọn thay cho Keras Tokenizer đã pickle
+Lưu dạng .npz: các từ UTF-8 nối liền (data) + offsets theo id + ids sắp theo từ
+→ load không cần Keras, word → id bằng binary search, id → từ bằng một lần take
+"""
+
+import os
+import pickle
+import logging
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_WORD = '<unk>'
+
+
+class Vocabulary(Mapping):
+    """
+    Mapping từ → id (dùng thay cho tokenizer.word_index)
+
+    Attributes:
+        words: numpy object array id → từ (id không có trong vocabulary → '<unk>')
+    """
+
+    def __init__(self, data, offsets, sorted_ids):
+        """
+        Args:
+            data: uint8 array - các từ UTF-8 nối liền theo thứ tự id
+            offsets: int array (max_id + 2,) - từ của id i là data[offsets[i]:offsets[i + 1]]
+            sorted_ids: int array - ids có trong vocabulary, sắp theo từ
+        """
+        data = np.asarray(data, dtype=np.uint8).tobytes()
+        offsets = np.asarray(offsets, dtype=np.int64)
+        self._sorted_ids = np.asarray(sorted_ids, dtype=np.int32)
+
+        bounds = offsets.tolist()
+        words = np.empty(len(bounds) - 1, dtype=object)
+        words[:] = [data[start:end].decode('utf-8') for start, end in zip(bounds, bounds[1:])]
+        missing = np.ones(len(words), dtype=bool)
+        missing[self._sorted_ids] = False
+        words[missing] = UNKNOWN_WORD
+        self.words = words
+        self._sorted_words = words[self._sorted_ids]
+
+    @classmethod
+    def from_word_index(cls, word_index):
+        """
+        Tạo vocabulary từ dict từ → id (vd: Tokenizer.word_index)
+        """
+        size = max(word_index.values(), default=-1) + 1
+        encoded = [b''] * size
+        for word, idx in word_index.items():
+            encoded[idx] = word.encode('utf-8')
+
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        # Python so sánh str theo code point = thứ tự bytes UTF-8
+        sorted_ids = [word_index[word] for word in sorted(word_index)]
+        return cls(data, offsets, sorted_ids)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load vocabulary từ file .npz
+
+        Returns:
+            tuple: (Vocabulary, source) - source là fingerprint của tokenizer.pkl lúc convert
+        """
+        with np.load(path) as archive:
+            vocabulary = cls(archive["data"], archive["offsets"], archive["sorted_ids"])
+            source = str(archive["source"]) if "source" in archive.files else None
+        return vocabulary, source
+
+    def save(self, path, source=None):
+        """
+        Ghi vocabulary ra file .npz (không nén)
+        
+        Ghi vào file tạm cùng thư mục rồi os.replace → process khác (vd: các workers
+        của serve_prefork.py convert cùng lúc) không bao giờ đọc phải file ghi dở
+        """
+        encoded = [word.encode('utf-8') for word in self.words]
+        for idx in np.setdiff1d(np.arange(len(encoded)), self._sorted_ids):
+            encoded[idx] = b''
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in encoded], out=offsets[1:])
+
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    data=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                    offsets=offsets,
+                    sorted_ids=self._sorted_ids,
+                    source=np.array(source or ""),
+                )
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return path
+
+    def __getitem__(self, word):
+        position = np.searchsorted(self._sorted_words, word)
+        if position < len(self._sorted_words) and self._sorted_words[position] == word:
+            return int(self._sorted_ids[position])
+        raise KeyError(word)
+
+    def __contains__(self, word):
+        try:
+            self[word]
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.words[np.sort(self._sorted_ids)].tolist())
+
+    def __len__(self):
+        return len(self._sorted_ids)
+
+    def __repr__(self):
+        return f"Vocabulary({len(self)} words)"
+
+
+def word_table(idx_to_word, size=0):
+    """
+    Bảng id → từ (numpy object array) để detokenize bằng một lần take
+
+    Args:
+        idx_to_word: Vocabulary.words (array) hoặc dict id → từ
+        size: Số ids tối thiểu (vd: số output của decoder)
+
+    Returns:
+        numpy object array; phần tử cuối là '<unk>' (ids ngoài bảng được clip về đó)
+    """
+    if isinstance(idx_to_word, Mapping):
+        length = max(max(idx_to_word, default=-1) + 1, size)
+        table = np.full(length + 1, UNKNOWN_WORD, dtype=object)
+        for idx, word in idx_to_word.items():
+            table[idx] = word
+        return table
+
+    words = np.asarray(idx_to_word, dtype=object)
+    padding = max(size - len(words), 0) + 1
+    return np.concatenate([words, np.full(padding, UNKNOWN_WORD, dtype=object)])
+
+
+class _PickledObject:
+    """
+    Thay thế cho các class Keras khi unpickle (chỉ giữ lại __dict__)
+    """
+
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class _TokenizerUnpickler(pickle.Unpickler):
+    """
+    Unpickler đọc tokenizer.pkl mà không import Keras/TensorFlow
+    """
+
+    KERAS_MODULES = ("keras", "tensorflow", "tf_keras", "keras_preprocessing")
+
+    def find_class(self, module, name):
+        if module.split('.')[0] in self.KERAS_MODULES:
+            return _PickledObject
+        return super().find_class(module, name)
+
+
+def convert_tokenizer(tokenizer_path, output_path=None):
+    """
+    Convert tokenizer.pkl (Keras Tokenizer) thành Vocabulary
+
+    Args:
+        tokenizer_path: Đường dẫn tokenizer.pkl
+        output_path: Ghi vocabulary ra file .npz (nếu có)
+
+    Returns:
+        Vocabulary
+    """
+    with open(tokenizer_path, 'rb') as f:
+        tokenizer = _TokenizerUnpickler(f).load()
+
+    state = tokenizer if isinstance(tokenizer, dict) else vars(tokenizer)
+    word_index = state.get("word_index")
+    if not isinstance(word_index, Mapping):
+        raise ValueError(f"No word_index found in {tokenizer_path}")
+
+    vocabulary = Vocabulary.from_word_index(word_index)
+    if output_path is not None:
+        vocabulary.save(output_path, source_fingerprint(tokenizer_path))
+        logger.info(f"✓ Vocabulary written to {output_path}")
+    return vocabulary
+
+
+def source_fingerprint(path):
+    """
+    Fingerprint (kích thước + mtime) của tokenizer.pkl → convert lại khi file thay đổi
+    """
+    stat = Path(path).stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_vocabulary(vocabulary_path, tokenizer_path=None):
+    """
+    Load vocabulary .npz; convert từ tokenizer.pkl nếu chưa có hoặc tokenizer đã đổi
+
+    Args:
+        vocabulary_path: Đường dẫn file .npz
+        tokenizer_path: Đường dẫn tokenizer.pkl (nguồn để convert)
+
+    Returns:
+        Vocabulary hoặc None nếu không có cả hai file
+    """
+    has_tokenizer = tokenizer_path is not None and Path(tokenizer_path).exists()
+
+    if vocabulary_path is not None and Path(vocabulary_path).exists():
+        vocabulary, source = Vocabulary.load(vocabulary_path)
+        if not has_tokenizer or source == source_fingerprint(tokenizer_path):
+            return vocabulary
+        logger.info(f"{tokenizer_path} changed since {vocabulary_path} was written; converting again")
+
+    if not has_tokenizer:
+        return None
+
+    vocabulary = convert_tokenizer(tokenizer_path)
+    if vocabulary_path is not None:
+        try:
+            vocabulary.save(vocabulary_path, source_fingerprint(tokenizer_path))
+            logger.info(f"✓ Vocabulary converted from {tokenizer_path} to {vocabulary_path}")
+        except OSError as e:
+            logger.warning(f"Could not write {vocabulary_path}: {e}")
+    return vocabulary